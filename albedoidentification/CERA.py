@@ -18,8 +18,12 @@
 """ TMVA imports """
 import ROOT
 import array
+import os
 import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from TreeLoader import TreeLoader
+
 
 """ Tensorflow imports """
 import tensorflow as tf
@@ -85,57 +89,25 @@ class CERA:
     # Step 1: Reading data
     ###################################################################################################
 
-    # Open the file
-    DataFile = ROOT.TFile(self.Filename)
-    if DataFile.IsOpen() == False:
-      print("Error opening data file")
+    # Open the file and get the data tree
+    try:
+      Loader = TreeLoader(self.Filename, "Quality")
+    except IOError as Error:
+      print("Error: {}".format(Error))
       return False
 
-    # Get the data tree
-    DataTree = DataFile.Get("Quality")
-    if DataTree is None:
-      print("Error reading data tree from root file")
-      return False
-
-    # Reading training dataset
-    DataLoader = ROOT.TMVA.DataLoader("Results")
-    Branches = list(DataTree.GetListOfBranches())
-
-    # Create a map of the branches
-    VariableMap = {}
-
-    for B in Branches:
-      if B.GetName() == "EvaluationIsReconstructable":
-        VariableMap[B.GetName()] = array.array('i', [0])
-      else:
-        VariableMap[B.GetName()] = array.array('f', [0])
-      DataTree.SetBranchAddress(B.GetName(), VariableMap[B.GetName()])
-
-
-    AllFeatures = list(VariableMap.keys())
-    AllFeatures.remove("SequenceLength")
-    AllFeatures.remove("SimulationID")
-    AllFeatures.remove("EvaluationZenithAngle")
-    AllFeatures.remove("EvaluationIsCompletelyAbsorbed")
-
     YTarget = "EvaluationIsReconstructable"
-    AllFeatures.remove(YTarget)
-
-    XEventDataBranches = [B for B in Branches
-          if not (B.GetName().startswith("Evaluation") or B.GetName().startswith("SimulationID")
-                  or B.GetName().startswith("SequenceLength"))]
 
-    YResultBranches = [B for B in Branches
-                      if B.GetName().startswith("EvaluationIsReconstructable")]
+    AllFeatures = Loader.selectColumns(Exclude=["SequenceLength", "SimulationID", "EvaluationZenithAngle", "EvaluationIsCompletelyAbsorbed", YTarget])
 
-    print("Eval Reconstructible: ", YResultBranches[0])
+    print("Eval Reconstructible: ", YTarget)
 
     ###################################################################################################
     # Step 2: Input parameters
     ###################################################################################################
 
     # Input parameters
-    TotalData = min(self.MaxEvents, DataTree.GetEntries())
+    TotalData = min(self.MaxEvents, Loader.getNumberOfEntries())
 
     # Ensure TotalData evenly splittable so we can split half into training and half into testing
     if TotalData % 2 == 1:
@@ -155,33 +127,14 @@ class CERA:
     # Step 3: Construct training and testing dataset
     ###################################################################################################
 
-    # Transform data into numpy array
-
-    XTrain = np.zeros((TotalData // 2, len(XEventDataBranches)))
-    XTest = np.zeros((TotalData // 2, len(XEventDataBranches)))
-    YTrain = np.zeros((TotalData // 2, len(YResultBranches)))
-    YTest = np.zeros((TotalData // 2, len(YResultBranches)))
+    # Transform data into numpy array: the features and the target as last column
+    Data = Loader.load(AllFeatures + [YTarget], TotalData)
 
-    for i in range(TotalData):
-      # Print final progress
-      if i == TotalData - 1:
-        print("{}: Progress: {}/{}".format(time.time(), i + 1, TotalData))
-
-      # Display progress throughout
-      elif i % 1000 == 0:
-        print("{}: Progress: {}/{}".format(time.time(), i, TotalData))
-
-      DataTree.GetEntry(i) # ???
-
-      NewRow = [VariableMap[feature][0] for feature in AllFeatures]
-
-      # Split half the X data into training set and half into testing set
-      if i % 2 == 0:
-        XTrain[i // 2] = np.array(NewRow)
-        YTrain[i // 2] = float(VariableMap[YTarget][0])
-      else:
-        XTest[i // 2] = np.array(NewRow)
-        YTest[i // 2] = float(VariableMap[YTarget][0])
+    # Split half the X data into training set and half into testing set
+    XTrain = Data[0::2, :-1]
+    XTest = Data[1::2, :-1]
+    YTrain = Data[0::2, -1:]
+    YTest = Data[1::2, -1:]
 
     print("{}: finish formatting array".format(time.time()))
 
@@ -204,7 +157,7 @@ class CERA:
     # H = tf.contrib.layers.fully_connected(H, 1000)
 
     print("      ... output layer ...")
-    Output = tf.contrib.layers.fully_connected(H, len(YResultBranches), activation_fn=None)
+    Output = tf.contrib.layers.fully_connected(H, YTrain.shape[1], activation_fn=None)
 
     print("      ... loss function ...")
     # Loss function sigmoid cross entropy with logits to be used here because
@@ -18,8 +18,12 @@
 """ TMVA imports """
 import ROOT
 import array
+import os
 import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from TreeLoader import TreeLoader
+
 """ Tensorflow imports """
 import tensorflow as tf
 import numpy as np
@@ -81,73 +85,20 @@ class CEZA:
 
     print("{}: retrieve from ROOT tree".format(time.time()))
 
-    # Open the file
-    DataFile = ROOT.TFile(self.FileName)
-    if DataFile.IsOpen() == False:
-      print("Error opening data file")
-      return False
-
-    # Get the data tree
-    DataTree = DataFile.Get("Quality")
-    if DataTree is None:
-      print("Error reading data tree from root file")
+    # Open the file and get the data tree
+    try:
+      Loader = TreeLoader(self.FileName, "Quality")
+    except IOError as Error:
+      print("Error: {}".format(Error))
       return False
 
-    Branches = DataTree.GetListOfBranches()
+    all_features = Loader.selectColumns(Exclude=["SequenceLength", "SimulationID", "EvaluationIsReconstructable", "EvaluationIsCompletelyAbsorbed", "EvaluationZenithAngle"])
 
-    VariableMap = {}
-
-    # Create a map of the branches, i.e. the columns
-    for B in list(Branches):
-      if B.GetName() == "EvaluationZenithAngle":
-        VariableMap[B.GetName()] = array.array('f', [0])
-      else:
-        VariableMap[B.GetName()] = array.array('f', [0])
-      DataTree.SetBranchAddress(B.GetName(), VariableMap[B.GetName()])
+    # transform data into numpy array: the features and the zenith angle as last column
+    Data = Loader.load(all_features + ["EvaluationZenithAngle"], self.MaxEvents)
 
-    # transform data into numpy array
-
-    total_data = min(self.MaxEvents, DataTree.GetEntries())
-
-    #placeholders
-    X_data = np.zeros((total_data, 40))
-    # if self.Algorithms.startswith("TF:"):
-    #   y_data = np.zeros((total_data, 2))
-    # else:
-    y_data = np.zeros((total_data, 1))
-
-    all_features = list(VariableMap.keys())
-    all_features.remove("SequenceLength")
-    all_features.remove("SimulationID")
-    all_features.remove("EvaluationIsReconstructable")
-    all_features.remove("EvaluationIsCompletelyAbsorbed")
-
-    all_features.remove("EvaluationZenithAngle")
-
-    print("{}: start formatting array".format(time.time()))
-
-    for x in range(total_data):
-
-      if x%1000 == 0 and x > 0:
-        print("{}: Progress: {}/{}".format(time.time(), x, total_data))
-
-      DataTree.GetEntry(x)  # Get row x
-
-      new_row=[VariableMap[feature][0] for feature in all_features]
-      X_data[x]=np.array(new_row)
-
-      if VariableMap["EvaluationZenithAngle"][0] < 90:
-        target = 1.0
-      else:
-        target = 0.0
-
-      #print("{0} vs. {1}".format(target, VariableMap["EvaluationZenithAngle"][0]))
-      
-      # if self.Algorithms.startswith("TF:"):
-      #   y_data[x][0]= target
-      #   y_data[x][1]= 1-target
-      # else:
-      y_data[x]= target
+    X_data = Data[:, :-1]
+    y_data = (Data[:, -1:] < 90).astype(np.float32)
 
     print("{}: finish formatting array".format(time.time()))
 
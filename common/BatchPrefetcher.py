@@ -0,0 +1,160 @@
+###################################################################################################
+#
+# BatchPrefetcher.py
+#
+# Copyright (C) by Andreas Zoglauer.
+# All rights reserved.
+#
+# Please see the file License.txt in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+
+###################################################################################################
+
+
+import time
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+###################################################################################################
+
+
+class BatchPrefetcher:
+  """
+  This class prepares the next batches (e.g. voxelization and labels) in a pool of threads while the
+  current batch is trained. At most QueueDepth batches are prepared ahead, the batches are returned in order.
+  The time the training loop had to wait for a batch (the stall time) shows whether the training is input-bound.
+  numpy releases the GIL in its array operations, thus threads are sufficient and no data needs to be copied.
+  A typical usage would look like this:
+
+  def makeBatch(Index, Slot):
+    return Voxels.densify(Sparse.slice(Index*128, (Index+1)*128), Slot), Labels[Index*128:(Index+1)*128]
+
+  Prefetcher = BatchPrefetcher(makeBatch, NumberOfBatches, NumberOfWorkers=2, QueueDepth=4)
+  for InputTensor, OutputTensor in Prefetcher:
+    model.fit(InputTensor, OutputTensor)
+  print("Stall time: {} sec".format(Prefetcher.StallTime))
+
+  """
+
+
+###################################################################################################
+
+
+  def __init__(self, Producer, NumberOfBatches, NumberOfWorkers = 1, QueueDepth = 2):
+    """
+    The default constructor for class BatchPrefetcher
+
+    Attributes
+    ----------
+    Producer : function
+      Called as Producer(Index, Slot) in a worker thread, returns the batch with the given index.
+      Slot is in [0, NumberOfSlots[ and never used by two batches which are alive at the same time,
+      thus the producer can write each batch into a buffer reused per slot (see Voxelizer.densify)
+    NumberOfBatches : integer
+      The number of batches per iteration
+    NumberOfWorkers : integer
+      The number of threads preparing batches
+    QueueDepth : integer
+      The maximum number of batches prepared ahead of the one currently used
+
+    """
+
+    self.Producer = Producer
+    self.NumberOfBatches = NumberOfBatches
+    self.NumberOfWorkers = max(1, NumberOfWorkers)
+    self.QueueDepth = max(1, QueueDepth)
+
+    # The batches in the queue plus the one currently used
+    self.NumberOfSlots = self.QueueDepth + 1
+
+    # The accumulated time the consumer waited for batches, and the time spent producing them, in seconds
+    self.StallTime = 0.0
+    self.ProductionTime = 0.0
+    self.Lock = threading.Lock()
+
+
+###################################################################################################
+
+
+  def __len__(self):
+    """
+    Return the number of batches per iteration
+    """
+
+    return self.NumberOfBatches
+
+
+###################################################################################################
+
+
+  def produce(self, Index):
+    """
+    Produce one batch and measure the time (called in the worker threads)
+    """
+
+    Timer = time.time()
+    Batch = self.Producer(Index, Index % self.NumberOfSlots)
+    with self.Lock:
+      self.ProductionTime += time.time() - Timer
+
+    return Batch
+
+
+###################################################################################################
+
+
+  def __iter__(self):
+    """
+    Iterate once over all batches, the next ones are prepared while the current one is used
+    """
+
+    Pool = ThreadPoolExecutor(max_workers=self.NumberOfWorkers)
+    Queue = collections.deque()
+
+    try:
+      Next = 0
+      while Next < self.NumberOfBatches and len(Queue) < self.QueueDepth:
+        Queue.append(Pool.submit(self.produce, Next))
+        Next += 1
+
+      while len(Queue) > 0:
+        Timer = time.time()
+        Batch = Queue.popleft().result()
+        self.StallTime += time.time() - Timer
+
+        # The previous batch is no longer used, thus its slot can be reused by the next one
+        if Next < self.NumberOfBatches:
+          Queue.append(Pool.submit(self.produce, Next))
+          Next += 1
+
+        yield Batch
+
+    finally:
+      # The batches not yet started are dropped, the running ones are finished
+      for Future in Queue:
+        Future.cancel()
+      Pool.shutdown(wait=True)
+
+
+###################################################################################################
+
+
+  def printStatistics(self, NumberOfIterations = 1):
+    """
+    Print the stall and production time per iteration
+    """
+
+    NumberOfIterations = max(1, NumberOfIterations)
+
+    print("Total time waiting for batches per Iteration: {} sec".format(self.StallTime/NumberOfIterations))
+    print("Total time preparing batches per Iteration:   {} sec (in {} threads, {} batches ahead)".format(self.ProductionTime/NumberOfIterations, self.NumberOfWorkers, self.QueueDepth))
+
+
+# END
+###################################################################################################
@@ -0,0 +1,335 @@
+###################################################################################################
+#
+# EventBatch.py
+#
+# Copyright (C) by Andreas Zoglauer.
+# All rights reserved.
+#
+# Please see the file License.txt in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+
+###################################################################################################
+
+
+import numpy as np
+
+from EventCache import EventCache, EventCollection, selectEvents, concatenateColumns
+
+
+###################################################################################################
+
+
+class EventBatch:
+  """
+  This class stores many events as one set of arrays (the column layout of the event cache) instead of
+  one EventData object per event: The hits of all events are concatenated in X, Y, Z, E, Type, Origin, ID,
+  the hits of event i are the entries Offsets[i] to Offsets[i+1]. The selections (center, hasHitsOutside,
+  isOriginInside) work on all events at once. A typical usage would look like this:
+
+  Batch = EventBatch.fromCache(EventCache("ComptonTrackIdentification.p1.evc"))
+  Batch.center()
+  Batch = Batch.select(Batch.hasHitsOutside(XMin, XMax, YMin, YMax, ZMin, ZMax) == False)
+  Training = Batch.slice(0, 10000)
+  Testing = Batch.slice(10000, len(Batch))
+
+  """
+
+
+###################################################################################################
+
+
+  def __init__(self, Columns):
+    """
+    The default constructor for class EventBatch
+
+    Attributes
+    ----------
+    Columns : dictionary
+      The columns as returned by EventCollection.get() or EventCache.getColumns(), they are used without copying
+
+    """
+
+    self.Offsets = np.asarray(Columns["Offsets"], dtype="int64")
+    for Column in list(EventCache.HitColumns) + list(EventCache.EventColumns):
+      setattr(self, Column, Columns[Column])
+
+    self.NumberOfEvents = len(self.Offsets) - 1
+    self.NumberOfHits = int(self.Offsets[-1])
+
+
+###################################################################################################
+
+
+  @staticmethod
+  def fromEvents(Events):
+    """
+    Create a batch from a list of event objects (e.g. EventData, see EventCollection.add)
+    """
+
+    Collection = EventCollection()
+    for Event in Events:
+      Collection.add(Event)
+
+    return EventBatch(Collection.get())
+
+
+###################################################################################################
+
+
+  @staticmethod
+  def fromCache(Cache, Begin = 0, End = -1):
+    """
+    Create a batch with an in-memory copy of the events Begin to End (all if negative) of an EventCache.
+    A copy is required since the cache is read-only, but e.g. center() modifies the positions.
+    """
+
+    if End < 0 or End > len(Cache):
+      End = len(Cache)
+
+    return EventBatch({ Column: np.array(Values) for Column, Values in EventBatch(Cache.getColumns()).slice(Begin, End).getColumns().items() })
+
+
+###################################################################################################
+
+
+  @staticmethod
+  def concatenate(Batches):
+    """
+    Concatenate several batches into one
+    """
+
+    return EventBatch(concatenateColumns([ Batch.getColumns() for Batch in Batches ]))
+
+
+###################################################################################################
+
+
+  def __len__(self):
+    """
+    Return the number of events in the batch
+    """
+
+    return self.NumberOfEvents
+
+
+###################################################################################################
+
+
+  def __getitem__(self, Index):
+    """
+    Return a view of the event with the given index, with the same attributes as EventData,
+    or for a slice (without step) the events as a new batch, see slice()
+    """
+
+    if isinstance(Index, slice):
+      Begin, End, Step = Index.indices(self.NumberOfEvents)
+      if Step != 1:
+        raise IndexError("Slices of an EventBatch cannot have a step")
+      return self.slice(Begin, End)
+
+    if Index < 0:
+      Index += self.NumberOfEvents
+    if Index < 0 or Index >= self.NumberOfEvents:
+      raise IndexError("Event index {} out of range [0, {}[".format(Index, self.NumberOfEvents))
+
+    return EventView(self, Index)
+
+
+###################################################################################################
+
+
+  def getColumns(self):
+    """
+    Return all columns as a dictionary (the layout of EventCollection.get())
+    """
+
+    Columns = { "Offsets": self.Offsets }
+    for Column in list(EventCache.HitColumns) + list(EventCache.EventColumns):
+      Columns[Column] = getattr(self, Column)
+
+    return Columns
+
+
+###################################################################################################
+
+
+  def getHits(self, Index):
+    """
+    Return a dictionary with views to all hit columns of the given event (as EventCache.getHits)
+    """
+
+    Begin = self.Offsets[Index]
+    End = self.Offsets[Index+1]
+
+    return { Column: getattr(self, Column)[Begin:End] for Column in EventCache.HitColumns }
+
+
+###################################################################################################
+
+
+  def getNumberOfHits(self):
+    """
+    Return the number of hits of each event
+    """
+
+    return np.diff(self.Offsets)
+
+
+###################################################################################################
+
+
+  def getEventIndices(self):
+    """
+    Return the index of the event each hit belongs to
+    """
+
+    return np.repeat(np.arange(self.NumberOfEvents, dtype="int64"), self.getNumberOfHits())
+
+
+###################################################################################################
+
+
+  def getNumberOfUniqueZ(self):
+    """
+    Return the number of different z positions of the hits of each event (EventData.unique)
+    """
+
+    EventIndices = self.getEventIndices()
+    Order = np.lexsort((self.Z, EventIndices))
+
+    SortedEvents = EventIndices[Order]
+    SortedZ = self.Z[Order]
+
+    IsNew = np.ones(shape=(self.NumberOfHits), dtype=bool)
+    IsNew[1:] = (SortedEvents[1:] != SortedEvents[:-1]) | (SortedZ[1:] != SortedZ[:-1])
+
+    return np.bincount(SortedEvents[IsNew], minlength=self.NumberOfEvents)
+
+
+###################################################################################################
+
+
+  def slice(self, Begin, End):
+    """
+    Return the events Begin to End as a new batch without copying the hits: the batches share the hit
+    arrays, thus e.g. center() on the slice also modifies the hits in this batch
+    """
+
+    Begin = max(0, min(Begin, self.NumberOfEvents))
+    End = max(Begin, min(End, self.NumberOfEvents))
+
+    HitBegin = self.Offsets[Begin]
+    HitEnd = self.Offsets[End]
+
+    Columns = { "Offsets": self.Offsets[Begin:End+1] - self.Offsets[Begin] }
+    for Column in EventCache.HitColumns:
+      Columns[Column] = getattr(self, Column)[HitBegin:HitEnd]
+    for Column in EventCache.EventColumns:
+      Columns[Column] = getattr(self, Column)[Begin:End]
+
+    return EventBatch(Columns)
+
+
+###################################################################################################
+
+
+  def select(self, Selection):
+    """
+    Return a new batch (a copy) with the selected events: Selection is either a boolean mask or a list of indices
+    """
+
+    Selection = np.asarray(Selection)
+    if Selection.dtype == bool:
+      Selection = np.flatnonzero(Selection)
+
+    return EventBatch(selectEvents(self.getColumns(), Selection))
+
+
+###################################################################################################
+
+
+  def center(self):
+    """
+    Move the center of each track to 0/0 (as EventData.center)
+    """
+
+    NumberOfHits = self.getNumberOfHits()
+    Starts = self.Offsets[:-1][NumberOfHits > 0]
+    if len(Starts) == 0:
+      return
+
+    for Column in ["X", "Y"]:
+      Values = getattr(self, Column)
+      Center = 0.5*(np.minimum.reduceat(Values, Starts) + np.maximum.reduceat(Values, Starts))
+      Values -= np.repeat(Center, NumberOfHits[NumberOfHits > 0])
+
+
+###################################################################################################
+
+
+  def hasHitsOutside(self, XMin, XMax, YMin, YMax, ZMin, ZMax):
+    """
+    Returns for each event True if any of its hits is outside the box defined by x in [XMin,XMax], y in [YMin,YMax], z in [ZMin,ZMax]
+    """
+
+    Outside = (self.X > XMax) | (self.X < XMin) | (self.Y > YMax) | (self.Y < YMin) | (self.Z > ZMax) | (self.Z < ZMin)
+
+    return np.bincount(self.getEventIndices(), weights=Outside, minlength=self.NumberOfEvents) > 0
+
+
+###################################################################################################
+
+
+  def isOriginInside(self, XMin, XMax, YMin, YMax, ZMin, ZMax):
+    """
+    Returns for each event True if the start is inside the box defined by x in [XMin,XMax], y in [YMin,YMax], z in [ZMin,ZMax]
+    """
+
+    return (self.OriginPositionX <= XMax) & (self.OriginPositionX >= XMin) & (self.OriginPositionY <= YMax) & (self.OriginPositionY >= YMin) & (self.OriginPositionZ <= ZMax) & (self.OriginPositionZ >= ZMin)
+
+
+###################################################################################################
+
+
+class EventView:
+  """
+  This class gives access to one event of an EventBatch with the attribute names of EventData.
+  The hit arrays are views into the batch, except Type, which is converted to str.
+  """
+
+
+###################################################################################################
+
+
+  def __init__(self, Batch, Index):
+    """
+    The default constructor for class EventView
+    """
+
+    for Column, Values in Batch.getHits(Index).items():
+      setattr(self, Column, Values)
+    self.Type = self.Type.astype(str)
+    for Column in EventCache.EventColumns:
+      setattr(self, Column, getattr(Batch, Column)[Index])
+
+
+###################################################################################################
+
+
+  def print(self):
+    """
+    Print the data
+    """
+
+    print("Event ID: {}".format(self.EventID))
+    print("  Origin Z: {}".format(self.OriginPositionZ))
+    for h in range(0, len(self.X)):
+      print("  Hit {} (origin: {}): type={}, pos=({}, {}, {})cm, E={}keV".format(self.ID[h], self.Origin[h], self.Type[h], self.X[h], self.Y[h], self.Z[h], self.E[h]))
+
+
+# END
+###################################################################################################
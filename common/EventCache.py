@@ -0,0 +1,506 @@
+###################################################################################################
+#
+# EventCache.py
+#
+# Copyright (C) by Andreas Zoglauer.
+# All rights reserved.
+#
+# Please see the file License.txt in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+
+###################################################################################################
+
+
+import os
+import json
+import numpy as np
+
+
+###################################################################################################
+
+
+class EventCache:
+  """
+  This class gives memory-mapped access to the events stored in an event cache directory.
+  The cache stores all hits of all events in flat columns (X, Y, Z, E, Type, Origin, ID),
+  the hits of event i are the entries Offsets[i] to Offsets[i+1]. Per-event quantities
+  (EventID, origin position, gamma energy, event type) are stored in one entry per event.
+  Opening a cache neither reads the data nor requires ROOT. A typical usage would look like this:
+
+  Cache = EventCache("ComptonTrackIdentification.p1.evc")
+  for i in range(0, len(Cache)):
+    Begin, End = Cache.Offsets[i], Cache.Offsets[i+1]
+    print(Cache.X[Begin:End])
+
+  """
+
+  # Version of the on-disk layout
+  Version = 1
+
+  # Name of the description file in the cache directory
+  InfoName = "EventCache.json"
+
+  # Hit columns and their data types
+  HitColumns = { "X": "float64", "Y": "float64", "Z": "float64", "E": "float64", "Type": "S1", "Origin": "int32", "ID": "int32" }
+
+  # Event columns and their data types
+  EventColumns = { "EventID": "int64", "OriginPositionX": "float64", "OriginPositionY": "float64", "OriginPositionZ": "float64", "GammaEnergy": "float64", "EventType": "int32" }
+
+
+###################################################################################################
+
+
+  def __init__(self, Name = "", Columns = None):
+    """
+    The default constructor for class EventCache
+
+    Attributes
+    ----------
+    Name : string
+      The directory of the event cache (something like: X.p1.evc)
+    Columns : dictionary
+      Alternatively to Name: in-memory columns as returned by EventCollection.get(), e.g. from readSimFiles
+
+    """
+
+    self.Name = Name
+
+    if Columns is not None:
+      self.Info = { "Version": EventCache.Version, "NumberOfEvents": len(Columns["Offsets"]) - 1, "NumberOfHits": int(Columns["Offsets"][-1]), "Source": "" }
+      self.NumberOfEvents = self.Info["NumberOfEvents"]
+      self.NumberOfHits = self.Info["NumberOfHits"]
+      for Column, Values in Columns.items():
+        setattr(self, Column, Values)
+      return
+
+    InfoFileName = os.path.join(Name, EventCache.InfoName)
+    if not os.path.exists(InfoFileName):
+      raise IOError("The directory {} does not contain an event cache".format(Name))
+
+    with open(InfoFileName, "r") as f:
+      self.Info = json.load(f)
+
+    if self.Info["Version"] != EventCache.Version:
+      raise IOError("The event cache {} has version {}, but version {} is required".format(Name, self.Info["Version"], EventCache.Version))
+
+    self.NumberOfEvents = self.Info["NumberOfEvents"]
+    self.NumberOfHits = self.Info["NumberOfHits"]
+
+    self.Offsets = self.map("Offsets", "int64", self.NumberOfEvents + 1)
+    for Column, Type in EventCache.HitColumns.items():
+      setattr(self, Column, self.map(Column, Type, self.NumberOfHits))
+    for Column, Type in EventCache.EventColumns.items():
+      setattr(self, Column, self.map(Column, Type, self.NumberOfEvents))
+
+
+###################################################################################################
+
+
+  @staticmethod
+  def exists(Name):
+    """
+    Return True if the given directory contains an event cache
+    """
+
+    return os.path.exists(os.path.join(Name, EventCache.InfoName))
+
+
+###################################################################################################
+
+
+  def map(self, Column, Type, Size):
+    """
+    Memory-map one column of the cache (read only)
+    """
+
+    if Size == 0:
+      return np.zeros(shape=(0), dtype=Type)
+
+    return np.memmap(os.path.join(self.Name, Column + ".bin"), dtype=Type, mode="r", shape=(Size))
+
+
+###################################################################################################
+
+
+  def __len__(self):
+    """
+    Return the number of events in the cache
+    """
+
+    return self.NumberOfEvents
+
+
+###################################################################################################
+
+
+  def getHits(self, Index):
+    """
+    Return a dictionary with views to all hit columns of the given event
+    """
+
+    Begin = self.Offsets[Index]
+    End = self.Offsets[Index+1]
+
+    return { Column: getattr(self, Column)[Begin:End] for Column in EventCache.HitColumns }
+
+
+###################################################################################################
+
+
+  def getColumns(self):
+    """
+    Return all columns as a dictionary (the layout of EventCollection.get())
+    """
+
+    Columns = { "Offsets": self.Offsets }
+    for Column in list(EventCache.HitColumns) + list(EventCache.EventColumns):
+      Columns[Column] = getattr(self, Column)
+
+    return Columns
+
+
+###################################################################################################
+
+
+class EventCollection:
+  """
+  This class collects events in memory in the column layout of the event cache
+  """
+
+
+###################################################################################################
+
+
+  def __init__(self):
+    """
+    The default constructor for class EventCollection
+    """
+
+    self.Hits = { Column: [] for Column in EventCache.HitColumns }
+    self.Events = { Column: [] for Column in EventCache.EventColumns }
+    self.NumberOfHits = [ 0 ]
+
+
+###################################################################################################
+
+
+  def __len__(self):
+    """
+    Return the number of collected events
+    """
+
+    return len(self.NumberOfHits) - 1
+
+
+###################################################################################################
+
+
+  def hitColumn(self, Data, Column, NumberOfHits):
+    """
+    Return the given per-hit column of an event object, or zeros if it is not (correctly) set
+    """
+
+    Values = getattr(Data, Column, None)
+    if Values is None or np.ndim(Values) != 1 or len(Values) != NumberOfHits:
+      return np.zeros(shape=(NumberOfHits), dtype=EventCache.HitColumns[Column])
+
+    if Column == "Type":
+      return np.asarray(Values).astype("U1").astype("S1")
+
+    return np.asarray(Values).astype(EventCache.HitColumns[Column])
+
+
+###################################################################################################
+
+
+  def add(self, Data, EventID = None, EventType = None):
+    """
+    Add one event. Data can be any object with the hit arrays X, Y, Z, E, and optionally Type, Origin, and ID,
+    as well as the optional per-event attributes OriginPositionX/Y/Z and GammaEnergy (e.g. class EventData)
+    """
+
+    NumberOfHits = len(Data.X)
+
+    for Column in EventCache.HitColumns:
+      self.Hits[Column].append(self.hitColumn(Data, Column, NumberOfHits))
+
+    if EventID is None:
+      EventID = getattr(Data, "EventID", len(self))
+    if EventType is None:
+      EventType = getattr(Data, "EventType", 0)
+
+    self.Events["EventID"].append(EventID)
+    self.Events["OriginPositionX"].append(getattr(Data, "OriginPositionX", 0.0))
+    self.Events["OriginPositionY"].append(getattr(Data, "OriginPositionY", 0.0))
+    self.Events["OriginPositionZ"].append(getattr(Data, "OriginPositionZ", 0.0))
+    self.Events["GammaEnergy"].append(getattr(Data, "GammaEnergy", 0.0))
+    self.Events["EventType"].append(EventType)
+
+    self.NumberOfHits.append(self.NumberOfHits[-1] + NumberOfHits)
+
+
+###################################################################################################
+
+
+  def get(self):
+    """
+    Return all collected events as a dictionary of numpy arrays: One entry per column plus the Offsets
+    """
+
+    Columns = { "Offsets": np.array(self.NumberOfHits, dtype="int64") }
+    for Column, Type in EventCache.HitColumns.items():
+      if len(self.Hits[Column]) > 0:
+        Columns[Column] = np.concatenate(self.Hits[Column])
+      else:
+        Columns[Column] = np.zeros(shape=(0), dtype=Type)
+    for Column, Type in EventCache.EventColumns.items():
+      Columns[Column] = np.array(self.Events[Column], dtype=Type)
+
+    return Columns
+
+
+###################################################################################################
+
+
+def selectEvents(Columns, Indices):
+  """
+  Return the columns of the events with the given indices (in the order of the indices)
+  """
+
+  Indices = np.asarray(Indices, dtype="int64")
+  Offsets = Columns["Offsets"]
+
+  Counts = Offsets[Indices + 1] - Offsets[Indices]
+  NewOffsets = np.zeros(shape=(len(Indices) + 1), dtype="int64")
+  np.cumsum(Counts, out=NewOffsets[1:])
+
+  # Index of each new hit in the old columns
+  HitIndices = np.arange(NewOffsets[-1], dtype="int64") + np.repeat(Offsets[Indices] - NewOffsets[:-1], Counts)
+
+  Selected = { "Offsets": NewOffsets }
+  for Column in EventCache.HitColumns:
+    Selected[Column] = Columns[Column][HitIndices]
+  for Column in EventCache.EventColumns:
+    Selected[Column] = Columns[Column][Indices]
+
+  return Selected
+
+
+###################################################################################################
+
+
+def concatenateColumns(ListOfColumns):
+  """
+  Concatenate the columns of several event sets into one
+  """
+
+  if len(ListOfColumns) == 1:
+    return ListOfColumns[0]
+
+  Offsets = [ np.zeros(shape=(1), dtype="int64") ]
+  NumberOfHits = 0
+  for Columns in ListOfColumns:
+    Offsets.append(Columns["Offsets"][1:] + NumberOfHits)
+    NumberOfHits += Columns["Offsets"][-1]
+
+  Concatenated = { "Offsets": np.concatenate(Offsets) }
+  for Column in list(EventCache.HitColumns) + list(EventCache.EventColumns):
+    Concatenated[Column] = np.concatenate([ Columns[Column] for Columns in ListOfColumns ])
+
+  return Concatenated
+
+
+###################################################################################################
+
+
+class EventCacheWriter:
+  """
+  This class writes an event cache which can be read via EventCache.
+  The columns are streamed to disk in chunks, thus the cache can be larger than the memory.
+  """
+
+
+###################################################################################################
+
+
+  def __init__(self, Name, Source = "", ChunkSize = 10000):
+    """
+    The default constructor for class EventCacheWriter
+
+    Attributes
+    ----------
+    Name : string
+      The directory of the event cache, it is created if it does not exist
+    Source : string
+      The file the events originate from (for bookkeeping only)
+    ChunkSize : integer
+      The number of events to buffer before writing to disk
+
+    """
+
+    self.Name = Name
+    self.Source = Source
+    self.ChunkSize = ChunkSize
+
+    os.makedirs(Name, exist_ok=True)
+
+    # Remove the description first, this way an interrupted conversion never looks like a valid cache
+    if os.path.exists(os.path.join(Name, EventCache.InfoName)):
+      os.remove(os.path.join(Name, EventCache.InfoName))
+
+    self.Files = {}
+    for Column in ["Offsets"] + list(EventCache.HitColumns) + list(EventCache.EventColumns):
+      self.Files[Column] = open(os.path.join(Name, Column + ".bin"), "wb")
+
+    self.NumberOfEvents = 0
+    self.NumberOfHits = 0
+
+    self.Files["Offsets"].write(np.zeros(shape=(1), dtype="int64").tobytes())
+
+    self.Buffer = EventCollection()
+
+
+###################################################################################################
+
+
+  def add(self, Data, EventID = None, EventType = None):
+    """
+    Add one event, see EventCollection.add
+    """
+
+    if EventID is None:
+      EventID = getattr(Data, "EventID", self.NumberOfEvents + len(self.Buffer))
+
+    self.Buffer.add(Data, EventID, EventType)
+
+    if len(self.Buffer) >= self.ChunkSize:
+      self.flush()
+
+
+###################################################################################################
+
+
+  def addColumns(self, Columns):
+    """
+    Write a block of events given as columns (the layout of EventCollection.get())
+    """
+
+    self.Files["Offsets"].write((Columns["Offsets"][1:] + self.NumberOfHits).astype("int64").tobytes())
+    for Column, Type in EventCache.HitColumns.items():
+      self.Files[Column].write(np.ascontiguousarray(Columns[Column], dtype=Type).tobytes())
+    for Column, Type in EventCache.EventColumns.items():
+      self.Files[Column].write(np.ascontiguousarray(Columns[Column], dtype=Type).tobytes())
+
+    self.NumberOfEvents += len(Columns["Offsets"]) - 1
+    self.NumberOfHits += int(Columns["Offsets"][-1])
+
+
+###################################################################################################
+
+
+  def flush(self):
+    """
+    Write all buffered events to disk
+    """
+
+    if len(self.Buffer) == 0:
+      return
+
+    self.addColumns(self.Buffer.get())
+
+    self.Buffer = EventCollection()
+
+
+###################################################################################################
+
+
+  def close(self):
+    """
+    Write the remaining events and the description file, which marks the cache as complete
+    """
+
+    self.flush()
+
+    for File in self.Files.values():
+      File.close()
+
+    Info = { "Version": EventCache.Version, "NumberOfEvents": self.NumberOfEvents, "NumberOfHits": self.NumberOfHits, "Source": self.Source }
+    with open(os.path.join(self.Name, EventCache.InfoName), "w") as f:
+      json.dump(Info, f, indent=2)
+
+    print("Info: Wrote {} events with {} hits to the event cache {}".format(self.NumberOfEvents, self.NumberOfHits, self.Name))
+
+
+###################################################################################################
+
+
+def convertSimFile(FileName, CacheName, Parser, GeometryName, MaxEvents = -1, NumberOfWorkers = 1):
+  """
+  Read a MEGAlib sim file once and store all events accepted by the Parser in an event cache.
+  If the file is one part of a multi-threaded cosima run (X.p1.sim.gz), all parts are converted.
+  Parser is a function which takes an MSimEvent and returns an event object (see EventCollection.add) or None.
+  With more than one worker, the files are parsed by a process pool, see SimFileReader.
+  This is the only function in this file which requires ROOT & MEGAlib.
+
+  Returns
+  -------
+  integer
+    The number of stored events
+
+  """
+
+  from SimFileReader import findSimFiles, iterateSimFiles
+
+  Writer = EventCacheWriter(CacheName, Source=FileName)
+
+  if NumberOfWorkers > 1:
+    print("Info: Converting {} into the event cache {} using {} processes".format(FileName, CacheName, NumberOfWorkers))
+
+    for Columns in iterateSimFiles(FileName, Parser, GeometryName, NumberOfWorkers, MaxEvents):
+      Writer.addColumns(Columns)
+      print("Events converted: {}".format(Writer.NumberOfEvents))
+    Writer.close()
+
+    return Writer.NumberOfEvents
+
+  import ROOT as M
+  M.gSystem.Load("$(MEGALIB)/lib/libMEGAlib.so")
+
+  Geometry = M.MDGeometryQuest()
+  if Geometry.ScanSetupFile(M.MString(GeometryName)) == True:
+    print("Geometry " + GeometryName + " loaded!")
+  else:
+    raise IOError("Unable to load geometry " + GeometryName)
+
+  for Name in findSimFiles(FileName):
+    Reader = M.MFileEventsSim(Geometry)
+    if Reader.Open(M.MString(Name)) == False:
+      raise IOError("Unable to open file " + Name)
+
+    print("Info: Converting {} into the event cache {}".format(Name, CacheName))
+
+    while MaxEvents < 0 or Writer.NumberOfEvents + len(Writer.Buffer) < MaxEvents:
+      Event = Reader.GetNextEvent()
+      if not Event:
+        break
+
+      if Event.GetNIAs() > 0:
+        Data = Parser(Event)
+        if Data is not None:
+          Writer.add(Data, EventID=Event.GetID())
+          if Writer.NumberOfEvents > 0 and len(Writer.Buffer) == 0:
+            print("Events converted: {}".format(Writer.NumberOfEvents))
+
+    Reader.Close()
+
+  Writer.close()
+
+  return Writer.NumberOfEvents
+
+
+# END
+###################################################################################################
@@ -0,0 +1,111 @@
+###################################################################################################
+#
+# GraphTools.py
+#
+# Copyright (C) by Andreas Zoglauer.
+# All rights reserved.
+#
+# Please see the file License.txt in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+
+###################################################################################################
+
+
+import numpy as np
+
+from scipy.spatial import cKDTree
+
+
+###################################################################################################
+
+
+"""
+Vectorized construction of the hit graphs of the graph neural networks.
+The graphs of many events are built at once: the hits of all events are the nodes, an edge is a pair of
+node indices (Senders[k], Receivers[k]), and edges only connect hits of the same event.
+EventIndices is the index of the event of each hit, it must be sorted (as EventBatch.getEventIndices()).
+"""
+
+
+###################################################################################################
+
+
+def radiusEdges(Positions, EventIndices, Radius):
+  """
+  Return all directed edges between different hits of the same event which are at most Radius apart.
+  A single KD-tree is used for all events: the event index is an additional coordinate, scaled such that
+  hits of different events are always further apart than Radius.
+  """
+
+  if len(Positions) == 0:
+    return np.zeros(shape=(0), dtype="int64"), np.zeros(shape=(0), dtype="int64")
+
+  Separation = 2.0*Radius + 1.0
+  Points = np.column_stack((np.asarray(Positions, dtype="float64"), np.asarray(EventIndices, dtype="float64") * Separation))
+
+  Pairs = cKDTree(Points).query_pairs(Radius, output_type="ndarray").astype("int64")
+
+  # The pairs are unordered, the edges go both ways
+  return np.concatenate((Pairs[:, 0], Pairs[:, 1])), np.concatenate((Pairs[:, 1], Pairs[:, 0]))
+
+
+###################################################################################################
+
+
+def groupEdges(Selected, EventIndices):
+  """
+  Return all directed edges between different selected hits of the same event (e.g. all gamma-ray hits)
+  """
+
+  Hits = np.flatnonzero(Selected)
+  Events = np.asarray(EventIndices)[Hits]
+
+  # All selected hits of the event of each selected hit
+  Begin = np.searchsorted(Events, Events, side="left")
+  Counts = np.searchsorted(Events, Events, side="right") - Begin
+
+  Senders = np.repeat(Hits, Counts)
+  Receivers = Hits[np.arange(np.sum(Counts)) - np.repeat(np.cumsum(Counts) - Counts, Counts) + np.repeat(Begin, Counts)]
+
+  IsLoop = Senders == Receivers
+
+  return Senders[~IsLoop], Receivers[~IsLoop]
+
+
+###################################################################################################
+
+
+def uniqueEdges(Senders, Receivers, NumberOfNodes):
+  """
+  Return the edges without duplicates, sorted by sender and then receiver (the order of an adjacency matrix)
+  """
+
+  Keys = np.unique(np.asarray(Senders, dtype="int64") * NumberOfNodes + np.asarray(Receivers, dtype="int64"))
+
+  return Keys // NumberOfNodes, Keys % NumberOfNodes
+
+
+###################################################################################################
+
+
+def incidenceMatrices(NumberOfNodes, Senders, Receivers):
+  """
+  Return the dense outgoing (Ro) and incoming (Ri) incidence matrices of shape (nodes, edges):
+  Ro[Senders[k], k] = 1 and Ri[Receivers[k], k] = 1
+  """
+
+  Ro = np.zeros((NumberOfNodes, len(Senders)))
+  Ri = np.zeros((NumberOfNodes, len(Receivers)))
+
+  Ro[Senders, np.arange(len(Senders))] = 1
+  Ri[Receivers, np.arange(len(Receivers))] = 1
+
+  return Ro, Ri
+
+
+# END
+###################################################################################################
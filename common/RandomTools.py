@@ -0,0 +1,77 @@
+###################################################################################################
+#
+# RandomTools.py
+#
+# Copyright (C) by Andreas Zoglauer.
+# All rights reserved.
+#
+# Please see the file License.txt in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+
+###################################################################################################
+
+
+import numpy as np
+
+
+###################################################################################################
+
+
+"""
+Reproducible random number generators for parallel data set creation.
+All generators are derived from one master SeedSequence: the generator of an item (e.g. the GRB with index g of
+the training data set) only depends on the master seed and the keys of the item, e.g. (0, g). Thus the created
+data sets are identical for any number of worker processes or any split into tasks, and the streams of different
+items are independent. A typical usage would look like this:
+
+Seeds = createSeedSequence(42)
+for g in range(Begin, End):
+  Generator = childGenerator(Seeds, 0, g)
+  ...
+"""
+
+
+###################################################################################################
+
+
+def createSeedSequence(Seed = None):
+  """
+  Return the master SeedSequence of the given integer seed, a given SeedSequence is returned as is.
+  Without seed a new one is drawn from the OS, the run can be repeated with its Seed.entropy
+  """
+
+  if isinstance(Seed, np.random.SeedSequence):
+    return Seed
+
+  return np.random.SeedSequence(Seed)
+
+
+###################################################################################################
+
+
+def childSeedSequence(Seeds, *Keys):
+  """
+  Return the SeedSequence of the item with the given (non-negative integer) keys.
+  childSeedSequence(Seeds, i) is the same as Seeds.spawn(n)[i] of a new master SeedSequence
+  """
+
+  return np.random.SeedSequence(Seeds.entropy, spawn_key=tuple(Seeds.spawn_key) + tuple(int(Key) for Key in Keys), pool_size=Seeds.pool_size)
+
+
+###################################################################################################
+
+
+def childGenerator(Seeds, *Keys):
+  """
+  Return a new random number generator for the item with the given keys
+  """
+
+  return np.random.default_rng(childSeedSequence(Seeds, *Keys))
+
+
+# END
+###################################################################################################
@@ -0,0 +1,303 @@
+###################################################################################################
+#
+# SimFileReader.py
+#
+# Copyright (C) by Andreas Zoglauer.
+# All rights reserved.
+#
+# Please see the file License.txt in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+
+###################################################################################################
+
+
+import os
+import re
+import glob
+import mmap
+import tempfile
+import collections
+import multiprocessing as mp
+import numpy as np
+
+from EventCache import EventCollection, selectEvents, concatenateColumns
+
+
+###################################################################################################
+
+
+"""
+Parallel parsing of MEGAlib sim files with a process pool.
+
+The work is split into chunks: An uncompressed sim file is split into contiguous byte ranges of about ChunkSize bytes.
+Each range starts at the first event (line "SE") at or after its begin, thus each event belongs to exactly one chunk.
+A worker copies the header of the file and the events of its chunk into a temporary sim file and parses only those,
+thus MEGAlib reads every event exactly once. Compressed files (.sim.gz) cannot be split and are parsed as one chunk,
+thus they only scale with the number of parts of a multi-threaded cosima run (X.p1.sim.gz, X.p2.sim.gz, ...).
+The chunks are handed out in file order and returned in this order as columns (see EventCollection.get()),
+and the pool stops as soon as enough events are parsed. A typical usage would look like this:
+
+def parseEvent(Event):
+  Data = EventData()
+  if Data.parse(Event) == True:
+    return Data
+  return None
+
+Columns = readSimFiles("ComptonTrackIdentification.p1.sim.gz", parseEvent, GeometryName, 24)
+Cache = EventCache(Columns=Columns)
+
+The Parser is handed to the worker processes, thus it must be a module-level function
+(or a method of a picklable object).
+"""
+
+
+###################################################################################################
+
+
+# The loaded geometries of a worker process by name, since one worker parses many chunks
+Geometries = {}
+
+
+###################################################################################################
+
+
+def findSimFiles(FileName):
+  """
+  Return all parts of a multi-threaded cosima run, if FileName is one of them (X.p1.sim.gz -> X.p1.sim.gz, X.p2.sim.gz, ...)
+  Otherwise return just FileName
+  """
+
+  Match = re.match(r"^(.*)\.p(\d+)(\..*\.sim(\.gz)?|\.sim(\.gz)?)$", FileName)
+  if Match is None:
+    return [ FileName ]
+
+  Parts = []
+  for Part in glob.glob(glob.escape(Match.group(1)) + ".p*" + Match.group(3)):
+    PartMatch = re.match(r"^" + re.escape(Match.group(1)) + r"\.p(\d+)" + re.escape(Match.group(3)) + r"$", Part)
+    if PartMatch is not None:
+      Parts.append((int(PartMatch.group(1)), Part))
+
+  if len(Parts) == 0:
+    return [ FileName ]
+
+  return [ Part for Number, Part in sorted(Parts) ]
+
+
+###################################################################################################
+
+
+def findEventStart(Data, Offset):
+  """
+  Return the position of the first event (line "SE") in the sim file content Data starting at or after Offset,
+  or the size of Data if there is none
+  """
+
+  Position = Data.find(b"\nSE", max(Offset - 1, 0))
+  while Position >= 0:
+    Next = Data[Position+3:Position+4]
+    if Next in (b"", b"\n", b"\r", b" ", b"\t"):
+      return Position + 1
+    Position = Data.find(b"\nSE", Position + 1)
+
+  return len(Data)
+
+
+###################################################################################################
+
+
+def writeSimChunk(FileName, Begin, End):
+  """
+  Write the header and the events starting in the byte range [Begin, End) of the sim file into a temporary sim file
+
+  Returns
+  -------
+  string
+    The name of the temporary file, or None if no event starts in the range
+
+  """
+
+  with open(FileName, "rb") as File:
+    Data = mmap.mmap(File.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      First = findEventStart(Data, Begin)
+      Last = findEventStart(Data, End)
+      if First >= Last:
+        return None
+
+      Handle, ChunkName = tempfile.mkstemp(suffix=".sim")
+      with os.fdopen(Handle, "wb") as Chunk:
+        Chunk.write(Data[:findEventStart(Data, 0)])
+        for Position in range(First, Last, 1 << 24):
+          Chunk.write(Data[Position:min(Position + (1 << 24), Last)])
+        # The footer of the file follows the events of the last chunk
+        if Last < len(Data):
+          Chunk.write(b"EN\n")
+    finally:
+      Data.close()
+
+  return ChunkName
+
+
+###################################################################################################
+
+
+def readSimChunk(FileName, Parser, GeometryName, Begin, End, MaxEvents):
+  """
+  Parse the events starting in the byte range [Begin, End) of the given sim file, the whole file if Begin is None (the worker function)
+
+  Returns
+  -------
+  dictionary
+    The columns of the first MaxEvents events accepted by the Parser (all if MaxEvents is negative)
+
+  """
+
+  import ROOT as M
+  M.gSystem.Load("$(MEGALIB)/lib/libMEGAlib.so")
+  M.PyConfig.IgnoreCommandLineOptions = True
+
+  if GeometryName not in Geometries:
+    Geometry = M.MDGeometryQuest()
+    if Geometry.ScanSetupFile(M.MString(GeometryName)) == False:
+      raise IOError("Unable to load geometry " + GeometryName)
+    Geometries[GeometryName] = Geometry
+
+  Events = EventCollection()
+
+  ChunkName = FileName
+  if Begin is not None:
+    ChunkName = writeSimChunk(FileName, Begin, End)
+    if ChunkName is None:
+      return Events.get()
+
+  try:
+    Reader = M.MFileEventsSim(Geometries[GeometryName])
+    if Reader.Open(M.MString(ChunkName)) == False:
+      raise IOError("Unable to open file " + FileName)
+
+    while MaxEvents < 0 or len(Events) < MaxEvents:
+      Event = Reader.GetNextEvent()
+      if not Event:
+        break
+
+      if Event.GetNIAs() > 0:
+        Data = Parser(Event)
+        if Data is not None:
+          Events.add(Data, EventID=Event.GetID())
+
+    Reader.Close()
+  finally:
+    if ChunkName != FileName:
+      os.remove(ChunkName)
+
+  return Events.get()
+
+
+###################################################################################################
+
+
+def splitSimFiles(FileNames, NumberOfWorkers, ChunkSize):
+  """
+  Return the chunks (FileName, Begin, End) of the sim files in file order, Begin and End are None for compressed files
+  """
+
+  Chunks = []
+  for Name in FileNames:
+    if Name.endswith(".gz") == True:
+      Chunks.append((Name, None, None))
+      continue
+
+    # Small files are still split between all workers
+    Size = os.path.getsize(Name)
+    Step = max(1, min(ChunkSize, Size // NumberOfWorkers))
+    for Begin in range(0, Size, Step):
+      Chunks.append((Name, Begin, min(Begin + Step, Size)))
+
+  return Chunks
+
+
+###################################################################################################
+
+
+def iterateSimFiles(FileName, Parser, GeometryName, NumberOfWorkers = 0, MaxEvents = -1, ChunkSize = 16 << 20):
+  """
+  Parse a sim file (and all other parts of its cosima run) with a process pool.
+  Yields the columns of one chunk after the other, in the original event order. The pool stops
+  when MaxEvents are reached or when the caller stops iterating (e.g. after enough selected events).
+
+  Attributes
+  ----------
+  FileName : string
+    The sim file (one of the parts X.p1.sim.gz, X.p2.sim.gz, ..., if cosima ran multi-threaded)
+  Parser : function
+    Takes an MSimEvent and returns an event object (see EventCollection.add) or None
+  GeometryName : string
+    The geometry setup file
+  NumberOfWorkers : integer
+    The number of processes, all cores if 0
+  MaxEvents : integer
+    The maximum number of accepted events (the first ones, as when reading sequentially), all if negative
+  ChunkSize : integer
+    The maximum size in bytes of the chunks of uncompressed sim files
+
+  """
+
+  if NumberOfWorkers <= 0:
+    NumberOfWorkers = mp.cpu_count()
+
+  FileNames = findSimFiles(FileName)
+  Chunks = splitSimFiles(FileNames, NumberOfWorkers, ChunkSize)
+
+  print("Info: Parsing {} sim file(s) in {} chunk(s) with {} processes".format(len(FileNames), len(Chunks), NumberOfWorkers))
+  if any(Begin is None for Name, Begin, End in Chunks) and len(Chunks) < NumberOfWorkers:
+    print("Info: Compressed sim files cannot be split, each is parsed by one process. Decompress them or run cosima with more threads to use all processes.")
+
+  NumberOfEvents = 0
+  with mp.Pool(processes=NumberOfWorkers) as Pool:
+    # Only a few chunks are handed out ahead, thus not much is parsed in vain when stopping early
+    Pending = collections.deque()
+    Next = 0
+    while Next < len(Chunks) or len(Pending) > 0:
+      while Next < len(Chunks) and len(Pending) < 2*NumberOfWorkers:
+        Name, Begin, End = Chunks[Next]
+        Pending.append(Pool.apply_async(readSimChunk, (Name, Parser, GeometryName, Begin, End, MaxEvents - NumberOfEvents if MaxEvents >= 0 else -1)))
+        Next += 1
+
+      Columns = Pending.popleft().get()
+      Count = len(Columns["Offsets"]) - 1
+      if MaxEvents >= 0 and NumberOfEvents + Count >= MaxEvents:
+        yield selectEvents(Columns, np.arange(MaxEvents - NumberOfEvents))
+        return
+
+      NumberOfEvents += Count
+      if Count > 0:
+        yield Columns
+
+
+###################################################################################################
+
+
+def readSimFiles(FileName, Parser, GeometryName, NumberOfWorkers = 0, MaxEvents = -1):
+  """
+  Parse a sim file (and all other parts of its cosima run) with a process pool, see iterateSimFiles
+
+  Returns
+  -------
+  dictionary
+    The columns of all accepted events (the layout of EventCollection.get()), to be used e.g. via EventCache(Columns=...)
+
+  """
+
+  Parts = list(iterateSimFiles(FileName, Parser, GeometryName, NumberOfWorkers, MaxEvents))
+  if len(Parts) == 0:
+    return EventCollection().get()
+
+  return concatenateColumns(Parts)
+
+
+# END
+###################################################################################################
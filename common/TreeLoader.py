@@ -0,0 +1,168 @@
+###################################################################################################
+#
+# TreeLoader.py
+#
+# Copyright (C) by Andreas Zoglauer.
+# All rights reserved.
+#
+# Please see the file License.txt in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+
+###################################################################################################
+
+
+import time
+import numpy as np
+import ROOT
+
+
+###################################################################################################
+
+
+class TreeLoader:
+  """
+  This class reads selected branches of a flat ROOT tree (e.g. the "Quality" trees of the
+  response files) in chunks directly into a 2D float32 numpy array, instead of calling
+  GetEntry for each row. A typical usage would look like this:
+
+  Loader = TreeLoader("Ling2.seq3.quality.root", "Quality")
+  Features = Loader.selectColumns(Exclude=["SequenceLength", "SimulationID", "EvaluationZenithAngle"])
+  Data = Loader.load(Features + ["EvaluationZenithAngle"], MaxEvents=100000)
+
+  """
+
+
+###################################################################################################
+
+
+  def __init__(self, FileName, TreeName = "Quality"):
+    """
+    The default constructor for class TreeLoader
+
+    Attributes
+    ----------
+    FileName : string
+      The ROOT file
+    TreeName : string
+      The name of the tree in the ROOT file
+
+    """
+
+    self.FileName = FileName
+    self.TreeName = TreeName
+
+    self.File = ROOT.TFile(FileName)
+    if self.File.IsOpen() == False:
+      raise IOError("Unable to open data file {}".format(FileName))
+
+    self.Tree = self.File.Get(TreeName)
+    if not self.Tree:
+      raise IOError("Unable to read data tree {} from file {}".format(TreeName, FileName))
+
+    self.BranchNames = [ B.GetName() for B in list(self.Tree.GetListOfBranches()) ]
+
+
+###################################################################################################
+
+
+  def getNumberOfEntries(self):
+    """
+    Return the number of rows in the tree
+    """
+
+    return int(self.Tree.GetEntries())
+
+
+###################################################################################################
+
+
+  def selectColumns(self, Include = None, Exclude = None):
+    """
+    Return the branch names to load: all branches (in tree order) or the Include list (in the given order),
+    without the ones in the Exclude list
+    """
+
+    if Include is None:
+      Columns = list(self.BranchNames)
+    else:
+      Columns = list(Include)
+
+    for Column in Columns:
+      if Column not in self.BranchNames:
+        raise ValueError("The tree {} has no branch {}".format(self.TreeName, Column))
+
+    if Exclude is not None:
+      Columns = [ Column for Column in Columns if Column not in Exclude ]
+
+    return Columns
+
+
+###################################################################################################
+
+
+  def load(self, Columns, MaxEvents = -1, ChunkSize = 100000):
+    """
+    Read the given branches of the first MaxEvents rows (all if negative)
+
+    Returns
+    -------
+    numpy array
+      float32 array of shape (rows, len(Columns)), the columns in the order of Columns
+
+    """
+
+    NumberOfEntries = self.getNumberOfEntries()
+    if MaxEvents >= 0:
+      NumberOfEntries = min(NumberOfEntries, MaxEvents)
+
+    Data = np.zeros(shape=(NumberOfEntries, len(Columns)), dtype=np.float32)
+
+    print("{}: Reading {} rows of {} columns from tree {}".format(time.time(), NumberOfEntries, len(Columns), self.TreeName))
+
+    if hasattr(ROOT, "RDataFrame") and hasattr(ROOT.RDataFrame, "AsNumpy"):
+      Frame = ROOT.RDataFrame(self.Tree)
+      for Begin in range(0, NumberOfEntries, ChunkSize):
+        End = min(Begin + ChunkSize, NumberOfEntries)
+        Arrays = Frame.Range(Begin, End).AsNumpy(Columns)
+        for c, Column in enumerate(Columns):
+          Data[Begin:End, c] = Arrays[Column]
+    else:
+      # Older ROOT versions: one TTree::Draw per branch and chunk
+      self.Tree.SetEstimate(ChunkSize + 1)
+      for Begin in range(0, NumberOfEntries, ChunkSize):
+        End = min(Begin + ChunkSize, NumberOfEntries)
+        for c, Column in enumerate(Columns):
+          Data[Begin:End, c] = self.drawBranch(Column, Begin, End - Begin)
+
+    print("{}: Finished reading tree {}".format(time.time(), self.TreeName))
+
+    return Data
+
+
+###################################################################################################
+
+
+  def drawBranch(self, Column, First, Number):
+    """
+    Read the values of one branch for the given rows via TTree::Draw
+    """
+
+    Drawn = self.Tree.Draw(Column, "", "goff", Number, First)
+    if Drawn != Number:
+      raise IOError("Unable to read branch {} of tree {}".format(Column, self.TreeName))
+
+    Buffer = self.Tree.GetV1()
+    if hasattr(Buffer, "SetSize"):
+      Buffer.SetSize(Number)
+    elif hasattr(Buffer, "reshape"):
+      Buffer.reshape((Number,))
+
+    return np.frombuffer(Buffer, dtype=np.float64, count=Number)
+
+
+# END
+###################################################################################################
@@ -0,0 +1,124 @@
+###################################################################################################
+#
+# VectorTools.py
+#
+# Copyright (C) by Andreas Zoglauer.
+# All rights reserved.
+#
+# Please see the file License.txt in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+
+###################################################################################################
+
+
+import numpy as np
+
+
+###################################################################################################
+
+
+"""
+Vectorized versions of the MVector operations used by the toy models.
+All vectors are numpy arrays of shape (N, 3), one row per event.
+"""
+
+
+###################################################################################################
+
+
+def directionsFromThetaPhi(Theta, Phi):
+  """
+  Return the unit vectors with the given polar and azimuth angles (as MVector::SetMagThetaPhi(1.0, Theta, Phi))
+  """
+
+  SinTheta = np.sin(Theta)
+
+  return np.stack((SinTheta*np.cos(Phi), SinTheta*np.sin(Phi), np.cos(Theta)), axis=-1)
+
+
+###################################################################################################
+
+
+def randomDirections(Generator, NumberOfDirections):
+  """
+  Return isotropically distributed unit vectors
+  """
+
+  Theta = np.arccos(1.0 - 2.0*Generator.random(NumberOfDirections))
+  Phi = 2.0*np.pi*Generator.random(NumberOfDirections)
+
+  return directionsFromThetaPhi(Theta, Phi)
+
+
+###################################################################################################
+
+
+def rotateReferenceFrame(Vectors, NewZAxes):
+  """
+  Rotate the vectors into the reference frame whose z-axis is the given unit vector (as MVector::RotateReferenceFrame)
+  """
+
+  U1 = NewZAxes[:, 0]
+  U2 = NewZAxes[:, 1]
+  U3 = NewZAxes[:, 2]
+
+  PX = Vectors[:, 0]
+  PY = Vectors[:, 1]
+  PZ = Vectors[:, 2]
+
+  Up = np.sqrt(U1*U1 + U2*U2)
+  IsTilted = Up > 0
+  SafeUp = np.where(IsTilted, Up, 1.0)
+
+  Rotated = np.empty_like(Vectors)
+  Rotated[:, 0] = (U1*U3*PX - U2*PY)/SafeUp + U1*PZ
+  Rotated[:, 1] = (U2*U3*PX + U1*PY)/SafeUp + U2*PZ
+  Rotated[:, 2] = -Up*PX + U3*PZ
+
+  # New z-axis parallel to the old one: unchanged, or mirrored if anti-parallel
+  Sign = np.where(U3 < 0, -1.0, 1.0)
+  Rotated[~IsTilted, 0] = Sign[~IsTilted]*PX[~IsTilted]
+  Rotated[~IsTilted, 1] = PY[~IsTilted]
+  Rotated[~IsTilted, 2] = Sign[~IsTilted]*PZ[~IsTilted]
+
+  return Rotated
+
+
+###################################################################################################
+
+
+def anglesFromDirections(Vectors):
+  """
+  Return the polar and azimuth angles of the vectors (as MVector::Theta() and MVector::Phi())
+  """
+
+  Theta = np.arctan2(np.hypot(Vectors[..., 0], Vectors[..., 1]), Vectors[..., 2])
+  Phi = np.arctan2(Vectors[..., 1], Vectors[..., 0])
+
+  return Theta, Phi
+
+
+###################################################################################################
+
+
+def rotationMatrix(Angle, Axis):
+  """
+  Return the 3x3 matrix of the rotation by Angle around the unit vector Axis (as MRotation(Angle, Axis)).
+  The rotated vectors are Matrix @ Vector, or Vectors @ Matrix.T for an array of shape (N, 3)
+  """
+
+  X, Y, Z = Axis
+  C = np.cos(Angle)
+  S = np.sin(Angle)
+
+  return np.array([[ C + X*X*(1-C),   X*Y*(1-C) - Z*S, X*Z*(1-C) + Y*S ],
+                   [ Y*X*(1-C) + Z*S, C + Y*Y*(1-C),   Y*Z*(1-C) - X*S ],
+                   [ Z*X*(1-C) - Y*S, Z*Y*(1-C) + X*S, C + Z*Z*(1-C)   ]])
+
+
+# END
+###################################################################################################
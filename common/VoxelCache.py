@@ -0,0 +1,189 @@
+###################################################################################################
+#
+# VoxelCache.py
+#
+# Copyright (C) by Andreas Zoglauer.
+# All rights reserved.
+#
+# Please see the file License.txt in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+
+###################################################################################################
+
+
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from Voxelizer import SparseVoxelBatch
+
+
+###################################################################################################
+
+
+class VoxelCache:
+  """
+  This class stores voxelized data sets (SparseVoxelBatch) on disk, and gives memory-mapped access to them.
+  Each entry is a sub-directory named by a hash of its configuration: the input file (name, size,
+  modification time), the binning, the event selection, etc. If any of these change, the hash changes,
+  and the data sets are voxelized again. A typical usage would look like this:
+
+  Cache = VoxelCache("Voxels.vxc")
+  Configuration = { "Input": VoxelCache.describeFile(FileName), "Voxelizer": Voxels.getConfiguration(), "MaxEvents": MaxEvents }
+  Sparse = Cache.get(Configuration, lambda: Voxels.voxelizeBatchSparse(DataSets))
+
+  """
+
+  # Version of the on-disk layout
+  Version = 1
+
+  # Name of the description file in each entry directory
+  InfoName = "VoxelCache.json"
+
+
+###################################################################################################
+
+
+  def __init__(self, Directory):
+    """
+    The default constructor for class VoxelCache
+
+    Attributes
+    ----------
+    Directory : string
+      The directory of the voxel cache, it is created if it does not exist
+
+    """
+
+    self.Directory = Directory
+
+    os.makedirs(Directory, exist_ok=True)
+
+
+###################################################################################################
+
+
+  @staticmethod
+  def describeFile(FileName):
+    """
+    Return the name, size and modification time of a file, or of all files in a directory (e.g. an event cache)
+    """
+
+    Description = { "Name": os.path.abspath(FileName) }
+    if os.path.isdir(FileName):
+      for Name in sorted(os.listdir(FileName)):
+        Description[Name] = VoxelCache.describeFile(os.path.join(FileName, Name))
+    elif os.path.exists(FileName):
+      Description["Size"] = os.path.getsize(FileName)
+      Description["ModificationTime"] = os.path.getmtime(FileName)
+
+    return Description
+
+
+###################################################################################################
+
+
+  @staticmethod
+  def getKey(Configuration):
+    """
+    Return the hash of a configuration (a dictionary which can be stored as json)
+    """
+
+    return hashlib.sha1(json.dumps(Configuration, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+###################################################################################################
+
+
+  def getEntryName(self, Configuration):
+    """
+    Return the directory of the entry with the given configuration
+    """
+
+    return os.path.join(self.Directory, VoxelCache.getKey(Configuration))
+
+
+###################################################################################################
+
+
+  def load(self, Configuration):
+    """
+    Return the memory-mapped voxels stored for the given configuration, or None if there are none
+    """
+
+    Name = self.getEntryName(Configuration)
+
+    InfoFileName = os.path.join(Name, VoxelCache.InfoName)
+    if not os.path.exists(InfoFileName):
+      return None
+
+    with open(InfoFileName, "r") as f:
+      Info = json.load(f)
+
+    if Info["Version"] != VoxelCache.Version:
+      return None
+
+    Size = Info["NumberOfIndices"]
+    if Size == 0:
+      Indices = np.zeros(shape=(0), dtype="int64")
+      Values = np.zeros(shape=(0), dtype="float32")
+    else:
+      Indices = np.memmap(os.path.join(Name, "Indices.bin"), dtype="int64", mode="r", shape=(Size))
+      Values = np.memmap(os.path.join(Name, "Values.bin"), dtype="float32", mode="r", shape=(Size))
+
+    return SparseVoxelBatch(Indices, Values, Info["NumberOfEvents"], Info["XBins"], Info["YBins"], Info["ZBins"])
+
+
+###################################################################################################
+
+
+  def save(self, Configuration, Sparse):
+    """
+    Store the voxels for the given configuration
+    """
+
+    Name = self.getEntryName(Configuration)
+    os.makedirs(Name, exist_ok=True)
+
+    # Remove the description first, this way an interrupted write never looks like a valid entry
+    InfoFileName = os.path.join(Name, VoxelCache.InfoName)
+    if os.path.exists(InfoFileName):
+      os.remove(InfoFileName)
+
+    np.ascontiguousarray(Sparse.Indices, dtype="int64").tofile(os.path.join(Name, "Indices.bin"))
+    np.ascontiguousarray(Sparse.Values, dtype="float32").tofile(os.path.join(Name, "Values.bin"))
+
+    Info = { "Version": VoxelCache.Version, "NumberOfEvents": Sparse.NumberOfEvents, "NumberOfIndices": len(Sparse.Indices), "XBins": Sparse.XBins, "YBins": Sparse.YBins, "ZBins": Sparse.ZBins, "Configuration": Configuration }
+    with open(InfoFileName, "w") as f:
+      json.dump(Info, f, indent=2)
+
+
+###################################################################################################
+
+
+  def get(self, Configuration, Create):
+    """
+    Return the voxels for the given configuration: from the cache if they exist,
+    otherwise they are created by calling Create() and stored
+    """
+
+    Sparse = self.load(Configuration)
+    if Sparse is not None:
+      print("Info: Using the voxelized data sets from the voxel cache {}".format(self.getEntryName(Configuration)))
+      return Sparse
+
+    Sparse = Create()
+    self.save(Configuration, Sparse)
+    print("Info: Stored the voxelized data sets in the voxel cache {}".format(self.getEntryName(Configuration)))
+
+    return self.load(Configuration)
+
+
+# END
+###################################################################################################
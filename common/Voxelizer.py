@@ -0,0 +1,330 @@
+###################################################################################################
+#
+# Voxelizer.py
+#
+# Copyright (C) by Andreas Zoglauer.
+# All rights reserved.
+#
+# Please see the file License.txt in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+
+###################################################################################################
+
+
+import numpy as np
+
+
+###################################################################################################
+
+
+class SparseVoxelBatch:
+  """
+  This class stores the voxel tensors of a batch of events in sparse (COO) form: the flat indices
+  (event index * number of voxels + voxel index, sorted) and the float32 values of the non-empty voxels.
+  The events typically have only 5-50 hits, thus this is orders of magnitude smaller than the dense tensor.
+  """
+
+
+###################################################################################################
+
+
+  def __init__(self, Indices, Values, NumberOfEvents, XBins, YBins, ZBins):
+    """
+    The default constructor for class SparseVoxelBatch
+
+    Attributes
+    ----------
+    Indices : numpy array
+      The sorted, unique flat indices of the non-empty voxels
+    Values : numpy array
+      The energy in each of these voxels
+    NumberOfEvents : integer
+      The batch size
+    XBins, YBins, ZBins : integer
+      The number of voxels in each dimension
+
+    """
+
+    self.Indices = Indices
+    self.Values = Values.astype(np.float32, copy=False)
+    self.NumberOfEvents = NumberOfEvents
+    self.XBins = XBins
+    self.YBins = YBins
+    self.ZBins = ZBins
+
+    self.NumberOfVoxels = XBins * YBins * ZBins
+
+
+###################################################################################################
+
+
+  def __len__(self):
+    """
+    Return the number of events
+    """
+
+    return self.NumberOfEvents
+
+
+###################################################################################################
+
+
+  def getShape(self):
+    """
+    Return the shape of the dense tensor
+    """
+
+    return (self.NumberOfEvents, self.XBins, self.YBins, self.ZBins, 1)
+
+
+###################################################################################################
+
+
+  def getMemorySize(self):
+    """
+    Return the memory used by the sparse representation in bytes
+    """
+
+    return self.Indices.nbytes + self.Values.nbytes
+
+
+###################################################################################################
+
+
+  def getDenseMemorySize(self):
+    """
+    Return the memory a dense float32 tensor would require in bytes
+    """
+
+    return self.NumberOfEvents * self.NumberOfVoxels * np.dtype(np.float32).itemsize
+
+
+###################################################################################################
+
+
+  def getNumberOfFilledVoxels(self):
+    """
+    Return the number of non-empty voxels of each event
+    """
+
+    return np.bincount(self.Indices // self.NumberOfVoxels, minlength=self.NumberOfEvents)
+
+
+###################################################################################################
+
+
+  def slice(self, Begin, End):
+    """
+    Return the events Begin to End as a new sparse batch (the arrays are views)
+    """
+
+    Begin = max(0, min(Begin, self.NumberOfEvents))
+    End = max(Begin, min(End, self.NumberOfEvents))
+
+    First, Last = np.searchsorted(self.Indices, [ Begin * self.NumberOfVoxels, End * self.NumberOfVoxels ])
+
+    return SparseVoxelBatch(self.Indices[First:Last] - Begin * self.NumberOfVoxels, self.Values[First:Last], End - Begin, self.XBins, self.YBins, self.ZBins)
+
+
+###################################################################################################
+
+
+  def toDense(self, Out = None):
+    """
+    Return the dense float32 tensor of shape (NumberOfEvents, XBins, YBins, ZBins, 1).
+    If given, it is written into Out, a float32 array with at least as many (zero) elements, see Voxelizer.densify
+    """
+
+    if Out is None:
+      Out = np.zeros(shape=(self.NumberOfEvents * self.NumberOfVoxels), dtype=np.float32)
+
+    Tensor = Out.reshape(-1)[:self.NumberOfEvents * self.NumberOfVoxels]
+    Tensor[self.Indices] = self.Values
+
+    return Tensor.reshape(self.getShape())
+
+
+###################################################################################################
+
+
+class Voxelizer:
+  """
+  This class converts the hits of a batch of events into the voxel tensor (BatchSize, XBins, YBins, ZBins, 1)
+  used as input of the 3D convolutional networks. All hits of the batch are binned at once, hits outside
+  the volume are ignored. The tensors can also be kept in sparse form and densified only right before they
+  are handed to the network, into a buffer which is reused between calls. A typical usage would look like this:
+
+  Voxels = Voxelizer(32, 32, 64, -43, 43, -43, 43, 13, 45)
+  InputTensor = Voxels.voxelizeBatch(Batch.slice(0, 128))
+
+  Sparse = Voxels.voxelizeBatchSparse(Batch)
+  for b in range(0, len(Batch) // 128):
+    model.fit(Voxels.densify(Sparse.slice(b*128, (b+1)*128)), ...)
+
+  """
+
+
+###################################################################################################
+
+
+  def __init__(self, XBins, YBins, ZBins, XMin, XMax, YMin, YMax, ZMin, ZMax):
+    """
+    The default constructor for class Voxelizer
+
+    Attributes
+    ----------
+    XBins, YBins, ZBins : integer
+      The number of voxels in each dimension
+    XMin, XMax, YMin, YMax, ZMin, ZMax : float
+      The volume covered by the voxels
+
+    """
+
+    self.XBins = XBins
+    self.YBins = YBins
+    self.ZBins = ZBins
+
+    self.XMin = XMin
+    self.XMax = XMax
+    self.YMin = YMin
+    self.YMax = YMax
+    self.ZMin = ZMin
+    self.ZMax = ZMax
+
+    self.NumberOfVoxels = XBins * YBins * ZBins
+
+    # The reused buffers of densify() and the indices set at their last call, by slot
+    self.Buffers = {}
+    self.BufferIndices = {}
+
+
+###################################################################################################
+
+
+  def getConfiguration(self):
+    """
+    Return the binning as dictionary (e.g. as part of the key of a VoxelCache)
+    """
+
+    return { "XBins": self.XBins, "YBins": self.YBins, "ZBins": self.ZBins, "XMin": self.XMin, "XMax": self.XMax, "YMin": self.YMin, "YMax": self.YMax, "ZMin": self.ZMin, "ZMax": self.ZMax }
+
+
+###################################################################################################
+
+
+  def getVoxelIndices(self, X, Y, Z):
+    """
+    Return the flat voxel index of each hit (x major, z minor, as in the tensor) and whether the hit is inside the volume
+    """
+
+    XBin = np.floor((np.asarray(X) - self.XMin) / ((self.XMax - self.XMin) / self.XBins)).astype(np.int64)
+    YBin = np.floor((np.asarray(Y) - self.YMin) / ((self.YMax - self.YMin) / self.YBins)).astype(np.int64)
+    ZBin = np.floor((np.asarray(Z) - self.ZMin) / ((self.ZMax - self.ZMin) / self.ZBins)).astype(np.int64)
+
+    Inside = (XBin >= 0) & (YBin >= 0) & (ZBin >= 0) & (XBin < self.XBins) & (YBin < self.YBins) & (ZBin < self.ZBins)
+
+    return (XBin * self.YBins + YBin) * self.ZBins + ZBin, Inside
+
+
+###################################################################################################
+
+
+  def voxelizeSparse(self, EventIndices, X, Y, Z, E, NumberOfEvents, Sum = True):
+    """
+    Convert the hits of a batch of events into the sparse voxel representation
+
+    Attributes
+    ----------
+    EventIndices : numpy array
+      The index of the event in the batch for each hit
+    X, Y, Z, E : numpy arrays
+      The hit positions and energies
+    NumberOfEvents : integer
+      The batch size
+    Sum : bool
+      If True, the energies of hits in the same voxel are summed, otherwise the last hit determines the energy
+
+    Returns
+    -------
+    SparseVoxelBatch
+      The non-empty voxels
+
+    """
+
+    VoxelIndices, Inside = self.getVoxelIndices(X, Y, Z)
+
+    Indices = np.asarray(EventIndices, dtype=np.int64)[Inside] * self.NumberOfVoxels + VoxelIndices[Inside]
+    Energies = np.asarray(E)[Inside]
+
+    if Sum == True:
+      UniqueIndices, Inverse = np.unique(Indices, return_inverse=True)
+      Values = np.bincount(Inverse, weights=Energies, minlength=len(UniqueIndices))
+    else:
+      # The first occurrence in the reversed list is the last hit in the voxel
+      UniqueIndices, Last = np.unique(Indices[::-1], return_index=True)
+      Values = Energies[::-1][Last]
+
+    return SparseVoxelBatch(UniqueIndices, Values, NumberOfEvents, self.XBins, self.YBins, self.ZBins)
+
+
+###################################################################################################
+
+
+  def voxelize(self, EventIndices, X, Y, Z, E, NumberOfEvents, Sum = True):
+    """
+    Convert the hits of a batch of events into a new dense float32 tensor of shape (NumberOfEvents, XBins, YBins, ZBins, 1), see voxelizeSparse
+    """
+
+    return self.voxelizeSparse(EventIndices, X, Y, Z, E, NumberOfEvents, Sum).toDense()
+
+
+###################################################################################################
+
+
+  def voxelizeBatchSparse(self, Batch, Sum = True):
+    """
+    Convert all events of an EventBatch into the sparse voxel representation, see voxelizeSparse
+    """
+
+    return self.voxelizeSparse(Batch.getEventIndices(), Batch.X, Batch.Y, Batch.Z, Batch.E, len(Batch), Sum)
+
+
+###################################################################################################
+
+
+  def voxelizeBatch(self, Batch, Sum = True):
+    """
+    Convert all events of an EventBatch into a new dense tensor, see voxelizeSparse
+    """
+
+    return self.voxelizeBatchSparse(Batch, Sum).toDense()
+
+
+###################################################################################################
+
+
+  def densify(self, Sparse, Slot = 0):
+    """
+    Write a sparse voxel batch into the reused float32 buffer of this voxelizer and return it as tensor.
+    Only the voxels set at the previous call are cleared, not the full buffer.
+    The returned tensor is only valid until the next call with the same slot, thus it must not be kept.
+    Different slots use different buffers, e.g. one per batch which can be in the queue of a BatchPrefetcher.
+    """
+
+    Size = Sparse.NumberOfEvents * self.NumberOfVoxels
+    if Slot not in self.Buffers or len(self.Buffers[Slot]) < Size:
+      self.Buffers[Slot] = np.zeros(shape=(Size), dtype=np.float32)
+    else:
+      self.Buffers[Slot][self.BufferIndices[Slot]] = 0
+
+    self.BufferIndices[Slot] = Sparse.Indices
+
+    return Sparse.toDense(self.Buffers[Slot])
+
+
+# END
+###################################################################################################
@@ -0,0 +1,242 @@
+###################################################################################################
+#
+# ComptonToyModel.py
+#
+# Copyright (C) by Andreas Zoglauer.
+# All rights reserved.
+#
+# Please see the file License.txt in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+
+###################################################################################################
+
+
+import numpy as np
+
+# Requires the common directory of the main repository in the python path
+from EventCache import EventCache
+from EventBatch import EventBatch
+from VectorTools import directionsFromThetaPhi, randomDirections, rotateReferenceFrame
+
+
+###################################################################################################
+
+
+class ComptonToyModel:
+  """
+  This class generates many toy-model Compton events at once, with the same physics as
+  EventData.createFromToyModel, but with numpy instead of one event at a time and without ROOT.
+  A typical usage would look like this:
+
+  ToyModel = ComptonToyModel(Seed=42)
+  Batch = ToyModel.generate(100000)
+
+  """
+
+
+###################################################################################################
+
+
+  def __init__(self, Energy = 2000, MaxHits = 100, Seed = None):
+    """
+    The default constructor for class ComptonToyModel
+
+    Attributes
+    ----------
+    Energy : float
+      The initial gamma-ray energy in keV
+    MaxHits : integer
+      The maximum number of hits per event (as EventData.MaxHits)
+    Seed : integer, SeedSequence, or Generator
+      The seed of the random number generator
+
+    """
+
+    self.Energy = Energy
+    self.MaxHits = MaxHits
+    self.Generator = np.random.default_rng(Seed)
+
+    # Electron rest mass in keV
+    self.E0 = 510.998910
+
+
+###################################################################################################
+
+
+  def sampleCompton(self, NumberOfEvents):
+    """
+    Sample the Compton scatter according to Butcher & Messel: Nuc Phys 20(1960), 15
+    Rejected events are re-drawn until all are accepted.
+
+    Returns
+    -------
+    numpy arrays
+      Epsilon (the ratio scattered to initial gamma-ray energy), OneMinusCosTheta, SinThetaSquared
+
+    """
+
+    Ei_m = self.Energy / self.E0
+
+    Epsilon0 = 1./(1. + 2.*Ei_m)
+    Epsilon0Square = Epsilon0*Epsilon0
+    Alpha1 = - np.log(Epsilon0)
+    Alpha2 = 0.5*(1.- Epsilon0Square)
+
+    Epsilon = np.zeros(shape=(NumberOfEvents))
+    OneMinusCosTheta = np.zeros(shape=(NumberOfEvents))
+    SinThetaSquared = np.zeros(shape=(NumberOfEvents))
+
+    Pending = np.arange(NumberOfEvents)
+    while len(Pending) > 0:
+      N = len(Pending)
+
+      UseFirst = Alpha1/(Alpha1+Alpha2) > self.Generator.random(N)
+      EpsilonTry = np.where(UseFirst, np.exp(-Alpha1*self.Generator.random(N)), np.sqrt(Epsilon0Square + (1.0 - Epsilon0Square)*self.Generator.random(N)))
+
+      OneMinusCosThetaTry = (1.- EpsilonTry)/(EpsilonTry*Ei_m)
+      SinThetaSquaredTry = OneMinusCosThetaTry*(2.-OneMinusCosThetaTry)
+      Reject = 1.0 - EpsilonTry*SinThetaSquaredTry/(1.0 + EpsilonTry*EpsilonTry)
+
+      Accepted = Reject < self.Generator.random(N)
+      Epsilon[Pending[Accepted]] = EpsilonTry[Accepted]
+      OneMinusCosTheta[Pending[Accepted]] = OneMinusCosThetaTry[Accepted]
+      SinThetaSquared[Pending[Accepted]] = SinThetaSquaredTry[Accepted]
+
+      Pending = Pending[~Accepted]
+
+    return Epsilon, OneMinusCosTheta, SinThetaSquared
+
+
+###################################################################################################
+
+
+  def generate(self, NumberOfEvents, FirstEventID = 0):
+    """
+    Generate the given number of events
+
+    Returns
+    -------
+    EventBatch
+      The events, their IDs start with FirstEventID
+
+    """
+
+    N = NumberOfEvents
+    Ei = self.Energy
+
+    # Random initial direction
+    Di = randomDirections(self.Generator, N)
+
+    # Start position (randomly within a certian volume)
+    xi = 40.0 * (self.Generator.random(N) - 0.5)
+    yi = 40.0 * (self.Generator.random(N) - 0.5)
+    zi = np.trunc(40.0 * (self.Generator.random(N) - 0.5))
+
+    # The Compton scatter
+    Epsilon, OneMinusCosTheta, SinThetaSquared = self.sampleCompton(N)
+
+    CosTheta = 1.0 - OneMinusCosTheta
+    Phi = 2*np.pi * self.Generator.random(N)
+
+    # Set the new photon and electron parameters relative to original direction
+    Eg = Epsilon*Ei
+    Ee = Ei - Eg
+
+    Dg = rotateReferenceFrame(directionsFromThetaPhi(np.arccos(np.clip(CosTheta, -1.0, 1.0)), Phi), Di)
+
+    Me = np.sqrt(Ee*(Ee+2.0*self.E0))
+    De = (Ei * Di - Eg[:, np.newaxis] * Dg) / Me[:, np.newaxis]
+
+
+    # Track all electrons in parallel, one step per iteration for the events whose electron still has energy
+    Position = np.stack((xi, yi, zi), axis=-1)
+
+    HitEvents = []
+    HitPositions = []
+    HitEnergies = []
+
+    Active = np.flatnonzero(Ee > 0)
+    Step = 0
+    while len(Active) > 0 and Step < self.MaxHits - 3:
+      A = len(Active)
+      EeActive = Ee[Active]
+
+      # Draw the deposit until it is positive
+      dE = np.zeros(shape=(A))
+      Pending = np.arange(A)
+      while len(Pending) > 0:
+        dE[Pending] = self.Generator.normal(10*np.sqrt(Ei-EeActive[Pending]), 0.1*np.sqrt(EeActive[Pending]))
+        Pending = Pending[dE[Pending] <= 0]
+
+      if Step == 0:
+        dE *= self.Generator.random(A)
+
+      dE = np.minimum(dE, EeActive)
+
+      HitEvents.append(Active)
+      HitPositions.append(Position[Active])
+      HitEnergies.append(dE)
+
+      Ee[Active] -= dE
+
+      dAngle = (Ei - Ee[Active]) * 0.4*np.pi / Ei
+      dEe = directionsFromThetaPhi(dAngle, 2.0 * np.pi * self.Generator.random(A))
+
+      De[Active] = rotateReferenceFrame(De[Active], dEe)
+
+      Distance = 2.0 + 3.0 * self.Generator.random(A)
+      Position[Active] += Distance[:, np.newaxis] * De[Active]
+
+      Active = Active[Ee[Active] > 0]
+      Step += 1
+
+
+    # Track the gamma ray
+    Distance = 10.0 + 10.0 * self.Generator.random(N)
+
+    HitEvents.append(np.arange(N))
+    HitPositions.append(np.stack((xi, yi, zi), axis=-1) + Distance[:, np.newaxis] * Dg)
+    HitEnergies.append(Eg)
+
+
+    # Order the hits by event, and within each event by step, the gamma ray last
+    HitEvents = np.concatenate(HitEvents)
+    Order = np.argsort(HitEvents, kind="stable")
+    HitEvents = HitEvents[Order]
+    HitPositions = np.concatenate(HitPositions)[Order]
+    HitEnergies = np.concatenate(HitEnergies)[Order]
+
+    NumberOfHits = np.bincount(HitEvents, minlength=N)
+    Offsets = np.zeros(shape=(N+1), dtype="int64")
+    np.cumsum(NumberOfHits, out=Offsets[1:])
+
+    # IDs start with 1 in each event, the electron hits originate from the previous hit, the gamma hit from hit 1
+    ID = np.arange(len(HitEvents)) - np.repeat(Offsets[:-1], NumberOfHits) + 1
+    IsGamma = np.zeros(shape=(len(HitEvents)), dtype=bool)
+    IsGamma[Offsets[1:] - 1] = True
+
+    Columns = { "Offsets": Offsets }
+    Columns["X"] = HitPositions[:, 0].astype(EventCache.HitColumns["X"])
+    Columns["Y"] = HitPositions[:, 1].astype(EventCache.HitColumns["Y"])
+    Columns["Z"] = HitPositions[:, 2].astype(EventCache.HitColumns["Z"])
+    Columns["E"] = HitEnergies.astype(EventCache.HitColumns["E"])
+    Columns["Type"] = np.where(IsGamma, b"g", b"e").astype(EventCache.HitColumns["Type"])
+    Columns["Origin"] = np.where(IsGamma, 1, ID - 1).astype(EventCache.HitColumns["Origin"])
+    Columns["ID"] = ID.astype(EventCache.HitColumns["ID"])
+
+    Columns["EventID"] = np.arange(FirstEventID, FirstEventID + N, dtype=EventCache.EventColumns["EventID"])
+    Columns["OriginPositionX"] = xi
+    Columns["OriginPositionY"] = yi
+    Columns["OriginPositionZ"] = zi
+    Columns["GammaEnergy"] = np.full(N, float(Ei))
+    Columns["EventType"] = np.zeros(shape=(N), dtype=EventCache.EventColumns["EventType"])
+
+    return EventBatch(Columns)
+
+
+# END
+###################################################################################################
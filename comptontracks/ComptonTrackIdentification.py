@@ -88,6 +88,11 @@ parser.add_argument('-f', '--filename', default='ComptonTrackIdentification.p1.s
 parser.add_argument('-m', '--maxevents', default='10000', help='Maximum number of events to use')
 parser.add_argument('-s', '--testingtrainingsplit', default='0.1', help='Testing-training split')
 parser.add_argument('-b', '--batchsize', default='128', help='Batch size')
+parser.add_argument('-c', '--cache', default='', help='Event cache directory: Created from the sim file at the first run, used instead of the sim file afterwards')
+parser.add_argument('-j', '--jobs', default='1', help='Number of processes parsing the sim file (or all parts X.p1.sim.gz, X.p2.sim.gz, ... of a multi-threaded cosima run), 0 for all cores')
+parser.add_argument('-w', '--prefetchworkers', default='2', help='Number of threads preparing the next training batches while the current one is trained')
+parser.add_argument('-q', '--prefetchdepth', default='4', help='Number of training batches prepared ahead')
+parser.add_argument('-v', '--voxelcache', default='', help='Voxel cache directory: The voxelized data sets are stored there at the first run, and reused as long as input file, binning, and selection do not change')
 
 args = parser.parse_args()
 
@@ -103,6 +108,16 @@ if int(args.batchsize) >= 16:
 if float(args.testingtrainingsplit) >= 0.05:
    TestingTrainingSplit = float(args.testingtrainingsplit)
 
+CacheName = args.cache
+VoxelCacheName = args.voxelcache
+
+PrefetchWorkers = int(args.prefetchworkers)
+PrefetchDepth = int(args.prefetchdepth)
+
+NumberOfJobs = int(args.jobs)
+if NumberOfJobs == 0:
+  NumberOfJobs = os.cpu_count()
+
 
 
 if os.path.exists(OutputDirectory):
@@ -136,6 +151,15 @@ signal.signal(signal.SIGINT, signal_handler)
 # Everything ROOT related can only be loaded here otherwise it interferes with the argparse
 from EventData import EventData
 
+# The shared tools are in the common directory of the main repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from EventCache import EventCache, EventCollection, convertSimFile
+from EventBatch import EventBatch
+from SimFileReader import iterateSimFiles
+from Voxelizer import Voxelizer
+from VoxelCache import VoxelCache
+from BatchPrefetcher import BatchPrefetcher
+
 # Load MEGAlib into ROOT so that it is usable
 import ROOT as M
 M.gSystem.Load("$(MEGALIB)/lib/libMEGAlib.so")
@@ -148,49 +172,105 @@ M.PyConfig.IgnoreCommandLineOptions = True
 ###################################################################################################
 
 
-# Read the simulation file data:
-DataSets = []
+# The accepted events are collected in chunks of this many events
+ChunkSize = 10000
 
 
-# Load geometry:
-Geometry = M.MDGeometryQuest()
-if Geometry.ScanSetupFile(M.MString(GeometryName)) == True:
-  print("Geometry " + GeometryName + " loaded!")
-else:
-  print("Unable to load geometry " + GeometryName + " - Aborting!")
-  quit()
+# Returns the parsed event or None, used to create the event cache
+def parseEvent(Event):
+  Data = EventData()
+  if Data.parse(Event) == True:
+    return Data
+  return None
 
 
-Reader = M.MFileEventsSim(Geometry)
-if Reader.Open(M.MString(FileName)) == False:
-  print("Unable to open file " + FileName + ". Aborting!")
-  quit()
+# Returns the events of the batch which pass the selection
+def selectDataSets(Batch):
+  Batch.center()
+
+  return Batch.select((Batch.hasHitsOutside(XMin, XMax, YMin, YMax, ZMin, ZMax) == False) & Batch.isOriginInside(XMin, XMax, YMin, YMax, ZMin, ZMax))
+
+
+# The event cache is created once from the full sim file, then all later runs only read the cache
+if CacheName != "" and EventCache.exists(CacheName) == False:
+  try:
+    convertSimFile(FileName, CacheName, parseEvent, GeometryName, NumberOfWorkers=NumberOfJobs)
+  except IOError as Error:
+    print("Unable to create the event cache: {} - Aborting!".format(Error))
+    quit()
+
+
+# Otherwise, in parallel mode, the sim file(s) are parsed by a process pool chunk by chunk, until enough data sets are selected
+Caches = None
+SimFileChunks = None
+if CacheName != "":
+  print("\n\nStarted reading data sets from event cache {}".format(CacheName))
+  Caches = [ EventCache(CacheName) ]
+elif NumberOfJobs > 1:
+  print("\n\nStarted reading data sets with {} processes".format(NumberOfJobs))
+  SimFileChunks = iterateSimFiles(FileName, parseEvent, GeometryName, NumberOfJobs)
+  Caches = ( EventCache(Columns=Columns) for Columns in SimFileChunks )
 
 
-print("\n\nStarted reading data sets")
+Chunks = []
 NumberOfDataSets = 0
-while True:
-  Event = Reader.GetNextEvent()
-  if not Event:
-    break
+if Caches is not None:
+  for Cache in Caches:
+    for Begin in range(0, len(Cache), ChunkSize):
+      Chunks.append(selectDataSets(EventBatch.fromCache(Cache, Begin, Begin + ChunkSize)))
+      NumberOfDataSets += len(Chunks[-1])
+      print("Data sets processed: {}".format(NumberOfDataSets))
 
-  if Event.GetNIAs() > 0:
-    Data = EventData()
-    if Data.parse(Event) == True:
-      Data.center()
+      if NumberOfDataSets >= MaxEvents:
+        break
 
-      if Data.hasHitsOutside(XMin, XMax, YMin, YMax, ZMin, ZMax) == False and Data.isOriginInside(XMin, XMax, YMin, YMax, ZMin, ZMax) == True:
-        DataSets.append(Data)
-        NumberOfDataSets += 1
+    if NumberOfDataSets >= MaxEvents:
+      break
 
-        if NumberOfDataSets > 0 and NumberOfDataSets % 1000 == 0:
-          print("Data sets processed: {}".format(NumberOfDataSets))
+  # Stop the process pool, the rest of the sim file is not needed
+  if SimFileChunks is not None:
+    SimFileChunks.close()
 
-  if NumberOfDataSets >= MaxEvents:
-    break
+else:
+  # Load geometry:
+  Geometry = M.MDGeometryQuest()
+  if Geometry.ScanSetupFile(M.MString(GeometryName)) == True:
+    print("Geometry " + GeometryName + " loaded!")
+  else:
+    print("Unable to load geometry " + GeometryName + " - Aborting!")
+    quit()
+
+
+  Reader = M.MFileEventsSim(Geometry)
+  if Reader.Open(M.MString(FileName)) == False:
+    print("Unable to open file " + FileName + ". Aborting!")
+    quit()
+
+
+  print("\n\nStarted reading data sets")
+  Events = EventCollection()
+  while NumberOfDataSets < MaxEvents:
+    Event = Reader.GetNextEvent()
+    if Event and Event.GetNIAs() > 0:
+      Data = parseEvent(Event)
+      if Data is not None:
+        Events.add(Data, EventID=Event.GetID())
 
+    # The selection is applied to a whole chunk of parsed events at once
+    if len(Events) >= ChunkSize or (not Event and len(Events) > 0):
+      Chunks.append(selectDataSets(EventBatch(Events.get())))
+      NumberOfDataSets += len(Chunks[-1])
+      print("Data sets processed: {}".format(NumberOfDataSets))
+      Events = EventCollection()
 
-print("Info: Parsed {} events".format(NumberOfDataSets))
+    if not Event:
+      break
+
+
+# All data sets as one batch
+DataSets = EventBatch.concatenate(Chunks).slice(0, MaxEvents) if len(Chunks) > 0 else EventBatch(EventCollection().get())
+
+print("Info: Parsed {} events".format(len(DataSets)))
 
 
 
@@ -208,24 +288,37 @@ if NTestingBatches == 0:
   NTestingBatches = 1
 NTrainingBatches = NBatches - NTestingBatches
 
-# Now split the actual data:
-TrainingDataSets = []
-for i in range(0, NTrainingBatches * BatchSize):
-  TrainingDataSets.append(DataSets[i])
+# Now split the actual data (views, no copies):
+TrainingDataSets = DataSets.slice(0, NTrainingBatches * BatchSize)
+TestingDataSets = DataSets.slice(NTrainingBatches * BatchSize, (NTrainingBatches + NTestingBatches) * BatchSize)
 
-
-TestingDataSets = []
-for i in range(0,NTestingBatches*BatchSize):
-   TestingDataSets.append(DataSets[NTrainingBatches * BatchSize + i])
+TrainingUniqueZ = TrainingDataSets.getNumberOfUniqueZ()
+TestingUniqueZ = TestingDataSets.getNumberOfUniqueZ()
 
 
 NumberOfTrainingEvents = len(TrainingDataSets)
 NumberOfTestingEvents = len(TestingDataSets)
 
-print(np.unique(np.array([event.unique for event in TestingDataSets])))
+print(np.unique(TestingUniqueZ))
 
 print("Info: Number of training data sets: {}   Number of testing data sets: {} (vs. input: {} and split ratio: {})".format(NumberOfTrainingEvents, NumberOfTestingEvents, len(DataSets), TestingTrainingSplit))
 
+# Converts the hits into the input tensor:
+# All events are voxelized once into the compact sparse form, each batch is densified only before handing it to the network
+Voxels = Voxelizer(XBins, YBins, ZBins, XMin, XMax, YMin, YMax, ZMin, ZMax)
+
+# With a voxel cache, this is done only once for a given input file, binning, and selection
+if VoxelCacheName != "":
+  VoxelConfiguration = { "Input": VoxelCache.describeFile(CacheName if CacheName != "" else FileName), "MaxEvents": MaxEvents, "Selection": "Compton track identification: centered, all hits and the origin inside the volume", "Voxelizer": Voxels.getConfiguration(), "Sum": False }
+  AllVoxels = VoxelCache(VoxelCacheName).get(VoxelConfiguration, lambda: Voxels.voxelizeBatchSparse(DataSets, Sum=False))
+else:
+  AllVoxels = Voxels.voxelizeBatchSparse(DataSets, Sum=False)
+
+TrainingVoxels = AllVoxels.slice(0, NTrainingBatches * BatchSize)
+TestingVoxels = AllVoxels.slice(NTrainingBatches * BatchSize, (NTrainingBatches + NTestingBatches) * BatchSize)
+
+print("Info: Memory of the voxelized data sets: {:.1f} MB (dense: {:.1f} MB)".format((TrainingVoxels.getMemorySize() + TestingVoxels.getMemorySize())/1024/1024, (TrainingVoxels.getDenseMemorySize() + TestingVoxels.getDenseMemorySize())/1024/1024))
+
 
 
 
@@ -341,10 +434,9 @@ TrainingPredictedLayer = np.array([])
 TrainingUniqueZLayer = np.array([])
 
 # Helper method
-def getRealAndPredictedLayers(OutputDataSpaceSize, OutputTensor, Result, e, Event):
+def getRealAndPredictedLayers(OutputDataSpaceSize, OutputTensor, Result, e, unique):
     real = -1
     predicted = -1
-    unique = Event.unique
     predicted = np.argmax(Result[e])
     for l in range(0, OutputDataSpaceSize):
         if OutputTensor[e][l] > 0.5:
@@ -367,37 +459,24 @@ def CheckPerformance():
   for Batch in range(0, NTestingBatches):
 
     # Step 1.1: Convert the data set into the input and output tensor
-    InputTensor = np.zeros(shape=(BatchSize, XBins, YBins, ZBins, 1))
-    OutputTensor = np.zeros(shape=(BatchSize, OutputDataSpaceSize))
-
+    Events = TestingDataSets.slice(Batch*BatchSize, (Batch+1)*BatchSize)
 
-    # Loop over all testing  data sets and add them to the tensor
-    for e in range(0, BatchSize):
-      Event = TestingDataSets[e + Batch*BatchSize]
-      # Set the layer in which the event happened
-
-      LayerBin = int ((Event.OriginPositionZ - ZMin) / ((ZMax- ZMin)/ ZBins) )
-      #print("layer bin: {} {}".format(Event.OriginPositionZ, LayerBin))
-
-      if LayerBin < 0 or LayerBin >= OutputDataSpaceSize:
-        print("Error: The calculated layer bin ({}) is out of bounds [0, {}]".format(LayerBin, OutputDataSpaceSize-1))
-      else:
-        OutputTensor[e][LayerBin] = 1
+    # Set all the hit locations and energies
+    Sparse = TestingVoxels.slice(Batch*BatchSize, (Batch+1)*BatchSize)
+    # The prefetcher only uses the slots below NumberOfSlots, its threads might still be filling them
+    InputTensor = Voxels.densify(Sparse, Prefetcher.NumberOfSlots)
+    OutputTensor = np.zeros(shape=(BatchSize, OutputDataSpaceSize))
 
-      # Set all the hit locations and energies
-      SomethingAdded = False
-      for h in range(0, len(Event.X)):
-        XBin = int( (Event.X[h] - XMin) / ((XMax - XMin) / XBins) )
-        YBin = int( (Event.Y[h] - YMin) / ((YMax - YMin) / YBins) )
-        ZBin = int( (Event.Z[h] - ZMin) / ((ZMax - ZMin) / ZBins) )
-        #print("hit z bin: {} {}".format(Event.Z[h], ZBin))
-        if XBin >= 0 and YBin >= 0 and ZBin >= 0 and XBin < XBins and YBin < YBins and ZBin < ZBins:
-          InputTensor[e][XBin][YBin][ZBin][0] = Event.E[h]
-          SomethingAdded = True
+    # Set the layer in which the event happened
+    LayerBins = ((Events.OriginPositionZ - ZMin) / ((ZMax- ZMin)/ ZBins)).astype(int)
+    for e in np.flatnonzero((LayerBins < 0) | (LayerBins >= OutputDataSpaceSize)):
+      print("Error: The calculated layer bin ({}) is out of bounds [0, {}]".format(LayerBins[e], OutputDataSpaceSize-1))
+    IsInside = (LayerBins >= 0) & (LayerBins < OutputDataSpaceSize)
+    OutputTensor[np.flatnonzero(IsInside), LayerBins[IsInside]] = 1
 
-      if SomethingAdded == False:
-        print("Nothing added for event {}".format(Event.ID))
-        Event.print()
+    for e in np.flatnonzero(Sparse.getNumberOfFilledVoxels() == 0):
+      print("Nothing added for event {}".format(Events.EventID[e]))
+      Events[e].print()
 
 
     # Step 2: Run it
@@ -408,7 +487,6 @@ def CheckPerformance():
     #print(OutputTensor[e])
 
     for e in range(0, BatchSize):
-      Event = TestingDataSets[e + Batch*BatchSize]
       TotalEvents += 1
       IsBad = False
       LargestValueBin = 0
@@ -428,7 +506,7 @@ def CheckPerformance():
         #  break
 
       # Fetch real and predicted layers for testing data
-      real, predicted, uniqueZ = getRealAndPredictedLayers(OutputDataSpaceSize, OutputTensor, Result, e, Event)
+      real, predicted, uniqueZ = getRealAndPredictedLayers(OutputDataSpaceSize, OutputTensor, Result, e, TestingUniqueZ[e + Batch*BatchSize])
       global TestingRealLayer
       global TestingPredictedLayer
       global TestingUniqueZLayer
@@ -463,6 +541,27 @@ def CheckPerformance():
 
   return Improvement
 
+# Returns the input and output tensor of a training batch, called by the prefetcher in its worker threads
+def makeTrainingBatch(Batch, Slot):
+  Events = TrainingDataSets.slice(Batch*BatchSize, (Batch+1)*BatchSize)
+
+  # Set all the hit locations and energies, each prefetcher slot has its own buffer
+  InputTensor = Voxels.densify(TrainingVoxels.slice(Batch*BatchSize, (Batch+1)*BatchSize), Slot)
+  OutputTensor = np.zeros(shape=(BatchSize, OutputDataSpaceSize))
+
+  # Set the layer in which the event happened, the last one if outside
+  IsInside = (Events.OriginPositionZ > ZMin) & (Events.OriginPositionZ < ZMax)
+  LayerBins = np.full(BatchSize, OutputDataSpaceSize-1)
+  LayerBins[IsInside] = ((Events.OriginPositionZ[IsInside] - ZMin) / ((ZMax- ZMin)/ ZBins)).astype(int)
+  OutputTensor[np.arange(BatchSize), LayerBins] = 1
+
+  return InputTensor, OutputTensor
+
+
+# The next training batches are prepared while the current one is trained
+Prefetcher = BatchPrefetcher(makeTrainingBatch, NTrainingBatches, PrefetchWorkers, PrefetchDepth)
+
+
 # Main training and evaluation loop
 
 TimeConverting = 0.0
@@ -478,33 +577,8 @@ while Iteration < MaxIterations:
   print("\n\nStarting iteration {}".format(Iteration))
 
   # Step 1: Loop over all training batches
-  for Batch in range(0, NTrainingBatches):
-
-    # Step 1.1: Convert the data set into the input and output tensor
-    TimerConverting = time.time()
-
-    InputTensor = np.zeros(shape=(BatchSize, XBins, YBins, ZBins, 1))
-    OutputTensor = np.zeros(shape=(BatchSize, OutputDataSpaceSize))
-
-    # Loop over all training data sets and add them to the tensor
-    for g in range(0, BatchSize):
-      Event = TrainingDataSets[g + Batch*BatchSize]
-      # Set the layer in which the event happened
-      if Event.OriginPositionZ > ZMin and Event.OriginPositionZ < ZMax:
-        LayerBin = int ((Event.OriginPositionZ - ZMin) / ((ZMax- ZMin)/ ZBins) )
-        OutputTensor[g][LayerBin] = 1
-      else:
-        OutputTensor[g][OutputDataSpaceSize-1] = 1
-
-      # Set all the hit locations and energies
-      for h in range(0, len(Event.X)):
-        XBin = int( (Event.X[h] - XMin) / ((XMax - XMin) / XBins) )
-        YBin = int( (Event.Y[h] - YMin) / ((YMax - YMin) / YBins) )
-        ZBin = int( (Event.Z[h] - ZMin) / ((ZMax - ZMin) / ZBins) )
-        if XBin >= 0 and YBin >= 0 and ZBin >= 0 and XBin < XBins and YBin < YBins and ZBin < ZBins:
-          InputTensor[g][XBin][YBin][ZBin][0] = Event.E[h]
-
-    TimeConverting += time.time() - TimerConverting
+  # Step 1.1: The input and output tensors are converted by the prefetcher, the converting time is the time waited for them
+  for Batch, (InputTensor, OutputTensor) in enumerate(Prefetcher):
 
     # Step 1.2: Perform the actual training
     TimerTraining = time.time()
@@ -517,9 +591,8 @@ while Iteration < MaxIterations:
     Result = model.predict(InputTensor)
 
     for e in range(0, BatchSize):
-        Event = TrainingDataSets[e + Batch*BatchSize]
         # Fetch real and predicted layers for training data
-        real, predicted, uniqueZ = getRealAndPredictedLayers(OutputDataSpaceSize, OutputTensor, Result, e, Event)
+        real, predicted, uniqueZ = getRealAndPredictedLayers(OutputDataSpaceSize, OutputTensor, Result, e, TrainingUniqueZ[e + Batch*BatchSize])
         TrainingRealLayer = np.append(TrainingRealLayer, real)
         TrainingPredictedLayer = np.append(TrainingPredictedLayer, predicted)
         TrainingUniqueZLayer = np.append(TrainingUniqueZLayer, uniqueZ)
@@ -556,9 +629,12 @@ while Iteration < MaxIterations:
   # Take care of Ctrl-C
   if Interrupted == True: break
 
+  TimeConverting = Prefetcher.StallTime
+
   print("\n\nTotal time converting per Iteration: {} sec".format(TimeConverting/Iteration))
   print("Total time training per Iteration:   {} sec".format(TimeTraining/Iteration))
   print("Total time testing per Iteration:    {} sec".format(TimeTesting/Iteration))
+  Prefetcher.printStatistics(Iteration)
 
 # End: for all iterations
 
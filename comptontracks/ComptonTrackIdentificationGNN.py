@@ -47,6 +47,12 @@ print("============================\n")
 
 UseToyModel = True
 
+# Number of training epochs
+NumberOfEpochs = 50
+
+# Number of threads creating the graph batches while training
+NumberOfWorkers = 2
+
 # Split between training and testing data
 TestingTrainingSplit = 0.1
 
@@ -62,6 +68,8 @@ parser.add_argument('-f', '--filename', default='ComptonTrackIdentification.p1.s
 parser.add_argument('-m', '--maxevents', default='10000', help='Maximum number of events to use')
 parser.add_argument('-s', '--testingtrainingsplit', default='0.1', help='Testing-training split')
 parser.add_argument('-b', '--batchsize', default='128', help='Batch size')
+parser.add_argument('-e', '--epochs', default='50', help='Number of training epochs')
+parser.add_argument('-w', '--workers', default='2', help='Number of threads creating the graph batches while training')
 
 args = parser.parse_args()
 
@@ -77,6 +85,12 @@ if int(args.batchsize) >= 16:
 if float(args.testingtrainingsplit) >= 0.05:
    TestingTrainingSplit = float(args.testingtrainingsplit)
 
+if int(args.epochs) >= 1:
+  NumberOfEpochs = int(args.epochs)
+
+if int(args.workers) >= 1:
+  NumberOfWorkers = int(args.workers)
+
 
 
 if os.path.exists(OutputDirectory):
@@ -110,6 +124,12 @@ signal.signal(signal.SIGINT, signal_handler)
 # Everything ROOT related can only be loaded here otherwise it interferes with the argparse
 from EventData import EventData
 
+# The shared tools are in the common directory of the main repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from EventBatch import EventBatch
+from ComptonToyModel import ComptonToyModel
+from GraphTools import radiusEdges, groupEdges, uniqueEdges
+
 # Load MEGAlib into ROOT so that it is usable
 import ROOT as M
 M.gSystem.Load("$(MEGALIB)/lib/libMEGAlib.so")
@@ -127,14 +147,8 @@ DataSets = []
 NumberOfDataSets = 0
 
 if UseToyModel == True:
-  for e in range(0, MaxEvents):
-    Data = EventData()
-    Data.createFromToyModel(e)
-    DataSets.append(Data)
-
-    NumberOfDataSets += 1
-    if NumberOfDataSets > 0 and NumberOfDataSets % 1000 == 0:
-      print("Data sets processed: {}".format(NumberOfDataSets))
+  DataSets = ComptonToyModel().generate(MaxEvents)
+  NumberOfDataSets = len(DataSets)
 
 else:
   # Load geometry:
@@ -174,6 +188,9 @@ else:
       break
 
 
+  DataSets = EventBatch.fromEvents(DataSets)
+
+
 print("Info: Parsed {} events".format(NumberOfDataSets))
 
 
@@ -192,21 +209,15 @@ if NTestingBatches == 0:
   NTestingBatches = 1
 NTrainingBatches = NBatches - NTestingBatches
 
-# Now split the actual data:
-TrainingDataSets = []
-for i in range(0, NTrainingBatches * BatchSize):
-  TrainingDataSets.append(DataSets[i])
-
-
-TestingDataSets = []
-for i in range(0,NTestingBatches*BatchSize):
-   TestingDataSets.append(DataSets[NTrainingBatches * BatchSize + i])
+# Now split the actual data (views, no copies):
+TrainingDataSets = DataSets.slice(0, NTrainingBatches * BatchSize)
+TestingDataSets = DataSets.slice(NTrainingBatches * BatchSize, (NTrainingBatches + NTestingBatches) * BatchSize)
 
 
 NumberOfTrainingEvents = len(TrainingDataSets)
 NumberOfTestingEvents = len(TestingDataSets)
 
-print(np.unique(np.array([event.unique for event in TestingDataSets])))
+print(np.unique(TestingDataSets.getNumberOfUniqueZ()))
 
 print("Info: Number of training data sets: {}   Number of testing data sets: {} (vs. input: {} and split ratio: {})".format(NumberOfTrainingEvents, NumberOfTestingEvents, len(DataSets), TestingTrainingSplit))
 
@@ -223,82 +234,84 @@ print("Info: Setting up the graph neural network...")
 # Criterion for choosing to connect two nodes
 radius = 10
 
-# Checking if distance is within criterion
-def distanceCheck(h1, h2):
-    dist = np.sqrt(np.sum((h1 - h2)**2))
-    return dist <= radius
-
-# Creates the graph representation for the detector
-def CreateGraph(event):
-
-    adjacency = np.zeros((len(event.X), len(event.X)))
-
-    data = np.array(list(zip(event.X, event.Y, event.Z, event.E, event.Type, event.Origin)))
-    hits = data[:, :3].astype(np.float)
-    energies = data[:, 3].astype(np.float)
-    types = data[:, 4]
-    origins = data[:, 5].astype(np.float)
-
-    for i in range(len(hits)):
-        for j in range(i+1, len(hits)):
-            if types[i] == 'g' and types[j] == 'g' or distanceCheck(hits[i], hits[j]):
-                adjacency[i][j] = adjacency[j][i] = 1
-
-    # Create the incoming matrix, outgoing matrix, and vector of labels
-    num_edges = int(np.sum(adjacency))
-    Ro = np.zeros((len(hits), num_edges))
-    Ri = np.zeros((len(hits), num_edges))
-    y = np.zeros(num_edges)
-
-    # Fill in the incoming matrix, outgoing matrix, and vector of labels
-    counter = 0
-    for i in range(len(adjacency)):
-        for j in range(len(adjacency[0])):
-            if adjacency[i][j]:
-                Ro[i, np.arange(num_edges)] = 1
-                Ri[j, np.arange(num_edges)] = 1
-                if types[i] == types[j] and i == origins[j]:
-                    y[counter] = 1
-                else:
-                    y[counter] = 0
-                counter += 1
+# Creates the graph representations of all events of a batch at once, as one disjoint-union graph:
+# Returns the node features X (hits, 4), the edges as hit indices into the batch (senders, receivers),
+# the edge labels y, and the graph id (the event index in the batch) of each node
+def CreateGraphs(batch):
+
+    graph_ids = batch.getEventIndices()
+    hits = np.column_stack((batch.X, batch.Y, batch.Z))
+
+    # Connect all hits within the radius, and all gamma-ray hits of an event with each other
+    senders_radius, receivers_radius = radiusEdges(hits, graph_ids, radius)
+    senders_gamma, receivers_gamma = groupEdges(batch.Type == b'g', graph_ids)
+    senders, receivers = uniqueEdges(np.concatenate((senders_radius, senders_gamma)), np.concatenate((receivers_radius, receivers_gamma)), len(hits))
+
+    # An edge is true if both hits are of the same type and the sender is the origin of the receiver (origins are hit IDs)
+    y = ((batch.Type[senders] == batch.Type[receivers]) & (batch.ID[senders] == batch.Origin[receivers])).astype(np.float64)
 
     # Generate feature matrix of nodes
-    X = data[:, :4].astype(np.float)
+    X = np.column_stack((batch.X, batch.Y, batch.Z, batch.E)).astype(np.float64)
+
+    return X, senders, receivers, y, graph_ids
+
+
+# Produces the graph batches for training and testing: each batch is the disjoint union of the graphs of batch_size events.
+# Keras calls it in worker threads, thus the graphs of the next batches are created while the current one is trained.
+# The model sees one graph per step, thus all arrays get a leading dimension of one.
+class GraphGenerator(tf.keras.utils.Sequence):
 
-    return [X, Ro, Ri, y]
+    def __init__(self, event_data, batch_size):
+        self.event_data = event_data
+        self.batch_size = batch_size
 
+    def __len__(self):
+        return int(len(self.event_data)/self.batch_size)
 
-# Definition of edge network (calculates edge weights)
-def EdgeNetwork(H, Ro, Ri, input_dim, hidden_dim):
+    def get_graphs(self, idx):
+        return CreateGraphs(self.event_data.slice(idx*self.batch_size, (idx+1)*self.batch_size))
 
-    def create_B(H):
-        bo = Ro.T @ H
-        bi = Ri.T @ H
-        B = tf.keras.layers.concatenate([bo, bi])
-        return B
+    def __getitem__(self, idx):
+        X, senders, receivers, y, graph_ids = self.get_graphs(idx)
 
-    B = tf.keras.layers.Lambda(lambda H: create_B(H))(H)
+        return [X[np.newaxis], senders[np.newaxis], receivers[np.newaxis]], y[np.newaxis, :, np.newaxis]
+
+
+# Gathers the node states of the given nodes (e.g. the senders of all edges)
+def GatherNodes(x):
+    H, indices = x
+    return tf.gather(H, indices, batch_dims = 1)
+
+
+# Sums the edge messages of all edges with the same given node (e.g. the receiver)
+def SumPerNode(x):
+    messages, indices, H = x
+    return tf.expand_dims(tf.math.unsorted_segment_sum(messages[0], indices[0], tf.shape(H)[1]), 0)
+
+
+# Definition of edge network (calculates edge weights from the states of the sender and receiver of each edge)
+def EdgeNetwork(H, senders, receivers, hidden_dim):
+
+    bo = tf.keras.layers.Lambda(GatherNodes)([H, senders])
+    bi = tf.keras.layers.Lambda(GatherNodes)([H, receivers])
+    B = tf.keras.layers.concatenate([bo, bi])
     layer_2 = tf.keras.layers.Dense(hidden_dim, activation = "tanh")(B)
     layer_3 = tf.keras.layers.Dense(1, activation = "sigmoid")(layer_2)
 
     return layer_3
 
 
-# Definition of node network (computes states of nodes)
-def NodeNetwork(H, Ro, Ri, edge_weights, input_dim, output_dim):
-
-    def create_M(e):
-        bo = Ro.T @ H
-        bi = Ri.T @ H
-        Rwo = Ro * tf.transpose(e)
-        Rwi = Ri * tf.transpose(e)
-        mi = Rwi @ bo
-        mo = Rwo @ bi
-        M = tf.keras.layers.concatenate([mi, mo, H])
-        return M
+# Definition of node network (computes states of nodes): the messages weighted by the edge weights are gathered
+# per edge and summed per node, thus the costs are linear in the number of edges
+def NodeNetwork(H, senders, receivers, edge_weights, output_dim):
 
-    M = tf.keras.layers.Lambda(lambda e: create_M(e))(edge_weights)
+    bo = tf.keras.layers.Lambda(GatherNodes)([H, senders])
+    bi = tf.keras.layers.Lambda(GatherNodes)([H, receivers])
+    wbo = tf.keras.layers.Lambda(lambda x: x[0] * x[1])([edge_weights, bo])
+    wbi = tf.keras.layers.Lambda(lambda x: x[0] * x[1])([edge_weights, bi])
+    mi = tf.keras.layers.Lambda(SumPerNode)([wbo, receivers, H])
+    mo = tf.keras.layers.Lambda(SumPerNode)([wbi, senders, H])
+    M = tf.keras.layers.concatenate([mi, mo, H])
     layer_4 = tf.keras.layers.Dense(output_dim, activation = "tanh")(M)
     layer_5 = tf.keras.layers.Dense(output_dim, activation = "tanh")(layer_4)
 
@@ -306,24 +319,29 @@ def NodeNetwork(H, Ro, Ri, edge_weights, input_dim, output_dim):
 
 
 # Definition of overall network (iterates to find most probable edges)
-def SegmentClassifier(Ro, Ri, input_dim = 4, hidden_dim = 16, num_iters = 3):
+# The graph is an input, thus the model is built and compiled once and trained on all graph batches
+def SegmentClassifier(input_dim = 4, hidden_dim = 16, num_iters = 3):
+
+    # The nodes and the edges (sender and receiver node indices) of the disjoint-union graph
+    input_layer = tf.keras.layers.Input(shape = (None, input_dim))
+    senders = tf.keras.layers.Input(shape = (None,), dtype = "int64")
+    receivers = tf.keras.layers.Input(shape = (None,), dtype = "int64")
 
     # Application of input network (creates latent representation of graph)
-    input_layer = tf.keras.layers.Input(batch_shape = (len(Ro), input_dim))
     H = tf.keras.layers.Dense(hidden_dim, activation = "tanh")(input_layer)
     H = tf.keras.layers.concatenate([H, input_layer])
 
     # Application of graph neural network (generates probabilities for each edge)
     for i in range(num_iters):
-        edge_weights = EdgeNetwork(H, Ro, Ri, input_dim + hidden_dim, hidden_dim)
-        H = NodeNetwork(H, Ro, Ri, edge_weights, input_dim + hidden_dim, hidden_dim)
+        edge_weights = EdgeNetwork(H, senders, receivers, hidden_dim)
+        H = NodeNetwork(H, senders, receivers, edge_weights, hidden_dim)
         H = tf.keras.layers.concatenate([H, input_layer])
 
-    output = EdgeNetwork(H, Ro, Ri, input_dim + hidden_dim, hidden_dim)
+    output = EdgeNetwork(H, senders, receivers, hidden_dim)
 
-    # Creation and compilation of model
-    model = tf.keras.models.Model(inputs = input_layer, outputs = output)
-    model.compile(optimizer = 'adam', loss = 'categorical_crossentropy', metrics = ['accuracy'])
+    # Creation and compilation of model: each edge is a binary classification
+    model = tf.keras.models.Model(inputs = [input_layer, senders, receivers], outputs = output)
+    model.compile(optimizer = 'adam', loss = 'binary_crossentropy', metrics = ['accuracy'])
 
     return model
 
@@ -333,28 +351,36 @@ def SegmentClassifier(Ro, Ri, input_dim = 4, hidden_dim = 16, num_iters = 3):
 ###################################################################################################
 
 
-print("Info: Training and evaluating the network - to be written")
+print("Info: Training and evaluating the network")
 
-for Batch in range(NTrainingBatches):
-    for e in range(BatchSize):
+training_generator = GraphGenerator(TrainingDataSets, BatchSize)
+testing_generator = GraphGenerator(TestingDataSets, BatchSize)
 
-        # Prepare graph for a set of simulated events (training)
-        event = TrainingDataSets[Batch*BatchSize + e]
-        X, Ro, Ri, y = CreateGraph(event)
+model = SegmentClassifier()
+model.summary()
 
-        # Fit the model to the data
-        model = SegmentClassifier(Ro, Ri)
-        model.fit(X, y)
+history = model.fit(training_generator, epochs = NumberOfEpochs, validation_data = testing_generator, shuffle = True, workers = NumberOfWorkers, max_queue_size = 2*NumberOfWorkers, use_multiprocessing = False)
 
-#for Batch in range(NTestingBatches):
-#    for e in range(BatchSize):
-#
-#        # Prepare graph for a set of simulated events (testing)
-#        event = TestingDataSets[Batch*BatchSize + e]
-#        X, Ro, Ri, y = CreateGraph(event)
-#
-#        # Generate predictions for a graph
-#        predicted_edge_weights = model.predict(X)
+
+# Evaluate the testing data sets: fraction of correctly identified edges, and of events with all edges correct
+CorrectEdges = 0
+TotalEdges = 0
+CorrectEvents = 0
+TotalEvents = 0
+for Batch in range(len(testing_generator)):
+    X, senders, receivers, y, graph_ids = testing_generator.get_graphs(Batch)
+    predicted_edge_weights = model.predict_on_batch([X[np.newaxis], senders[np.newaxis], receivers[np.newaxis]])
+    Correct = (np.asarray(predicted_edge_weights).reshape(-1) > 0.5) == (y > 0.5)
+
+    CorrectEdges += np.sum(Correct)
+    TotalEdges += len(Correct)
+
+    WrongPerEvent = np.bincount(graph_ids[senders], weights = ~Correct, minlength = BatchSize)
+    CorrectEvents += np.sum(WrongPerEvent == 0)
+    TotalEvents += BatchSize
+
+print("Percentage of correct edges: {:-6.2f}%".format(100.0 * CorrectEdges / max(TotalEdges, 1)))
+print("Percentage of events with all edges correct: {:-6.2f}%".format(100.0 * CorrectEvents / max(TotalEvents, 1)))
 
 
 #input("Press [enter] to EXIT")
@@ -297,6 +297,34 @@ class EventData:
 
 
 
+###################################################################################################
+
+
+  def createFromCache(self, Cache, Index):
+    """
+    Fill the data from the event with the given index of an EventCache
+    """
+
+    Hits = Cache.getHits(Index)
+
+    self.EventID = int(Cache.EventID[Index])
+
+    self.OriginPositionX = float(Cache.OriginPositionX[Index])
+    self.OriginPositionY = float(Cache.OriginPositionY[Index])
+    self.OriginPositionZ = float(Cache.OriginPositionZ[Index])
+
+    # Copies, since the cache is read-only and e.g. center() modifies the positions
+    self.ID     = np.array(Hits["ID"], dtype=int)
+    self.Origin = np.array(Hits["Origin"], dtype=int)
+    self.X      = np.array(Hits["X"], dtype=float)
+    self.Y      = np.array(Hits["Y"], dtype=float)
+    self.Z      = np.array(Hits["Z"], dtype=float)
+    self.E      = np.array(Hits["E"], dtype=float)
+    self.Type   = Hits["Type"].astype(str)
+
+    self.unique = len(np.unique(self.Z))
+
+
 ###################################################################################################
 
 
@@ -379,7 +407,7 @@ class EventData:
       return False
     if self.OriginPositionY < YMin:
       return False
-    if self.OriginPositionZ > XMax:
+    if self.OriginPositionZ > ZMax:
       return False
     if self.OriginPositionZ < ZMin:
       return False
@@ -25,6 +25,9 @@ import array
 import os
 import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from TreeLoader import TreeLoader
+
 
 ###################################################################################################
 
@@ -97,72 +100,25 @@ class DecayIdentification:
 
     print("{}: retrieve from ROOT tree".format(time.time()))
 
-    # Open the file
-    DataFile = ROOT.TFile(self.FileName)
-    if DataFile.IsOpen() == False:
-      print("Error opening data file")
+    # Open the file and get the data tree
+    try:
+      Loader = TreeLoader(self.FileName, "Quality")
+    except IOError as Error:
+      print("Error: {}".format(Error))
       return False
 
-    # Get the data tree
-    DataTree = DataFile.Get("Quality")
-    if DataTree == 0:
-      print("Error reading data tree from root file")
-      return False
+    all_features = Loader.selectColumns(Exclude=["SequenceLength", "SimulationID", "EvaluationIsReconstructable", "EvaluationZenithAngle", "EvaluationIsDecay", "EvaluationIsCompletelyAbsorbed"])
 
-    Branches = DataTree.GetListOfBranches()
-
-    VariableMap = {}
+    # transform data into numpy array: the features and the target as last column
+    Data = Loader.load(all_features + ["EvaluationIsDecay"], self.MaxEvents)
 
-    # Create a map of the branches, i.e. the columns
-    for B in list(Branches):
-      if B.GetName() == "EvaluationIsCompletelyAbsorbed":
-        VariableMap[B.GetName()] = array.array('i', [0])
-      else:
-        VariableMap[B.GetName()] = array.array('f', [0])
-      DataTree.SetBranchAddress(B.GetName(), VariableMap[B.GetName()])
-
-    # transform data into numpy array
-
-    total_data = min(self.MaxEvents, DataTree.GetEntries())
-
-    X_data = np.zeros((total_data, 40)) # space holder
+    X_data = Data[:, :-1]
 
+    target = (Data[:, -1] == 1).astype(np.float32)
     if self.Algorithms.startswith("TF:"):
-      y_data = np.zeros((total_data, 2))
+      y_data = np.column_stack((target, 1 - target))
     else:
-      y_data = np.zeros((total_data, 1))
-
-    all_features = list(VariableMap.keys())
-    all_features.remove("SequenceLength")
-    all_features.remove("SimulationID")
-    all_features.remove("EvaluationIsReconstructable")
-    all_features.remove("EvaluationZenithAngle")
-    all_features.remove("EvaluationIsDecay")
-
-    all_features.remove("EvaluationIsCompletelyAbsorbed") #y
-
-    print("{}: start formatting array".format(time.time()))
-
-    for x in range(0, total_data):
-
-      if x%1000 == 0 and x > 0:
-        print("{}: Progress: {}/{}".format(time.time(), x, total_data))
-
-      DataTree.GetEntry(x)  # Get row x
-
-      new_row=[VariableMap[feature][0] for feature in all_features]
-      X_data[x]=np.array(new_row)
-
-      if VariableMap["EvaluationIsDecay"][0] == 1:
-        target=1.0
-      else:
-        target=0.0
-
-      if self.Algorithms.startswith("TF:"):
-        y_data[x][0]= target
-        y_data[x][1]= 1-target
-      else:
-        y_data[x]= target
+      y_data = target.reshape(-1, 1)
 
     print("{}: finish formatting array".format(time.time()))
 
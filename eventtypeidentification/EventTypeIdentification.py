@@ -29,9 +29,46 @@ import time
 import collections
 import numpy as np
 import math, datetime
+from types import SimpleNamespace
 from voxnet import *
 #from volumetric_data import ShapeNet40Vox30
 
+# The shared tools are in the common directory of the main repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from EventCache import EventCache, convertSimFile
+from SimFileReader import readSimFiles
+from Voxelizer import Voxelizer
+
+
+###################################################################################################
+
+
+def parseEventTypeAndHits(Event):
+  """
+  Extract the event type and all hits from an MSimEvent
+
+  Returns:
+    object: the event with the hit arrays X, Y, Z, E, and the numerical EventType (see EventTypeIdentification.loadData), or None if the event has no interactions
+  """
+
+  if Event.GetNIAs() == 0:
+    return None
+
+  Type = 0
+  if Event.GetIAAt(1).GetProcess() == ROOT.MString("COMP"):
+    Type += 0 + Event.GetIAAt(1).GetDetectorType()
+  elif Event.GetIAAt(1).GetProcess() == ROOT.MString("PAIR"):
+    Type += 10 + Event.GetIAAt(1).GetDetectorType()
+
+  Data = SimpleNamespace(X = np.zeros(Event.GetNHTs()), Y = np.zeros(Event.GetNHTs()), Z = np.zeros(Event.GetNHTs()), E = np.zeros(Event.GetNHTs()), EventType = Type)
+  for i in range(0, Event.GetNHTs()):
+    Data.X[i] = Event.GetHTAt(i).GetPosition().X()
+    Data.Y[i] = Event.GetHTAt(i).GetPosition().Y()
+    Data.Z[i] = Event.GetHTAt(i).GetPosition().Z()
+    Data.E[i] = Event.GetHTAt(i).GetEnergy()
+
+  return Data
+
 
 ###################################################################################################
 
@@ -50,7 +87,7 @@ class EventTypeIdentification:
 ###################################################################################################
 
 
-  def __init__(self, FileName, Output, Algorithm, MaxEvents):
+  def __init__(self, FileName, Output, Algorithm, MaxEvents, CacheName = "", NumberOfJobs = 1):
     """
     The default constructor for class EventClustering
 
@@ -64,10 +101,18 @@ class EventTypeIdentification:
       The algorithms used during training. Seperate multiples by commma (e.g. "MLP,DNNCPU")
     MaxEvents: integer
       The maximum amount of events to use
+    CacheName: string
+      Event cache directory: Created from the sim file at the first run, used instead of the sim file afterwards
+    NumberOfJobs: integer
+      Number of processes parsing the sim file, 0 for all cores
 
     """
 
     self.FileName = FileName
+    self.CacheName = CacheName
+    self.NumberOfJobs = NumberOfJobs
+    if self.NumberOfJobs == 0:
+      self.NumberOfJobs = os.cpu_count()
     self.Output = 'Results'
     if Output != '':
       self.Output = self.Output + '_' + Output
@@ -97,6 +142,8 @@ class EventTypeIdentification:
 
     self.ZMin = 0
     self.ZMax = 48
+
+    self.Voxels = Voxelizer(self.XBins, self.YBins, self.ZBins, self.XMin, self.XMax, self.YMin, self.YMax, self.ZMin, self.ZMax)
     
     #keras model development
     self.OutputDirectory = "output.txt"
@@ -137,75 +184,87 @@ class EventTypeIdentification:
       list: list of all hits as a numpy array containing (x, y, z, energy) as row 
     """
    
-    print("{}: Load data from sim file".format(time.time()))
+    # Fixed for the time being
+    GeometryName = "$(MEGALIB)/resource/examples/geomega/GRIPS/GRIPS.geo.setup"
 
+    # The event cache is created once from the full sim file, then all later runs only read the cache
+    if self.CacheName != "" and EventCache.exists(self.CacheName) == False:
+      try:
+        convertSimFile(self.FileName, self.CacheName, parseEventTypeAndHits, GeometryName, NumberOfWorkers=self.NumberOfJobs)
+      except IOError as Error:
+        print("Unable to create the event cache: {} - Aborting!".format(Error))
+        quit()
 
-    import ROOT as M
 
-    # Load MEGAlib into ROOT
-    M.gSystem.Load("$(MEGALIB)/lib/libMEGAlib.so")
+    EventTypes = []
+    EventHits = []
 
-    # Initialize MEGAlib
-    G = M.MGlobal()
-    G.Initialize()
-    
-    # Fixed for the time being
-    GeometryName = "$(MEGALIB)/resource/examples/geomega/GRIPS/GRIPS.geo.setup"
+    if self.CacheName != "" or self.NumberOfJobs > 1:
+      if self.CacheName != "":
+        print("{}: Load data from event cache".format(time.time()))
+        Cache = EventCache(self.CacheName)
+      else:
+        print("{}: Load data from sim file with {} processes".format(time.time(), self.NumberOfJobs))
+        Cache = EventCache(Columns=readSimFiles(self.FileName, parseEventTypeAndHits, GeometryName, self.NumberOfJobs, self.MaxEvents))
 
-    # Load geometry:
-    Geometry = M.MDGeometryQuest()
-    if Geometry.ScanSetupFile(M.MString(GeometryName)) == True:
-      print("Geometry " + GeometryName + " loaded!")
-    else:
-      print("Unable to load geometry " + GeometryName + " - Aborting!")
-      quit()
-    
+      for e in range(0, min(len(Cache), self.MaxEvents)):
+        Hits = Cache.getHits(e)
+        EventTypes.append(int(Cache.EventType[e]))
+        EventHits.append(np.column_stack((Hits["X"], Hits["Y"], Hits["Z"], Hits["E"])))
+
+      if len(EventTypes) > 0:
+        self.MaxLabel = max(self.MaxLabel, max(EventTypes) + 1)
 
-    Reader = M.MFileEventsSim(Geometry)
-    if Reader.Open(M.MString(self.FileName)) == False:
-      print("Unable to open file " + FileName + ". Aborting!")
-      quit()
+    else:
+      print("{}: Load data from sim file".format(time.time()))
 
-    #Hist = M.TH2D("Energy", "Energy", 100, 0, 600, 100, 0, 600)
-    #Hist.SetXTitle("Input energy [keV]")
-    #Hist.SetYTitle("Measured energy [keV]")
+      import ROOT as M
 
+      # Load MEGAlib into ROOT
+      M.gSystem.Load("$(MEGALIB)/lib/libMEGAlib.so")
 
-    EventTypes = []
-    EventHits = []
+      # Initialize MEGAlib
+      G = M.MGlobal()
+      G.Initialize()
 
-    NEvents = 0
-    while True: 
-      Event = Reader.GetNextEvent()
-      if not Event:
-        break
-  
-      Type = 0
-      if Event.GetNIAs() > 0:
-        if Event.GetIAAt(1).GetProcess() == M.MString("COMP"):
-          Type += 0 + Event.GetIAAt(1).GetDetectorType()
-        elif Event.GetIAAt(1).GetProcess() == M.MString("PAIR"):
-          Type += 10 + Event.GetIAAt(1).GetDetectorType()
+      # Load geometry:
+      Geometry = M.MDGeometryQuest()
+      if Geometry.ScanSetupFile(M.MString(GeometryName)) == True:
+        print("Geometry " + GeometryName + " loaded!")
       else:
-        break
-      
-      if Type+1 > self.MaxLabel:
-        self.MaxLabel = Type +1
-  
-      Hits = np.zeros((Event.GetNHTs(), 4))
-      for i in range(0, Event.GetNHTs()):
-        Hits[i, 0] = Event.GetHTAt(i).GetPosition().X()
-        Hits[i, 1] = Event.GetHTAt(i).GetPosition().Y()
-        Hits[i, 2] = Event.GetHTAt(i).GetPosition().Z()
-        Hits[i, 3] = Event.GetHTAt(i).GetEnergy()
-      
-      NEvents += 1
-      EventTypes.append(Type)
-      EventHits.append(Hits)
-      
-      if NEvents >= self.MaxEvents:
-        break
-  
+        print("Unable to load geometry " + GeometryName + " - Aborting!")
+        quit()
+
+
+      Reader = M.MFileEventsSim(Geometry)
+      if Reader.Open(M.MString(self.FileName)) == False:
+        print("Unable to open file " + self.FileName + ". Aborting!")
+        quit()
+
+      #Hist = M.TH2D("Energy", "Energy", 100, 0, 600, 100, 0, 600)
+      #Hist.SetXTitle("Input energy [keV]")
+      #Hist.SetYTitle("Measured energy [keV]")
+
+      NEvents = 0
+      while True:
+        Event = Reader.GetNextEvent()
+        if not Event:
+          break
+
+        Data = parseEventTypeAndHits(Event)
+        if Data is None:
+          break
+
+        if Data.EventType+1 > self.MaxLabel:
+          self.MaxLabel = Data.EventType +1
+
+        NEvents += 1
+        EventTypes.append(Data.EventType)
+        EventHits.append(np.column_stack((Data.X, Data.Y, Data.Z, Data.E)))
+
+        if NEvents >= self.MaxEvents:
+          break
+
     print("Occurances of different event types:")
     print(collections.Counter(EventTypes))
     
@@ -576,9 +635,8 @@ class EventTypeIdentification:
       EventHits = self.EventHitsTest
       EventTypes = self.EventTypesTest
 
-    voxs = np.zeros([bs, self.XBins, self.YBins, self.ZBins, 1], dtype=np.float32)
     one_hots = np.zeros([bs, self.MaxLabel], dtype=np.float32)
-    #fill event hits
+    Selected = []
     for bi in range(bs):
       self.LastEventIndex += 1
       if self.LastEventIndex == len(EventHits):
@@ -587,15 +645,16 @@ class EventTypeIdentification:
         self.LastEventIndex += 1
         if self.LastEventIndex == len(EventHits):
           self.LastEventIndex = 0
-      for i in EventHits[self.LastEventIndex]:
-          xbin = (int) (((i[0] - self.XMin) / (self.XMax - self.XMin)) * self.XBins)
-          ybin = (int) (((i[1] - self.YMin) / (self.YMax - self.YMin)) * self.YBins)
-          zbin = (int) (((i[2] - self.ZMin) / (self.ZMax - self.ZMin)) * self.ZBins)
-          #print(bi, xbin, ybin, zbin)
-          voxs[bi, xbin, ybin, zbin] += i[3]
+      Selected.append(self.LastEventIndex)
       #fills event types
       one_hots[bi][EventTypes[self.LastEventIndex]] = 1
-      
+
+    #fill event hits: all hits (x, y, z, energy) of the batch at once
+    Hits = np.concatenate([ EventHits[i] for i in Selected ])
+    EventIndices = np.repeat(np.arange(bs), [ len(EventHits[i]) for i in Selected ])
+    #the tensor is written into the reused buffer of the voxelizer, it is only valid until the next call
+    voxs = self.Voxels.densify(self.Voxels.voxelizeSparse(EventIndices, Hits[:, 0], Hits[:, 1], Hits[:, 2], Hits[:, 3], bs, Sum=True))
+
     return voxs, one_hots
 
 
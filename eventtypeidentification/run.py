@@ -40,10 +40,12 @@ parser.add_argument('-o', '--output', default='', help='Postfix for the output d
 parser.add_argument('-a', '--algorithm', default='KERAS:VOXNET', help='Machine learning algorithm. Allowed: TF:VOXNET')
 parser.add_argument('-m', '--maxevents', default='100000', help='Maximum number of events to use')
 parser.add_argument('-e', '--onlyevaluate', action='store_true', help='Only test the approach')
+parser.add_argument('-c', '--cache', default='', help='Event cache directory: Created from the sim file at the first run, used instead of the sim file afterwards')
+parser.add_argument('-j', '--jobs', default='1', help='Number of processes parsing the sim file (or all parts X.p1.sim.gz, X.p2.sim.gz, ... of a multi-threaded cosima run), 0 for all cores')
 
 args = parser.parse_args()
 
-AI = EventTypeIdentification(args.file, args.output, args.algorithm, int(args.maxevents))
+AI = EventTypeIdentification(args.file, args.output, args.algorithm, int(args.maxevents), args.cache, int(args.jobs))
 
 if args.onlyevaluate == False:
   if AI.train() == False:
@@ -60,6 +60,16 @@ class GRBCreator:
     self.PhiBins = int(180 / ResolutionInDegrees)
 
 
+###################################################################################################
+
+
+  def getNumberOfBins(self):
+    """
+    Return the number of bins of the histogram (PsiBins x ChiBins x PhiBins)
+    """
+
+    return self.PsiBins * self.ChiBins * self.PhiBins
+
 
 ###################################################################################################
 
@@ -20,8 +20,8 @@ import random
 import math
 from GRBCreator import GRBCreator
 
-import ROOT as M
-M.gSystem.Load("$(MEGALIB)/lib/libMEGAlib.so")
+# Requires the common directory of the main repository in the python path
+from VectorTools import directionsFromThetaPhi, anglesFromDirections
 
 
 ###################################################################################################
@@ -29,14 +29,16 @@ M.gSystem.Load("$(MEGALIB)/lib/libMEGAlib.so")
 
 class GRBCreatorToyModel(GRBCreator):
   """
-  This class represents GRB creator which uses a toy model
+  This class represents GRB creator which uses a toy model.
+  createSourceDataSets generates all source events of a GRB at once with numpy, the
+  per-event versions Create and createOneSourceDataSet are kept for reference.
   """
 
 
 ###################################################################################################
 
 
-  def __init__(self, ResolutionInDegrees, NoiseInDegreesInSigma):
+  def __init__(self, ResolutionInDegrees, NoiseInDegreesInSigma, Seed = None):
     """
     The default constructor for class EventClustering
 
@@ -46,6 +48,8 @@ class GRBCreatorToyModel(GRBCreator):
       The resolution in degrees of the data space
     NoiseInSigma: Float
       The amount the source data will be noised in degree 
+    Seed : integer, SeedSequence, or Generator
+      The seed of the random number generator of the vectorized creation
 
     """
 
@@ -53,6 +57,8 @@ class GRBCreatorToyModel(GRBCreator):
     
     self.NoiseInRadiansInSigma = math.radians(NoiseInDegreesInSigma)
 
+    self.Generator = np.random.default_rng(Seed)
+
 
 ###################################################################################################
 
@@ -93,6 +99,10 @@ class GRBCreatorToyModel(GRBCreator):
 
   def Create(self, Ei, Rotation):
 
+    # Only this per-event version needs MEGAlib, the vectorized creation runs without it
+    import ROOT as M
+    M.gSystem.Load("$(MEGALIB)/lib/libMEGAlib.so")
+
     # Simulate the gamma ray according to Butcher & Messel: Nuc Phys 20(1960), 15
 
     Ei_m = Ei / 510.998910
@@ -205,6 +215,133 @@ class GRBCreatorToyModel(GRBCreator):
     return Index
 
 
+###################################################################################################
+
+
+  def noiseAngles(self, Angles, Min, Max, Generator):
+    """
+    Noise all angles with a gaussian, values outside [Min, Max] are re-drawn (vectorized version of Noise)
+    """
+
+    Noised = Generator.normal(Angles, self.NoiseInRadiansInSigma)
+
+    Pending = np.flatnonzero((Noised < Min) | (Noised > Max))
+    while len(Pending) > 0:
+      Noised[Pending] = Generator.normal(Angles[Pending], self.NoiseInRadiansInSigma)
+      Pending = Pending[(Noised[Pending] < Min) | (Noised[Pending] > Max)]
+
+    return Noised
+
+
+###################################################################################################
+
+
+  def getBinIndices(self, Chi, Psi, Phi):
+    """
+    Return the flat histogram index of each event (psi major, phi minor)
+    """
+
+    # Truncation as the int() cast, angles at the upper edge belong to the last bin
+    ChiBin = np.minimum(((Chi - self.ChiMin) / (self.ChiMax - self.ChiMin) * self.ChiBins).astype(np.int64), self.ChiBins-1)
+    PsiBin = np.minimum(((Psi - self.PsiMin) / (self.PsiMax - self.PsiMin) * self.PsiBins).astype(np.int64), self.PsiBins-1)
+    PhiBin = np.minimum(((Phi - self.PhiMin) / (self.PhiMax - self.PhiMin) * self.PhiBins).astype(np.int64), self.PhiBins-1)
+
+    return (PsiBin*self.ChiBins + ChiBin)*self.PhiBins + PhiBin
+
+
+###################################################################################################
+
+
+  def createSourceDataSets(self, Rotation, NumberOfEvents, Generator = None):
+    """
+    Create the histogram indices of all source events of one GRB at once
+
+    Attributes
+    ----------
+    Rotation : numpy array
+      The 3x3 rotation matrix from the detector to the GRB frame (see VectorTools.rotationMatrix)
+    NumberOfEvents : integer
+      The number of source events
+    Generator : numpy Generator
+      The random number generator, by default the one of this creator
+
+    Returns
+    -------
+    numpy array
+      The flat histogram index of each event
+
+    """
+
+    if Generator is None:
+      Generator = self.Generator
+
+    # The energy of the Compton scatter of Create does not enter the histogram, thus it is not sampled.
+    # The direction is random, its angle to the GRB direction is the Compton scatter angle
+    Phi = np.arccos(1 - 2*Generator.random(NumberOfEvents))
+    Azimuth = 2.0 * np.pi * Generator.random(NumberOfEvents)
+
+    Dg = directionsFromThetaPhi(Phi, Azimuth) @ np.asarray(Rotation).T
+
+    Chi, Psi = anglesFromDirections(Dg)
+
+    if self.NoiseInRadiansInSigma > 0:
+      Chi = self.noiseAngles(Chi, 0, math.pi, Generator)
+      Psi = self.noiseAngles(Psi, -math.pi, math.pi, Generator)
+      Phi = self.noiseAngles(Phi, 0, math.pi, Generator)
+
+    return self.getBinIndices(Chi, Psi, Phi)
+
+
+###################################################################################################
+
+
+  def createSourceHistogram(self, Rotation, NumberOfEvents, Generator = None):
+    """
+    Create the sparse histogram of the source events of one GRB, see createSourceDataSets
+
+    Returns
+    -------
+    numpy arrays
+      The indices of the non-empty bins (sorted) and their counts
+
+    """
+
+    Counts = np.bincount(self.createSourceDataSets(Rotation, NumberOfEvents, Generator), minlength=self.getNumberOfBins())
+    Indices = np.flatnonzero(Counts)
+
+    return Indices, Counts[Indices]
+
+
+###################################################################################################
+
+
+  def createBackgroundHistogram(self, NumberOfEvents, Generator = None):
+    """
+    Create the sparse histogram of the background events, which are uniformly distributed over all bins.
+    With more events than bins, the counts of all bins are drawn at once from a multinomial distribution,
+    thus the time does not grow with the number of background events. With fewer events, drawing one bin
+    per event is faster, the distribution of the counts is the same
+
+    Returns
+    -------
+    numpy arrays
+      The indices of the non-empty bins (sorted) and their counts
+
+    """
+
+    if Generator is None:
+      Generator = self.Generator
+
+    NumberOfBins = self.getNumberOfBins()
+    if NumberOfEvents < NumberOfBins:
+      return np.unique(Generator.integers(0, NumberOfBins, size=NumberOfEvents), return_counts=True)
+
+    Counts = Generator.multinomial(NumberOfEvents, np.full(NumberOfBins, 1.0 / NumberOfBins))
+    Indices = np.flatnonzero(Counts)
+
+    return Indices, Counts[Indices]
+
+
 ###################################################################################################
 
 
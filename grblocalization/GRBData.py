@@ -15,10 +15,10 @@
 ###################################################################################################
 
 
-import random 
 import numpy as np
-import ROOT as M
-M.gSystem.Load("$(MEGALIB)/lib/libMEGAlib.so")
+
+# Requires the common directory of the main repository in the python path
+from VectorTools import randomDirections, anglesFromDirections, rotationMatrix
 
 
 ###################################################################################################
@@ -76,16 +76,18 @@ class GRBData:
 ###################################################################################################
 
 
-  def create(self, ToyModel, NumberOfSourceEvents, NumberOfBackgroundEvents):
+  def create(self, ToyModel, NumberOfSourceEvents, NumberOfBackgroundEvents, Generator = None):
     """
-    Switch between the various machine-learning libraries based on self.Algorithm
+    Create the histogram of one GRB at a random location. The source and background histograms are created
+    by the ToyModel, with the given random number generator (default: the one of the ToyModel)
     """
 
+    if Generator is None:
+      Generator = ToyModel.Generator
 
     # Create a random rotation matrix
-    V = M.MVector()
-    V.SetMagThetaPhi(1, np.arccos(1 - 2*random.random()), 2.0 * np.pi * random.random())
-    Angle = 2.0 * np.pi * random.random()
+    V = randomDirections(Generator, 1)[0]
+    Angle = 2.0 * np.pi * Generator.random()
 
     '''
     if random.random() < 0.25:
@@ -102,24 +104,20 @@ class GRBData:
       Angle = 0.2 
     '''
     
-    Rotation = M.MRotation(Angle, V)
+    Rotation = rotationMatrix(Angle, V)
   
     # Retrieve the origin of the gamma rays
-    Origin = M.MVector(0, 0, 1)
-    Origin = Rotation*Origin
-  
-    self.OriginLatitude = Origin.Theta()
-    self.OriginLongitude = Origin.Phi()
+    Origin = Rotation @ np.array([0.0, 0.0, 1.0])
   
-    self.Index = np.zeros(shape=(NumberOfSourceEvents + NumberOfBackgroundEvents), dtype=int)
+    self.OriginLatitude, self.OriginLongitude = anglesFromDirections(Origin)
   
-    # Create the input source events
-    for e in range(0, NumberOfSourceEvents):
-      self.Index[e] = ToyModel.createOneSourceDataSet(Rotation)
-    
-    # Create input background events
-    for e in range(0, NumberOfBackgroundEvents):
-      self.Index[e + NumberOfSourceEvents] = ToyModel.createOneBackgroundDataSet()
-      
-    self.Indices, self.Values = np.unique(self.Index, return_counts=True)
+    # Create the input source and background histograms, and add them
+    SourceIndices, SourceCounts = ToyModel.createSourceHistogram(Rotation, NumberOfSourceEvents, Generator)
+    BackgroundIndices, BackgroundCounts = ToyModel.createBackgroundHistogram(NumberOfBackgroundEvents, Generator)
+
+    Counts = np.zeros(shape=(ToyModel.getNumberOfBins()), dtype=int)
+    Counts[SourceIndices] += SourceCounts
+    Counts[BackgroundIndices] += BackgroundCounts
 
+    self.Indices = np.flatnonzero(Counts)
+    self.Values = Counts[self.Indices]
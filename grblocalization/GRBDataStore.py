@@ -0,0 +1,295 @@
+###################################################################################################
+#
+# GRBDataStore.py
+#
+# Copyright (C) by Andreas Zoglauer.
+# All rights reserved.
+#
+# Please see the file License.txt in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+
+###################################################################################################
+
+
+import sys
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+
+###################################################################################################
+
+
+class GRBDataStore:
+  """
+  This class stores the histograms of many GRBs as one sparse CSR matrix (one row per GRB), together with the
+  origin latitudes and longitudes. The histograms are created by the worker processes of a pool, which write
+  them directly into shared memory instead of returning pickled GRBData objects. A typical usage would look like this:
+
+  Store = GRBDataStore(NumberOfGRBs, NumberOfSourceEvents + NumberOfBackgroundEvents, ToyModel.getNumberOfBins())
+  pool.map(generateDataSets, [ (Store, Begin, min(Begin+64, NumberOfGRBs)) for Begin in range(0, NumberOfGRBs, 64) ])
+  Store.finalize()
+
+  XTrain, YTrain = Store.getBatch(0, 256)
+
+  While the workers fill the store, each GRB has a fixed slot of MaxEntries entries in the shared memory.
+  finalize() packs the slots into the CSR arrays IndPtr, Indices, Values and releases the shared memory.
+  """
+
+
+###################################################################################################
+
+
+  def __init__(self, NumberOfGRBs, MaxEntries, NumberOfBins):
+    """
+    The default constructor for class GRBDataStore
+
+    Attributes
+    ----------
+    NumberOfGRBs : integer
+      The number of GRBs (rows)
+    MaxEntries : integer
+      The maximum number of non-empty bins of one GRB, e.g. the number of events per GRB
+    NumberOfBins : integer
+      The number of bins of the histograms (columns)
+
+    """
+
+    self.NumberOfGRBs = NumberOfGRBs
+    self.MaxEntries = max(1, min(MaxEntries, NumberOfBins))
+    self.NumberOfBins = NumberOfBins
+
+    # Name, dtype and shape of the shared arrays the workers write into
+    self.Layout = [ ("Entries", np.int64, (NumberOfGRBs)),
+                    ("SlotIndices", np.int32, (NumberOfGRBs, self.MaxEntries)),
+                    ("SlotValues", np.float32, (NumberOfGRBs, self.MaxEntries)),
+                    ("Latitude", np.float64, (NumberOfGRBs)),
+                    ("Longitude", np.float64, (NumberOfGRBs)) ]
+
+    self.Owner = True
+    self.SharedMemory = {}
+    for Name, Type, Shape in self.Layout:
+      Size = max(1, int(np.prod(Shape)) * np.dtype(Type).itemsize)
+      self.SharedMemory[Name] = shared_memory.SharedMemory(create=True, size=Size)
+    self.attach()
+    self.Entries[:] = 0
+
+    # The CSR arrays, available after finalize()
+    self.IndPtr = None
+    self.Indices = None
+    self.Values = None
+
+    # The reused batch buffers of getBatch() and the entries set at their last call, by slot
+    self.Buffers = {}
+    self.BufferIndices = {}
+
+
+###################################################################################################
+
+
+  def attach(self):
+    """
+    Create the numpy arrays on top of the shared memory
+    """
+
+    for Name, Type, Shape in self.Layout:
+      setattr(self, Name, np.ndarray(Shape, dtype=Type, buffer=self.SharedMemory[Name].buf))
+
+
+###################################################################################################
+
+
+  def __getstate__(self):
+    """
+    Only the names of the shared memory blocks are sent to the worker processes
+    """
+
+    if self.SharedMemory is None:
+      raise RuntimeError("The GRBDataStore is already finalized and can no longer be filled by workers")
+
+    return { "NumberOfGRBs": self.NumberOfGRBs, "MaxEntries": self.MaxEntries, "NumberOfBins": self.NumberOfBins, "Layout": self.Layout,
+             "Names": { Name: Memory.name for Name, Memory in self.SharedMemory.items() },
+             "ResourceTracker": getattr(resource_tracker._resource_tracker, "_pid", None) }
+
+
+###################################################################################################
+
+
+  def __setstate__(self, State):
+    """
+    Attach to the shared memory of the store in the parent process
+    """
+
+    self.NumberOfGRBs = State["NumberOfGRBs"]
+    self.MaxEntries = State["MaxEntries"]
+    self.NumberOfBins = State["NumberOfBins"]
+    self.Layout = State["Layout"]
+
+    self.Owner = False
+
+    # Only the owner releases the memory, the resource tracker must not remove it when a worker exits
+    if sys.version_info >= (3, 13):
+      self.SharedMemory = { Name: shared_memory.SharedMemory(name=MemoryName, track=False) for Name, MemoryName in State["Names"].items() }
+    else:
+      self.SharedMemory = { Name: shared_memory.SharedMemory(name=MemoryName) for Name, MemoryName in State["Names"].items() }
+      # Workers started via spawn or forkserver (no tracker pid of their own), or forked after the owner started its tracker,
+      # share the tracker of the owner, where the memory is already registered. Only workers forked before have their own one.
+      # The pid is private to the resource tracker (verified with Python 3.8 to 3.12), without it the memory stays registered
+      Tracker = getattr(resource_tracker._resource_tracker, "_pid", None)
+      if Tracker is not None and State["ResourceTracker"] is not None and Tracker != State["ResourceTracker"]:
+        for Memory in self.SharedMemory.values():
+          resource_tracker.unregister(Memory._name, "shared_memory")
+
+    self.attach()
+
+
+###################################################################################################
+
+
+  def close(self):
+    """
+    Detach from the shared memory, the owner also releases it
+    """
+
+    if self.SharedMemory is None:
+      return
+
+    for Name, Type, Shape in self.Layout:
+      setattr(self, Name, None)
+    for Memory in self.SharedMemory.values():
+      Memory.close()
+      if self.Owner == True:
+        Memory.unlink()
+    self.SharedMemory = None
+
+
+###################################################################################################
+
+
+  def set(self, Index, Indices, Values, Latitude, Longitude):
+    """
+    Store the sparse histogram and origin of the GRB with the given index (called in the workers)
+    """
+
+    Entries = len(Indices)
+    if Entries > self.MaxEntries:
+      raise ValueError("GRB {} has {} non-empty bins, but the store only has space for {}".format(Index, Entries, self.MaxEntries))
+
+    self.SlotIndices[Index, :Entries] = Indices
+    self.SlotValues[Index, :Entries] = Values
+    self.Latitude[Index] = Latitude
+    self.Longitude[Index] = Longitude
+    self.Entries[Index] = Entries
+
+
+###################################################################################################
+
+
+  def setGRB(self, Index, GRB):
+    """
+    Store a GRBData object
+    """
+
+    self.set(Index, GRB.getIndices(), GRB.getValues(), GRB.OriginLatitude, GRB.OriginLongitude)
+
+
+###################################################################################################
+
+
+  def finalize(self):
+    """
+    Pack the slots into the CSR arrays and release the shared memory (after all workers are done)
+    """
+
+    Entries = self.Entries.copy()
+    Used = np.arange(self.MaxEntries)[np.newaxis, :] < Entries[:, np.newaxis]
+
+    self.IndPtr = np.zeros(shape=(self.NumberOfGRBs + 1), dtype=np.int64)
+    np.cumsum(Entries, out=self.IndPtr[1:])
+    self.Indices = self.SlotIndices[Used]
+    self.Values = self.SlotValues[Used]
+    Latitude = self.Latitude.copy()
+    Longitude = self.Longitude.copy()
+
+    self.close()
+
+    self.Latitude = Latitude
+    self.Longitude = Longitude
+
+
+###################################################################################################
+
+
+  def __len__(self):
+    """
+    Return the number of GRBs
+    """
+
+    return self.NumberOfGRBs
+
+
+###################################################################################################
+
+
+  def densify(self, NumberOfRows, Rows, Indices, Values, Slot):
+    """
+    Scatter the entries (row, bin index, value) into the float32 buffer of the slot and return it as (NumberOfRows, NumberOfBins).
+    Only the bins set at the previous call with this slot are cleared, the result is valid until the next call with the same slot.
+    """
+
+    Size = NumberOfRows * self.NumberOfBins
+    if Slot not in self.Buffers or len(self.Buffers[Slot]) < Size:
+      self.Buffers[Slot] = np.zeros(shape=(Size), dtype=np.float32)
+    else:
+      self.Buffers[Slot][self.BufferIndices[Slot]] = 0
+
+    self.BufferIndices[Slot] = Rows * self.NumberOfBins + Indices
+    self.Buffers[Slot][self.BufferIndices[Slot]] = Values
+
+    return self.Buffers[Slot][:Size].reshape((NumberOfRows, self.NumberOfBins))
+
+
+###################################################################################################
+
+
+  def getBatch(self, Begin, End, Slot = 0):
+    """
+    Return the dense histograms (End-Begin, NumberOfBins) and origins (End-Begin, 2) of the GRBs Begin to End
+    after finalize(). The histograms are scattered into a buffer reused per slot, see densify
+    """
+
+    NumberOfRows = End - Begin
+    First, Last = self.IndPtr[Begin], self.IndPtr[End]
+
+    Rows = np.repeat(np.arange(NumberOfRows, dtype=np.int64), np.diff(self.IndPtr[Begin:End+1]))
+
+    Origins = np.stack((self.Latitude[Begin:End], self.Longitude[Begin:End]), axis=-1)
+
+    return self.densify(NumberOfRows, Rows, self.Indices[First:Last], self.Values[First:Last], Slot), Origins
+
+
+###################################################################################################
+
+
+  def getSlotBatch(self, Begin, End, Slot = 0):
+    """
+    As getBatch, but read the GRBs directly from their slots in the shared memory, before finalize()
+    (e.g. while the workers keep refilling other slots, see GRBStream). The data is copied, thus the
+    slots can be refilled right after the call
+    """
+
+    NumberOfRows = End - Begin
+    Used = np.arange(self.MaxEntries)[np.newaxis, :] < self.Entries[Begin:End, np.newaxis]
+
+    Rows = np.nonzero(Used)[0]
+
+    Origins = np.stack((self.Latitude[Begin:End], self.Longitude[Begin:End]), axis=-1)
+
+    return self.densify(NumberOfRows, Rows, self.SlotIndices[Begin:End][Used], self.SlotValues[Begin:End][Used], Slot), Origins
+
+
+# END
+###################################################################################################
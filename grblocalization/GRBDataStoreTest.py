@@ -0,0 +1,86 @@
+###################################################################################################
+#
+# GRBDataStoreTest.py
+#
+# Copyright (C) by Andreas Zoglauer.
+# All rights reserved.
+#
+# Please see the file License.txt in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+
+###################################################################################################
+
+
+import os
+import sys
+import subprocess
+import numpy as np
+import multiprocessing as mp
+
+from GRBDataStore import GRBDataStore
+
+
+###################################################################################################
+
+
+def checkWorker(Store, Begin, End):
+  """
+  Fill the GRBs Begin to End with a known pattern
+  """
+
+  for g in range(Begin, End):
+    Store.set(g, np.array([ g % Store.NumberOfBins ]), np.array([ g + 1.0 ]), g, -g)
+
+
+###################################################################################################
+
+
+def checkStartMethod(Method):
+  """
+  Fill a store from the workers of a pool with the given start method and check the content
+  """
+
+  Store = GRBDataStore(1000, 4, 50)
+  Names = [ Memory.name for Memory in Store.SharedMemory.values() ]
+  with mp.get_context(Method).Pool(3) as Pool:
+    # Twice, thus the workers attach to the store more than once
+    for Pass in range(0, 2):
+      Pool.starmap(checkWorker, [ (Store, Begin, min(Begin + 64, len(Store))) for Begin in range(0, len(Store), 64) ])
+  Store.finalize()
+
+  X, Y = Store.getBatch(0, len(Store))
+  Rows = np.arange(len(Store))
+  if not np.array_equal(X[Rows, Rows % 50], Rows + 1.0) or X.sum() != (Rows + 1.0).sum() or not np.array_equal(Y[:, 1], -Rows):
+    raise RuntimeError("Wrong content of the store")
+  if os.path.isdir("/dev/shm") and any(os.path.exists(os.path.join("/dev/shm", Name.lstrip("/"))) for Name in Names):
+    raise RuntimeError("Shared memory left behind")
+
+
+###################################################################################################
+
+
+if __name__ == "__main__":
+  # Self check of the shared memory handling with all start methods of the workers: python3 GRBDataStoreTest.py
+  # Each method runs in its own process, since the errors of the resource tracker only show up in its output
+  if len(sys.argv) > 1:
+    checkStartMethod(sys.argv[1])
+    sys.exit(0)
+
+  Failed = False
+  for Method in mp.get_all_start_methods():
+    Result = subprocess.run([ sys.executable, os.path.abspath(__file__), Method ], capture_output=True, text=True)
+    if Result.returncode != 0 or Result.stderr != "":
+      print("GRBDataStoreTest: start method {} FAILED:\n{}".format(Method, Result.stderr))
+      Failed = True
+    else:
+      print("GRBDataStoreTest: start method {} OK".format(Method))
+
+  sys.exit(1 if Failed else 0)
+
+
+# END
+###################################################################################################
@@ -73,6 +73,10 @@ parser.add_argument('-s', '--simulationoptions', default='', help='')
 parser.add_argument('-r', '--resolution', default='5.0', help='Resolution of the input grid in degrees')
 parser.add_argument('-b', '--batchsize', default='256', help='The number of GRBs in one training batch (default: 256 corresponsing to 5 degree grid resolution (64 for 3 degrees))')
 parser.add_argument('-o', '--outputdirectory', default='Output', help='Name of the output directory. If it exists, the current data and time will be appended.')
+parser.add_argument('--seed', default='', help='The master seed of the random number generators. The same seed creates the same data sets for any number of processes (default: a new seed at each run)')
+parser.add_argument('--stream', action='store_true', help='Train on a stream of newly generated GRBs instead of looping over the fixed set of training batches')
+parser.add_argument('--streamworkers', default=str(max(1, os.cpu_count() - 1)), help='The number of processes generating the GRBs of the stream (default: number of cores - 1)')
+parser.add_argument('--streamdepth', default='', help='The number of batches the stream generates ahead. Each one takes ~batch size x min(events per GRB, bins) x 8 bytes of shared memory, e.g. 4 MB with the defaults (default: 2 x stream workers)')
 parser
 
 args = parser.parse_args()
@@ -143,6 +147,30 @@ OutputDirectory = args.outputdirectory
 # TODO: Add checks
 print("CMD-Line: Using \"{}\" as output directory".format(OutputDirectory))
 
+MasterSeed = None
+if args.seed != '':
+  MasterSeed = int(args.seed)
+  if MasterSeed < 0:
+    print("Error: The seed must be a non-negative integer and not {}".format(MasterSeed))
+    sys.exit(0)
+
+UseStream = args.stream
+NumberOfStreamWorkers = int(args.streamworkers)
+if UseStream == True:
+  if NumberOfStreamWorkers < 1:
+    print("Error: You need a positive number of stream workers and not {}".format(NumberOfStreamWorkers))
+    sys.exit(0)
+  print("CMD-Line: Streaming newly generated training GRBs using {} workers".format(NumberOfStreamWorkers))
+
+StreamDepth = 2*NumberOfStreamWorkers
+if args.streamdepth != '':
+  StreamDepth = int(args.streamdepth)
+if UseStream == True:
+  if StreamDepth < 1:
+    print("Error: You need a positive stream depth and not {}".format(StreamDepth))
+    sys.exit(0)
+  print("CMD-Line: Generating up to {} training batches ahead".format(StreamDepth))
+
 print("\n\n")
 
 
@@ -201,8 +229,12 @@ signal.signal(signal.SIGINT, signal_handler)
 
 
 # Everything ROOT related can only be loaded here otherwise it interferes with the argparse
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
 from GRBData import GRBData
+from GRBDataStore import GRBDataStore
+from GRBStream import GRBStream
 from GRBCreatorToyModel import GRBCreatorToyModel
+from RandomTools import createSeedSequence, childSeedSequence, childGenerator
 
 # Load MEGAlib into ROOT so that it is usable
 import ROOT as M
@@ -216,16 +248,39 @@ M.PyConfig.IgnoreCommandLineOptions = True
 ###################################################################################################
 
 
+# In stream mode only the testing data sets are created here, the training data sets are generated on the fly
+if UseStream == True:
+  NumberOfTrainingLocations = 0
+
 print("Info: Creating {:,} Compton events".format((NumberOfTrainingLocations + NumberOfTestLocations) * (NumberOfComptonEvents + NumberOfBackgroundEvents)))
 
 
 ToyModelCreator = GRBCreatorToyModel(ResolutionInDegrees, OneSigmaNoiseInDegrees)  
 
+# All random numbers are derived from the master seed, print it, so that the data sets can be created again
+Seeds = createSeedSequence(MasterSeed)
+print("Info: Using {} as master seed".format(Seeds.entropy))
+
+# The keys of the data sets for the random number generators
+TrainingSeedKey = 0
+TestingSeedKey = 1
+StreamSeedKey = 2
+
+
+def generateDataSets(Store, Begin, End, SeedKey):
+  # Each GRB has its own generator, thus the data sets do not depend on the number of processes or tasks
+  for g in range(Begin, End):
+    DataSet = GRBData()
+    DataSet.create(ToyModelCreator, NumberOfComptonEvents, NumberOfBackgroundEvents, childGenerator(Seeds, SeedKey, g))
+    Store.setGRB(g, DataSet)
 
-def generateOneDataSet(_):
-  DataSet = GRBData()
-  DataSet.create(ToyModelCreator, NumberOfComptonEvents, NumberOfBackgroundEvents)
-  return DataSet
+
+def createDataSets(NumberOfGRBs, SeedKey, TaskSize = 64):
+  # The workers write the histograms directly into the shared memory of the store
+  Store = GRBDataStore(NumberOfGRBs, NumberOfComptonEvents + NumberOfBackgroundEvents, InputDataSpaceSize)
+  pool.starmap(generateDataSets, [ (Store, Begin, min(Begin + TaskSize, NumberOfGRBs), SeedKey) for Begin in range(0, NumberOfGRBs, TaskSize) ])
+  Store.finalize()
+  return Store
   
   
 # Parallelizing using Pool.starmap()
@@ -235,10 +290,11 @@ pool = mp.Pool(mp.cpu_count())
 # Create data sets
 TimerCreation = time.time()
 
-TrainingDataSets = pool.map(generateOneDataSet, range(0, NumberOfTrainingLocations))
-print("Info: Created {:,} training data sets. ".format(NumberOfTrainingLocations))
+if UseStream == False:
+  TrainingDataSets = createDataSets(NumberOfTrainingLocations, TrainingSeedKey)
+  print("Info: Created {:,} training data sets. ".format(NumberOfTrainingLocations))
 
-TestingDataSets = pool.map(generateOneDataSet, range(0, NumberOfTestLocations))
+TestingDataSets = createDataSets(NumberOfTestLocations, TestingSeedKey)
 print("Info: Created {:,} testing data sets. ".format(NumberOfTestLocations))
 
 pool.close()
@@ -387,6 +443,7 @@ with open(OutputDirectory + "/Configuration.txt", 'w') as f:
   f.write("ResolutionInDegrees: {}\n".format(ResolutionInDegrees))
   f.write("MaxBatchSize: {}\n".format(MaxBatchSize))
   f.write("OutputDirectory: {}\n".format(OutputDirectory))
+  f.write("MasterSeed: {}\n".format(Seeds.entropy))
   
 with open(OutputDirectory + '/Progress.txt', 'w') as f:
   f.write("Progress\n\n")
@@ -408,16 +465,7 @@ def CheckPerformance():
   for Batch in range(0, NumberOfTestingBatches):
         
     # Step 1: Convert the data
-    XTest = np.zeros(shape=(TestingBatchSize, PsiBins*ChiBins*PhiBins*1))
-    YTest = np.zeros(shape=(TestingBatchSize, OutputDataSpaceSize))
-
-    for g in range(0, TestingBatchSize):
-      GRB = TrainingDataSets[g + Batch*TrainingBatchSize]
-      YTest[g][0] = GRB.OriginLatitude
-      YTest[g][1] = GRB.OriginLongitude
-      
-      XSlice = XTest[g,]
-      XSlice.put(GRB.getIndices(), GRB.getValues())
+    XTest, YTest = TestingDataSets.getBatch(Batch*TestingBatchSize, (Batch+1)*TestingBatchSize)
     
     XTest = XTest.reshape((TestingBatchSize, PsiBins, ChiBins, PhiBins, 1))
     
@@ -470,6 +518,11 @@ def CheckPerformance():
 
 
 
+# Start generating the training data sets, at most StreamDepth batches ahead
+if UseStream == True:
+  TrainingStream = GRBStream(ToyModelCreator, NumberOfComptonEvents, NumberOfBackgroundEvents, TrainingBatchSize, NumberOfStreamWorkers, StreamDepth, childSeedSequence(Seeds, StreamSeedKey))
+
+
 # Main training and evaluation loop
 TimeConverting = 0.0
 TimeTraining = 0.0
@@ -483,16 +536,10 @@ while Iteration < MaxIterations:
     # Convert the data set into training and testing data
     TimerConverting = time.time()
     
-    XTrain = np.zeros(shape=(TrainingBatchSize, PsiBins*ChiBins*PhiBins*1))
-    YTrain = np.zeros(shape=(TrainingBatchSize, OutputDataSpaceSize))
-
-    for g in range(0, TrainingBatchSize):
-      GRB = TrainingDataSets[g + Batch*TrainingBatchSize]
-      YTrain[g][0] = GRB.OriginLatitude
-      YTrain[g][1] = GRB.OriginLongitude
-      
-      XSlice = XTrain[g,]
-      XSlice.put(GRB.getIndices(), GRB.getValues())
+    if UseStream == True:
+      XTrain, YTrain = TrainingStream.next()
+    else:
+      XTrain, YTrain = TrainingDataSets.getBatch(Batch*TrainingBatchSize, (Batch+1)*TrainingBatchSize)
         
     XTrain = XTrain.reshape((TrainingBatchSize, PsiBins, ChiBins, PhiBins, 1))
     
@@ -541,6 +588,11 @@ print("\n\nTotal time converting per Iteration: {} sec".format(TimeConverting/It
 print("Total time training per Iteration:   {} sec".format(TimeTraining/Iteration))
 print("Total time testing per Iteration:    {} sec".format(TimeTesting/Iteration))
 
+if UseStream == True:
+  print("")
+  TrainingStream.printStatistics()
+  TrainingStream.close()
+
 
 #input("Press [enter] to EXIT")
 sys.exit(0)
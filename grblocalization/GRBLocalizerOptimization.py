@@ -73,6 +73,7 @@ parser.add_argument('-s', '--simulationoptions', default='', help='')
 parser.add_argument('-r', '--resolution', default='5.0', help='Resolution of the input grid in degrees')
 parser.add_argument('-b', '--batchsize', default='256', help='The number of GRBs in one training batch (default: 256 corresponsing to 5 degree grid resolution (64 for 3 degrees))')
 parser.add_argument('-o', '--outputdirectory', default='Output', help='Name of the output directory. If it exists, the current data and time will be appended.')
+parser.add_argument('--seed', default='', help='The master seed of the random number generators. The same seed creates the same data sets for any number of processes (default: a new seed at each run)')
 parser
 
 args = parser.parse_args()
@@ -143,6 +144,13 @@ OutputDirectory = args.outputdirectory
 # TODO: Add checks
 print("CMD-Line: Using \"{}\" as output directory".format(OutputDirectory))
 
+MasterSeed = None
+if args.seed != '':
+  MasterSeed = int(args.seed)
+  if MasterSeed < 0:
+    print("Error: The seed must be a non-negative integer and not {}".format(MasterSeed))
+    sys.exit(0)
+
 print("\n\n")
 
 
@@ -201,8 +209,11 @@ signal.signal(signal.SIGINT, signal_handler)
 
 
 # Everything ROOT related can only be loaded here otherwise it interferes with the argparse
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
 from GRBData import GRBData
+from GRBDataStore import GRBDataStore
 from GRBCreatorToyModel import GRBCreatorToyModel
+from RandomTools import createSeedSequence, childGenerator
 
 # Load MEGAlib into ROOT so that it is usable
 import ROOT as M
@@ -221,11 +232,29 @@ print("Info: Creating {:,} Compton events".format((NumberOfTrainingLocations + N
 
 ToyModelCreator = GRBCreatorToyModel(ResolutionInDegrees, OneSigmaNoiseInDegrees)  
 
+# All random numbers are derived from the master seed, print it, so that the data sets can be created again
+Seeds = createSeedSequence(MasterSeed)
+print("Info: Using {} as master seed".format(Seeds.entropy))
+
+# The keys of the data sets for the random number generators
+TrainingSeedKey = 0
+TestingSeedKey = 1
+
+
+def generateDataSets(Store, Begin, End, SeedKey):
+  # Each GRB has its own generator, thus the data sets do not depend on the number of processes or tasks
+  for g in range(Begin, End):
+    DataSet = GRBData()
+    DataSet.create(ToyModelCreator, NumberOfComptonEvents, NumberOfBackgroundEvents, childGenerator(Seeds, SeedKey, g))
+    Store.setGRB(g, DataSet)
 
-def generateOneDataSet(_):
-  DataSet = GRBData()
-  DataSet.create(ToyModelCreator, NumberOfComptonEvents, NumberOfBackgroundEvents)
-  return DataSet
+
+def createDataSets(NumberOfGRBs, SeedKey, TaskSize = 64):
+  # The workers write the histograms directly into the shared memory of the store
+  Store = GRBDataStore(NumberOfGRBs, NumberOfComptonEvents + NumberOfBackgroundEvents, InputDataSpaceSize)
+  pool.starmap(generateDataSets, [ (Store, Begin, min(Begin + TaskSize, NumberOfGRBs), SeedKey) for Begin in range(0, NumberOfGRBs, TaskSize) ])
+  Store.finalize()
+  return Store
   
   
 # Parallelizing using Pool.starmap()
@@ -235,10 +264,10 @@ pool = mp.Pool(mp.cpu_count())
 # Create data sets
 TimerCreation = time.time()
 
-TrainingDataSets = pool.map(generateOneDataSet, range(0, NumberOfTrainingLocations))
+TrainingDataSets = createDataSets(NumberOfTrainingLocations, TrainingSeedKey)
 print("Info: Created {:,} training data sets. ".format(NumberOfTrainingLocations))
 
-TestingDataSets = pool.map(generateOneDataSet, range(0, NumberOfTestLocations))
+TestingDataSets = createDataSets(NumberOfTestLocations, TestingSeedKey)
 print("Info: Created {:,} testing data sets. ".format(NumberOfTestLocations))
 
 pool.close()
@@ -408,6 +437,7 @@ with open(OutputDirectory + "/Configuration.txt", 'w') as f:
   f.write("ResolutionInDegrees: {}\n".format(ResolutionInDegrees))
   f.write("MaxBatchSize: {}\n".format(MaxBatchSize))
   f.write("OutputDirectory: {}\n".format(OutputDirectory))
+  f.write("MasterSeed: {}\n".format(Seeds.entropy))
   
 with open(OutputDirectory + '/Progress.txt', 'w') as f:
   f.write("Progress\n\n")
@@ -429,16 +459,7 @@ def CheckPerformance():
   for Batch in range(0, NumberOfTestingBatches):
         
     # Step 1: Convert the data
-    XTest = np.zeros(shape=(TestingBatchSize, PsiBins*ChiBins*PhiBins*1))
-    YTest = np.zeros(shape=(TestingBatchSize, OutputDataSpaceSize))
-
-    for g in range(0, TestingBatchSize):
-      GRB = TrainingDataSets[g + Batch*TrainingBatchSize]
-      YTest[g][0] = GRB.OriginLatitude
-      YTest[g][1] = GRB.OriginLongitude
-      
-      XSlice = XTest[g,]
-      XSlice.put(GRB.getIndices(), GRB.getValues())
+    XTest, YTest = TestingDataSets.getBatch(Batch*TestingBatchSize, (Batch+1)*TestingBatchSize)
     
     XTest = XTest.reshape((TestingBatchSize, PsiBins, ChiBins, PhiBins, 1))
     
@@ -504,16 +525,7 @@ while Iteration < MaxIterations:
     # Convert the data set into training and testing data
     TimerConverting = time.time()
     
-    XTrain = np.zeros(shape=(TrainingBatchSize, PsiBins*ChiBins*PhiBins*1))
-    YTrain = np.zeros(shape=(TrainingBatchSize, OutputDataSpaceSize))
-
-    for g in range(0, TrainingBatchSize):
-      GRB = TrainingDataSets[g + Batch*TrainingBatchSize]
-      YTrain[g][0] = GRB.OriginLatitude
-      YTrain[g][1] = GRB.OriginLongitude
-      
-      XSlice = XTrain[g,]
-      XSlice.put(GRB.getIndices(), GRB.getValues())
+    XTrain, YTrain = TrainingDataSets.getBatch(Batch*TrainingBatchSize, (Batch+1)*TrainingBatchSize)
         
     XTrain = XTrain.reshape((TrainingBatchSize, PsiBins, ChiBins, PhiBins, 1))
     
@@ -0,0 +1,227 @@
+###################################################################################################
+#
+# GRBStream.py
+#
+# Copyright (C) by Andreas Zoglauer.
+# All rights reserved.
+#
+# Please see the file License.txt in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+
+###################################################################################################
+
+
+import time
+import queue
+import traceback
+import multiprocessing as mp
+
+from GRBData import GRBData
+from GRBDataStore import GRBDataStore
+
+# Requires the common directory of the main repository in the python path
+from RandomTools import createSeedSequence, childGenerator
+
+
+###################################################################################################
+
+
+def generateStream(Store, ToyModel, NumberOfSourceEvents, NumberOfBackgroundEvents, BatchSize, FreeSlots, ReadySlots, Seeds):
+  """
+  The loop of a GRBStream worker process: fill the free slots with the requested batches until it receives None.
+  If the creation fails, (None, Batch, traceback) is sent instead of the slot and the worker stops
+  """
+
+  while True:
+    Task = FreeSlots.get()
+    if Task is None:
+      break
+    Slot, Batch = Task
+
+    Timer = time.time()
+    try:
+      for g in range(0, BatchSize):
+        # The GRB only depends on the seed and its index in the stream, not on the worker creating it
+        DataSet = GRBData()
+        DataSet.create(ToyModel, NumberOfSourceEvents, NumberOfBackgroundEvents, childGenerator(Seeds, Batch*BatchSize + g))
+        Store.setGRB(Slot*BatchSize + g, DataSet)
+    except Exception:
+      ReadySlots.put((None, Batch, traceback.format_exc()))
+      break
+
+    ReadySlots.put((Slot, Batch, time.time() - Timer))
+
+
+###################################################################################################
+
+
+class GRBStream:
+  """
+  This class generates an endless stream of new training batches of GRBs in worker processes, instead of
+  looping over a fixed set. The workers fill batch slots of a shared-memory GRBDataStore, at most QueueDepth
+  batches are prepared ahead. Each GRB has its own random number generator derived from the seed and its index in
+  the stream, and the batches are returned in order, thus the same seed gives the same stream for any number of workers.
+  The generation and consumption rates show whether there are enough workers to keep the training busy.
+  A typical usage would look like this:
+
+  Stream = GRBStream(ToyModel, 2000, 0, 256, NumberOfWorkers=8, QueueDepth=16, Seed=42)
+  for Batch in range(0, NumberOfBatches):
+    XTrain, YTrain = Stream.next()
+    ...
+  Stream.printStatistics()
+  Stream.close()
+
+  """
+
+
+###################################################################################################
+
+
+  def __init__(self, ToyModel, NumberOfSourceEvents, NumberOfBackgroundEvents, BatchSize, NumberOfWorkers = 1, QueueDepth = 4, Seed = None):
+    """
+    The default constructor for class GRBStream
+
+    Attributes
+    ----------
+    ToyModel : GRBCreatorToyModel
+      The creator of the GRB histograms
+    NumberOfSourceEvents, NumberOfBackgroundEvents : integer
+      The number of events per GRB
+    BatchSize : integer
+      The number of GRBs per batch
+    NumberOfWorkers : integer
+      The number of generating processes
+    QueueDepth : integer
+      The number of batch slots, i.e. the maximum number of batches generated ahead. Each slot takes
+      BatchSize x (8 x min(NumberOfSourceEvents + NumberOfBackgroundEvents, NumberOfBins) + 24) bytes of shared memory
+    Seed : integer or SeedSequence
+      The seed from which the random number generators of the GRBs are derived (see RandomTools)
+
+    """
+
+    self.BatchSize = BatchSize
+    self.NumberOfWorkers = max(1, NumberOfWorkers)
+    self.QueueDepth = max(1, QueueDepth)
+
+    self.Store = GRBDataStore(self.QueueDepth * BatchSize, NumberOfSourceEvents + NumberOfBackgroundEvents, ToyModel.getNumberOfBins())
+
+    self.FreeSlots = mp.Queue()
+    self.ReadySlots = mp.Queue()
+    for Slot in range(0, self.QueueDepth):
+      self.FreeSlots.put((Slot, Slot))
+
+    # Batches finished by the workers ahead of the next one to return, by batch number
+    self.ReadyBatches = {}
+
+    # The statistics: batches consumed, time waited for them, batches generated and the time the workers spent on them
+    self.StartTime = time.time()
+    self.NumberOfBatches = 0
+    self.NumberOfGeneratedBatches = 0
+    self.StallTime = 0.0
+    self.GenerationTime = 0.0
+
+    self.Seeds = createSeedSequence(Seed)
+    self.Workers = [ mp.Process(target=generateStream, args=(self.Store, ToyModel, NumberOfSourceEvents, NumberOfBackgroundEvents, BatchSize, self.FreeSlots, self.ReadySlots, self.Seeds), daemon=True) for w in range(0, self.NumberOfWorkers) ]
+    for Worker in self.Workers:
+      Worker.start()
+
+
+###################################################################################################
+
+
+  def next(self):
+    """
+    Return the dense histograms (BatchSize, NumberOfBins) and origins (BatchSize, 2) of the next new batch.
+    The histograms are only valid until the next call (see GRBDataStore.densify).
+    If a worker failed or died, the stream is closed and a RuntimeError is raised
+    """
+
+    if self.Workers is None:
+      raise RuntimeError("The GRB stream is already closed")
+
+    Timer = time.time()
+    while self.NumberOfBatches not in self.ReadyBatches:
+      try:
+        Slot, Batch, GenerationTime = self.ReadySlots.get(timeout=1.0)
+      except queue.Empty:
+        # The workers only exit when the stream is closed
+        ExitCodes = [ Worker.exitcode for Worker in self.Workers if Worker.exitcode is not None ]
+        if len(ExitCodes) > 0:
+          self.close()
+          raise RuntimeError("A GRB stream worker died unexpectedly (exit code {})".format(ExitCodes[0]))
+        continue
+
+      if Slot is None:
+        self.close()
+        raise RuntimeError("A GRB stream worker failed to create batch {}:\n{}".format(Batch, GenerationTime))
+
+      self.ReadyBatches[Batch] = Slot
+      self.NumberOfGeneratedBatches += 1
+      self.GenerationTime += GenerationTime
+    self.StallTime += time.time() - Timer
+
+    Slot = self.ReadyBatches.pop(self.NumberOfBatches)
+    X, Y = self.Store.getSlotBatch(Slot*self.BatchSize, (Slot+1)*self.BatchSize)
+
+    # The batch is copied, the slot can be refilled with the batch QueueDepth ahead
+    self.FreeSlots.put((Slot, self.NumberOfBatches + self.QueueDepth))
+    self.NumberOfBatches += 1
+
+    return X, Y
+
+
+###################################################################################################
+
+
+  def printStatistics(self):
+    """
+    Print the generation and consumption rates
+    """
+
+    Elapsed = max(time.time() - self.StartTime, 1e-9)
+    NumberOfGRBs = self.NumberOfBatches * self.BatchSize
+    GenerationRate = self.NumberOfGeneratedBatches * self.BatchSize / max(self.GenerationTime, 1e-9)
+
+    print("GRB stream: {:,} GRBs consumed in {:.1f} sec: {:,.0f} GRBs/sec (waited {:.1f} sec for batches)".format(NumberOfGRBs, Elapsed, NumberOfGRBs / Elapsed, self.StallTime))
+    print("GRB stream: generation rate {:,.0f} GRBs/sec per worker, {:,.0f} GRBs/sec with {} workers".format(GenerationRate, GenerationRate * self.NumberOfWorkers, self.NumberOfWorkers))
+
+    # Without waiting, the training would have consumed the GRBs at this rate
+    ConsumptionRate = NumberOfGRBs / max(Elapsed - self.StallTime, 1e-9)
+    print("GRB stream: training consumption rate {:,.0f} GRBs/sec, i.e. ~{:.1f} workers needed".format(ConsumptionRate, ConsumptionRate / GenerationRate))
+
+
+###################################################################################################
+
+
+  def close(self):
+    """
+    Stop the workers and release the shared memory
+    """
+
+    if self.Workers is None:
+      return
+
+    # The batches not yet started are dropped, the workers only finish their current one
+    try:
+      while True:
+        self.FreeSlots.get_nowait()
+    except queue.Empty:
+      pass
+
+    for Worker in self.Workers:
+      self.FreeSlots.put(None)
+    for Worker in self.Workers:
+      Worker.join(timeout=10)
+      if Worker.is_alive():
+        Worker.terminate()
+    self.Workers = None
+
+    self.Store.close()
+
+
+# END
+###################################################################################################
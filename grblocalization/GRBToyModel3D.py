@@ -31,6 +31,9 @@ import os
 from datetime import datetime
 from functools import reduce
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from RandomTools import createSeedSequence, childGenerator
+
 import ROOT as M
 
 # Load MEGAlib into ROOT so that it is usable
@@ -63,6 +66,9 @@ OneSigmaNoiseInRadians = math.radians(0.0)
 
 OutputDirectory = "Output"
 
+# The master seed of all random number generators (None: a new one at each run)
+MasterSeed = None
+
 
 # Set derived parameters
 NumberOfTrainingBatches= (int) (NumberOfTrainingLocations / MaxBatchSize)
@@ -162,7 +168,7 @@ def ComptonScatterAngle(Eg, Ee):
 
 
 
-def Create(Ei, Rotation):
+def Create(Ei, Rotation, Generator):
 
   # Simulate the gamma ray according to Butcher & Messel: Nuc Phys 20(1960), 15
 
@@ -181,26 +187,26 @@ def Create(Ei, Rotation):
   Reject = 0.0
 
   while True:
-    if Alpha1/(Alpha1+Alpha2) > random.random():
-      Epsilon = math.exp(-Alpha1*random.random())
+    if Alpha1/(Alpha1+Alpha2) > Generator.random():
+      Epsilon = math.exp(-Alpha1*Generator.random())
       EpsilonSquare = Epsilon*Epsilon
     else:
-      EpsilonSquare = Epsilon0Square + (1.0 - Epsilon0Square)*random.random()
+      EpsilonSquare = Epsilon0Square + (1.0 - Epsilon0Square)*Generator.random()
       Epsilon = math.sqrt(EpsilonSquare)
       
     OneMinusCosTheta = (1.- Epsilon)/(Epsilon*Ei_m)
     SinThetaSquared = OneMinusCosTheta*(2.-OneMinusCosTheta)
     Reject = 1.0 - Epsilon*SinThetaSquared/(1.0 + EpsilonSquare)
 
-    if Reject < random.random():
+    if Reject < Generator.random():
       break
   
   CosTeta = 1.0 - OneMinusCosTheta; 
 
   # Set the new photon parameters --- direction is random since we didn't give a start direction
 
-  Theta = np.arccos(1 - 2*random.random()) # Compton scatter angle since on axis
-  Phi = 2.0 * np.pi * random.random();   
+  Theta = np.arccos(1 - 2*Generator.random()) # Compton scatter angle since on axis
+  Phi = 2.0 * np.pi * Generator.random();   
 
   Dg = M.MVector()
   Dg.SetMagThetaPhi(1.0, Theta, Phi) 
@@ -218,26 +224,29 @@ def Create(Ei, Rotation):
 
 
 # Dummy noising of the data
-def Noise(Chi, Psi, Theta, NoiseOneSigmaInRadians):
+def Noise(Chi, Psi, Theta, NoiseOneSigmaInRadians, Generator):
   NoisedChi = sys.float_info.max
   while NoisedChi < 0 or NoisedChi > math.pi:
-    NoisedChi = np.random.normal(Chi, NoiseOneSigmaInRadians)
+    NoisedChi = Generator.normal(Chi, NoiseOneSigmaInRadians)
     #print("Chi: {} {}".format(Chi, NoisedChi))
 
   NoisedPsi = sys.float_info.max
   while NoisedPsi < -math.pi or NoisedPsi > math.pi:
-    NoisedPsi = np.random.normal(Psi, NoiseOneSigmaInRadians)
+    NoisedPsi = Generator.normal(Psi, NoiseOneSigmaInRadians)
     #print("Psi {} {}".format(Psi, NoisedPsi))
 
   NoisedTheta = sys.float_info.max
   while NoisedTheta < 0 or NoisedTheta > math.pi:
-    NoisedTheta = np.random.normal(Theta, NoiseOneSigmaInRadians)
+    NoisedTheta = Generator.normal(Theta, NoiseOneSigmaInRadians)
     #print("Theta {} {}".format(Theta, NoisedTheta))
 
   return NoisedChi, NoisedPsi, NoisedTheta
 
 
-def GenerateOneDataSet(Index):
+def GenerateOneDataSet(Index, SeedKey):
+
+  # Each data set has its own generator, thus the data sets do not depend on the number of processes
+  Generator = childGenerator(Seeds, SeedKey, Index)
 
   DataSet = np.zeros(shape=(ThetaBins, ChiBins, PsiBins, 1))
 
@@ -246,8 +255,8 @@ def GenerateOneDataSet(Index):
 
   # Create a random rotation matrix
   V = M.MVector()
-  V.SetMagThetaPhi(1, np.arccos(1 - 2*random.random()), 2.0 * np.pi * random.random())
-  Angle = 2.0 * np.pi * random.random()
+  V.SetMagThetaPhi(1, np.arccos(1 - 2*Generator.random()), 2.0 * np.pi * Generator.random())
+  Angle = 2.0 * np.pi * Generator.random()
 
   '''
   if random.random() < 0.25:
@@ -273,11 +282,11 @@ def GenerateOneDataSet(Index):
   
   # Create the input source events
   for e in range(0, NumberOfComptonEvents):
-    Chi, Psi, Theta, Energy = Create(511, Rotation)
+    Chi, Psi, Theta, Energy = Create(511, Rotation, Generator)
     #print("{}, {}, {}".format(Chi, Psi, Theta))
   
     if OneSigmaNoiseInRadians > 0:
-      Chi, Psi, Theta = Noise(Chi, Psi, Theta, OneSigmaNoiseInRadians)
+      Chi, Psi, Theta = Noise(Chi, Psi, Theta, OneSigmaNoiseInRadians, Generator)
 
     ChiBin = (int) (((Chi - ChiMin) / (ChiMax - ChiMin)) * ChiBins)
     PsiBin = (int) (((Psi - PsiMin) / (PsiMax - PsiMin)) * PsiBins)
@@ -287,9 +296,9 @@ def GenerateOneDataSet(Index):
     
   # Create input background events
   for e in range(0, NumberOfBackgroundEvents):
-    ChiBin = random.randint(0, ChiBins-1)
-    PsiBin = random.randint(0, PsiBins-1)
-    ThetaBin = random.randint(0, ThetaBins-1)
+    ChiBin = Generator.integers(0, ChiBins)
+    PsiBin = Generator.integers(0, PsiBins)
+    ThetaBin = Generator.integers(0, ThetaBins)
 
     DataSet[ThetaBin, ChiBin, PsiBin] += 1
 
@@ -298,12 +307,20 @@ def GenerateOneDataSet(Index):
 
 
 
+# All random numbers are derived from the master seed, print it, so that the data sets can be created again
+Seeds = createSeedSequence(MasterSeed)
+print("Info: Using {} as master seed".format(Seeds.entropy))
+
+# The keys of the data sets for the random number generators
+TrainingSeedKey = 0
+TestingSeedKey = 1
+
 # Parallelizing using Pool.starmap()
 import multiprocessing as mp
 
 # Create data sets
 pool = mp.Pool(mp.cpu_count())
-DataSetTrain = pool.map(GenerateOneDataSet, [l for l in range(0, NumberOfTrainingLocations)])
+DataSetTrain = pool.starmap(GenerateOneDataSet, [(l, TrainingSeedKey) for l in range(0, NumberOfTrainingLocations)])
 pool.close() 
 print("Info: Created {:,} training data sets. Now prepping them for Tensorflow.".format(NumberOfTrainingLocations))
 
@@ -358,7 +375,7 @@ del DataSetTrain
 
 # Create data sets
 pool = mp.Pool(mp.cpu_count())
-DataSetTest = pool.map(GenerateOneDataSet, [l for l in range(0, NumberOfTestLocations)])
+DataSetTest = pool.starmap(GenerateOneDataSet, [(l, TestingSeedKey) for l in range(0, NumberOfTestLocations)])
 pool.close() 
 print("Info: Created {:,} testing data sets. Now prepping them for Tensorflow.".format(NumberOfTestLocations))
 
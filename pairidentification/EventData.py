@@ -289,6 +289,32 @@ class EventData:
 
 
 
+###################################################################################################
+
+
+  def createFromCache(self, Cache, Index):
+    """
+    Fill the data from the event with the given index of an EventCache
+    """
+
+    Hits = Cache.getHits(Index)
+
+    self.EventID = int(Cache.EventID[Index])
+
+    self.GammaEnergy = float(Cache.GammaEnergy[Index])
+
+    self.OriginPositionZ = float(Cache.OriginPositionZ[Index])
+
+    # Copies, since the cache is read-only and e.g. center() modifies the positions
+    self.ID     = np.array(Hits["ID"], dtype=int)
+    self.Origin = np.array(Hits["Origin"], dtype=int)
+    self.X      = np.array(Hits["X"], dtype=float)
+    self.Y      = np.array(Hits["Y"], dtype=float)
+    self.Z      = np.array(Hits["Z"], dtype=float)
+    self.E      = np.array(Hits["E"], dtype=float)
+    self.Type   = Hits["Type"].astype(str)
+
+
 ###################################################################################################
 
 
@@ -90,6 +90,11 @@ parser.add_argument('-f', '--filename', default='PairIdentification.p1.sim.gz',
 parser.add_argument('-m', '--maxevents', default='10000', help='Maximum number of events to use')
 parser.add_argument('-s', '--testingtrainigsplit', default='0.1', help='Testing-training split')
 parser.add_argument('-b', '--batchsize', default='128', help='Batch size')
+parser.add_argument('-c', '--cache', default='', help='Event cache directory: Created from the sim file at the first run, used instead of the sim file afterwards')
+parser.add_argument('-j', '--jobs', default='1', help='Number of processes parsing the sim file (or all parts X.p1.sim.gz, X.p2.sim.gz, ... of a multi-threaded cosima run), 0 for all cores')
+parser.add_argument('-w', '--prefetchworkers', default='2', help='Number of threads preparing the next training batches while the current one is trained')
+parser.add_argument('-q', '--prefetchdepth', default='4', help='Number of training batches prepared ahead')
+parser.add_argument('-v', '--voxelcache', default='', help='Voxel cache directory: The voxelized data sets are stored there at the first run, and reused as long as input file, binning, and selection do not change')
 
 args = parser.parse_args()
 
@@ -105,6 +110,16 @@ if int(args.batchsize) >= 16:
 if float(args.testingtrainigsplit) >= 0.05:
   TestingTrainingSplit = float(args.testingtrainigsplit)
 
+CacheName = args.cache
+VoxelCacheName = args.voxelcache
+
+PrefetchWorkers = int(args.prefetchworkers)
+PrefetchDepth = int(args.prefetchdepth)
+
+NumberOfJobs = int(args.jobs)
+if NumberOfJobs == 0:
+  NumberOfJobs = os.cpu_count()
+
 
 if os.path.exists(OutputDirectory):
   Now = datetime.now()
@@ -137,6 +152,14 @@ signal.signal(signal.SIGINT, signal_handler)
 # Everything ROOT related can only be loaded here otherwise it interferes with the argparse
 from EventData import EventData
 
+# The shared tools are in the common directory of the main repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from EventCache import EventCache, EventCollection, convertSimFile
+from EventBatch import EventBatch
+from SimFileReader import iterateSimFiles
+from Voxelizer import Voxelizer
+from VoxelCache import VoxelCache
+
 # Load MEGAlib into ROOT so that it is usable
 import ROOT as M
 M.gSystem.Load("$(MEGALIB)/lib/libMEGAlib.so")
@@ -149,42 +172,102 @@ M.PyConfig.IgnoreCommandLineOptions = True
 ###################################################################################################
 
 
-# Read the simulation file data:
-DataSets = []
+# The accepted events are collected in chunks of this many events
+ChunkSize = 10000
 
 
-# Load geometry:
-Geometry = M.MDGeometryQuest()
-if Geometry.ScanSetupFile(M.MString(GeometryName)) == True:
-  print("Geometry " + GeometryName + " loaded!")
-else:
-  print("Unable to load geometry " + GeometryName + " - Aborting!")
-  quit()
+# Returns the parsed event or None, used to create the event cache
+def parseEvent(Event):
+  Data = EventData()
+  if Data.parse(Event) == True:
+    return Data
+  return None
+
+
+# Returns the events of the batch which pass the selection
+def selectDataSets(Batch):
+  return Batch.select(Batch.hasHitsOutside(XMin, XMax, YMin, YMax, ZMin, ZMax) == False)
 
 
-Reader = M.MFileEventsSim(Geometry)
-if Reader.Open(M.MString(FileName)) == False:
-  print("Unable to open file " + FileName + ". Aborting!")
-  quit()
+# The event cache is created once from the full sim file, then all later runs only read the cache
+if CacheName != "" and EventCache.exists(CacheName) == False:
+  try:
+    convertSimFile(FileName, CacheName, parseEvent, GeometryName, NumberOfWorkers=NumberOfJobs)
+  except IOError as Error:
+    print("Unable to create the event cache: {} - Aborting!".format(Error))
+    quit()
 
 
-print("\n\nStarted reading data sets")
+# Otherwise, in parallel mode, the sim file(s) are parsed by a process pool chunk by chunk, until enough data sets are selected
+Caches = None
+SimFileChunks = None
+if CacheName != "":
+  print("\n\nStarted reading data sets from event cache {}".format(CacheName))
+  Caches = [ EventCache(CacheName) ]
+elif NumberOfJobs > 1:
+  print("\n\nStarted reading data sets with {} processes".format(NumberOfJobs))
+  SimFileChunks = iterateSimFiles(FileName, parseEvent, GeometryName, NumberOfJobs)
+  Caches = ( EventCache(Columns=Columns) for Columns in SimFileChunks )
+
+
+Chunks = []
 NumberOfDataSets = 0
-while NumberOfDataSets < MaxEvents:
-  Event = Reader.GetNextEvent()
-  if not Event:
-    break
-
-  if Event.GetNIAs() > 0:
-    Data = EventData()
-    if Data.parse(Event) == True:
-      if Data.hasHitsOutside(XMin, XMax, YMin, YMax, ZMin, ZMax) == False:
-        DataSets.append(Data)
-        NumberOfDataSets += 1
-        if NumberOfDataSets % 500 == 0:
-            print("Data sets processed: {}".format(NumberOfDataSets))
-
-print("Info: Parsed {} events".format(NumberOfDataSets))
+if Caches is not None:
+  for Cache in Caches:
+    for Begin in range(0, len(Cache), ChunkSize):
+      if NumberOfDataSets >= MaxEvents:
+        break
+
+      Chunks.append(selectDataSets(EventBatch.fromCache(Cache, Begin, Begin + ChunkSize)))
+      NumberOfDataSets += len(Chunks[-1])
+      print("Data sets processed: {}".format(NumberOfDataSets))
+
+    if NumberOfDataSets >= MaxEvents:
+      break
+
+  # Stop the process pool, the rest of the sim file is not needed
+  if SimFileChunks is not None:
+    SimFileChunks.close()
+
+else:
+  # Load geometry:
+  Geometry = M.MDGeometryQuest()
+  if Geometry.ScanSetupFile(M.MString(GeometryName)) == True:
+    print("Geometry " + GeometryName + " loaded!")
+  else:
+    print("Unable to load geometry " + GeometryName + " - Aborting!")
+    quit()
+
+
+  Reader = M.MFileEventsSim(Geometry)
+  if Reader.Open(M.MString(FileName)) == False:
+    print("Unable to open file " + FileName + ". Aborting!")
+    quit()
+
+
+  print("\n\nStarted reading data sets")
+  Events = EventCollection()
+  while NumberOfDataSets < MaxEvents:
+    Event = Reader.GetNextEvent()
+    if Event and Event.GetNIAs() > 0:
+      Data = parseEvent(Event)
+      if Data is not None:
+        Events.add(Data, EventID=Event.GetID())
+
+    # The selection is applied to a whole chunk of parsed events at once
+    if len(Events) >= ChunkSize or (not Event and len(Events) > 0):
+      Chunks.append(selectDataSets(EventBatch(Events.get())))
+      NumberOfDataSets += len(Chunks[-1])
+      print("Data sets processed: {}".format(NumberOfDataSets))
+      Events = EventCollection()
+
+    if not Event:
+      break
+
+# All data sets as one batch
+DataSets = EventBatch.concatenate(Chunks).slice(0, MaxEvents) if len(Chunks) > 0 else EventBatch(EventCollection().get())
+
+print("Info: Parsed {} events".format(len(DataSets)))
 
 # Split the data sets in training and testing data sets
 
@@ -195,8 +278,9 @@ numEvents = len(DataSets)
 
 numTraining = int(numEvents * TestingTrainingSplit)
 
-TrainingDataSets = DataSets[:numTraining]
-ValidationDataSets = DataSets[numTraining:]
+# Views, no copies
+TrainingDataSets = DataSets.slice(0, numTraining)
+ValidationDataSets = DataSets.slice(numTraining, numEvents)
 
 
 
@@ -303,15 +387,17 @@ print("Initializing Tensors...")
 
 class tensor_generator(tf.keras.utils.Sequence):
 
-    def __init__(self, event_data, batch_size):
+    def __init__(self, event_data, voxels, batch_size):
         self.event_data = event_data
+        # The voxelized hits of the events, in the compact sparse form
+        self.voxels = voxels
         self.batch_size = batch_size
 
     def __len__(self):
         return int(len(self.event_data)/self.batch_size)
 
     def __getitem__(self, idx):
-        pos_tensor = make_positional_tensor(self.event_data, idx, self.batch_size)
+        pos_tensor = make_positional_tensor(self.voxels, idx, self.batch_size)
         gamma_tensor = make_gamma_tensor(self.event_data, idx, self.batch_size)
         label_tensor = make_label_tensor(self.event_data, idx, self.batch_size)
 
@@ -323,17 +409,11 @@ class tensor_generator(tf.keras.utils.Sequence):
 
 
 
-def make_positional_tensor(event_data, idx, batch_size):
-    tensor = np.zeros(shape=(batch_size, XBins, YBins, ZBins, 1))
-    for i in range(batch_size):
-        Event = event_data[i + idx*batch_size]
-        for j in range(len(Event.X)):
-            XBin = int( (Event.X[j] - XMin) / ((XMax - XMin) / XBins) )
-            YBin = int( (Event.Y[j] - YMin) / ((YMax - YMin) / YBins) )
-            ZBin = int( (Event.Z[j] - ZMin) / ((ZMax - ZMin) / ZBins) )
-            if XBin >= 0 and YBin >= 0 and ZBin >= 0 and XBin < XBins and YBin < YBins and ZBin < ZBins:
-                tensor[i][XBin][YBin][ZBin][0] = Event.E[j]
-    return tensor
+Voxels = Voxelizer(XBins, YBins, ZBins, XMin, XMax, YMin, YMax, ZMin, ZMax)
+
+def make_positional_tensor(voxels, idx, batch_size):
+    # Keras may request batches from several threads, thus each batch gets its own dense tensor instead of Voxels.densify()
+    return voxels.slice(idx*batch_size, (idx+1)*batch_size).toDense()
 
 
 
@@ -362,14 +442,22 @@ def make_label_tensor(event_data, idx, batch_size):
 
 
 
-training_generator = tensor_generator(TrainingDataSets, BatchSize)
-validation_generator = tensor_generator(ValidationDataSets, BatchSize)
+# The hits are voxelized once, with a voxel cache only once for a given input file, binning, and selection
+if VoxelCacheName != "":
+    VoxelConfiguration = { "Input": VoxelCache.describeFile(CacheName if CacheName != "" else FileName), "MaxEvents": MaxEvents, "Selection": "Pair identification: all hits inside the volume", "Voxelizer": Voxels.getConfiguration(), "Sum": False }
+    AllVoxels = VoxelCache(VoxelCacheName).get(VoxelConfiguration, lambda: Voxels.voxelizeBatchSparse(DataSets, Sum=False))
+else:
+    AllVoxels = Voxels.voxelizeBatchSparse(DataSets, Sum=False)
+
+training_generator = tensor_generator(TrainingDataSets, AllVoxels.slice(0, numTraining), BatchSize)
+validation_generator = tensor_generator(ValidationDataSets, AllVoxels.slice(numTraining, numEvents), BatchSize)
 # testing_generator = tensor_generator(TestingDataSets, BatchSize)
 
 
 print("Training Model...")
 
-history = combined_model.fit_generator(generator=training_generator, verbose=1, epochs=50, validation_data=validation_generator, shuffle=True)
+# Keras prepares the next batches of the Sequence in threads while the current one is trained
+history = combined_model.fit_generator(generator=training_generator, verbose=1, epochs=50, validation_data=validation_generator, shuffle=True, workers=PrefetchWorkers, max_queue_size=PrefetchDepth, use_multiprocessing=False)
 
 print("Finished Training\nHistory is: \n")
 print(history.history)
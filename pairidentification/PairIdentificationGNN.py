@@ -116,6 +116,11 @@ signal.signal(signal.SIGINT, signal_handler)
 # Everything ROOT related can only be loaded here otherwise it interferes with the argparse
 from EventData import EventData
 
+# The shared tools are in the common directory of the main repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from EventBatch import EventBatch
+from PairToyModel import PairToyModel
+
 # Load MEGAlib into ROOT so that it is usable
 import ROOT as M
 M.gSystem.Load("$(MEGALIB)/lib/libMEGAlib.so")
@@ -133,15 +138,9 @@ DataSets = []
 NumberOfDataSets = 0
 
 if UseToyModel == True:
-  for e in range(0, MaxEvents):
-    Data = EventData()
-    Data.createFromToyModel(e)
-    DataSets.append(Data)
-    
-    NumberOfDataSets += 1
-    if NumberOfDataSets > 0 and NumberOfDataSets % 1000 == 0:
-      print("Data sets processed: {}".format(NumberOfDataSets))
-  
+  DataSets = PairToyModel().generate(MaxEvents)
+  NumberOfDataSets = len(DataSets)
+
 else:
   # Load geometry:
   Geometry = M.MDGeometryQuest()
@@ -174,6 +173,8 @@ else:
           if NumberOfDataSets % 500 == 0:
             print("Data sets processed: {}".format(NumberOfDataSets))
 
+  DataSets = EventBatch.fromEvents(DataSets)
+
 print("Info: Parsed {} events".format(NumberOfDataSets))
 
 # Split the data sets in training and testing data sets
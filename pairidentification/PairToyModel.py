@@ -0,0 +1,243 @@
+###################################################################################################
+#
+# PairToyModel.py
+#
+# Copyright (C) by Andreas Zoglauer.
+# All rights reserved.
+#
+# Please see the file License.txt in the main repository for the copyright-notice.
+#
+###################################################################################################
+
+
+
+
+###################################################################################################
+
+
+import numpy as np
+
+# Requires the common directory of the main repository in the python path
+from EventCache import EventCache
+from EventBatch import EventBatch
+from VectorTools import directionsFromThetaPhi, rotateReferenceFrame
+
+
+###################################################################################################
+
+
+class PairToyModel:
+  """
+  This class generates many toy-model pair events at once, with the same physics as
+  EventData.createFromToyModel, but with numpy instead of one event at a time and without ROOT.
+  The electron and positron tracks of all events are stepped in parallel, tracks which stopped are masked out.
+  A typical usage would look like this:
+
+  ToyModel = PairToyModel(Seed=42)
+  Batch = ToyModel.generate(100000)
+
+  """
+
+
+###################################################################################################
+
+
+  def __init__(self, Energy = 10000, MaxHits = 1000, Seed = None):
+    """
+    The default constructor for class PairToyModel
+
+    Attributes
+    ----------
+    Energy : float
+      The initial gamma-ray energy in keV
+    MaxHits : integer
+      The maximum number of hits per event (as EventData.MaxHits)
+    Seed : integer, SeedSequence, or Generator
+      The seed of the random number generator
+
+    """
+
+    self.Energy = Energy
+    self.MaxHits = MaxHits
+    self.Generator = np.random.default_rng(Seed)
+
+
+###################################################################################################
+
+
+  def track(self, Position, Direction, Energy, InitialDepth, MaxSteps):
+    """
+    Track one particle per event through the layers until it has deposited all its energy
+
+    Attributes
+    ----------
+    Position, Direction : numpy arrays of shape (N, 3)
+      The start positions and directions
+    Energy : numpy array
+      The start energies
+    InitialDepth : numpy array
+      The fraction of the first energy deposit in the start layer
+    MaxSteps : numpy array
+      The maximum number of steps of each particle
+
+    Returns
+    -------
+    numpy arrays
+      For each step: the event index, the step number, the position (N, 3), and the deposited energy
+
+    """
+
+    Ei = self.Energy
+
+    Position = Position.copy()
+    Direction = Direction.copy()
+    Energy = Energy.copy()
+
+    StepEvents = []
+    StepNumbers = []
+    StepPositions = []
+    StepEnergies = []
+
+    Active = np.flatnonzero((Energy > 0) & (MaxSteps > 0))
+    Step = 0
+    while len(Active) > 0:
+      A = len(Active)
+      EnergyActive = Energy[Active]
+
+      # Draw the deposit until it is positive
+      dE = np.zeros(shape=(A))
+      Pending = np.arange(A)
+      while len(Pending) > 0:
+        P = len(Pending)
+        dE[Pending] = np.maximum(self.Generator.normal(250, 20, P), self.Generator.normal(10*np.sqrt(Ei-EnergyActive[Pending]), 0.1*np.sqrt(EnergyActive[Pending])))
+        Pending = Pending[dE[Pending] <= 0]
+
+      if Step == 0:
+        dE *= InitialDepth[Active]
+
+      dE = np.minimum(dE, EnergyActive)
+
+      StepEvents.append(Active)
+      StepNumbers.append(np.full(A, Step))
+      StepPositions.append(Position[Active])
+      StepEnergies.append(dE)
+
+      Energy[Active] -= dE
+
+      dAngle = (Ei - Energy[Active]) * 0.4*np.pi / Ei
+      dEe = directionsFromThetaPhi(dAngle, 2.0 * np.pi * self.Generator.random(A))
+
+      Direction[Active] = rotateReferenceFrame(Direction[Active], dEe)
+
+      # Move to the next layer
+      Lambda = np.where(Direction[Active, 2] > 0, 1.0, -1.0) / Direction[Active, 2]
+      Position[Active] += Lambda[:, np.newaxis] * Direction[Active]
+
+      Step += 1
+      Active = Active[(Energy[Active] > 0) & (MaxSteps[Active] > Step)]
+
+    return np.concatenate(StepEvents), np.concatenate(StepNumbers), np.concatenate(StepPositions), np.concatenate(StepEnergies)
+
+
+###################################################################################################
+
+
+  def generate(self, NumberOfEvents, FirstEventID = 0):
+    """
+    Generate the given number of events
+
+    Returns
+    -------
+    EventBatch
+      The events, their IDs start with FirstEventID
+
+    """
+
+    N = NumberOfEvents
+    Ei = self.Energy
+
+    # Start position (randomly within a certain volume)
+    xi = 40.0 * (self.Generator.random(N) - 0.5)
+    yi = 40.0 * (self.Generator.random(N) - 0.5)
+    zi = np.trunc(40.0 * (self.Generator.random(N) - 0.5))
+    Start = np.stack((xi, yi, zi), axis=-1)
+
+    # Random energy split
+    Ee = (0.2 + self.Generator.random(N) * 0.8)*Ei
+    Ep = Ei - Ee
+
+    # Random opening angle
+    OpeningAngle = 0.1 + 0.6*self.Generator.random(N)
+
+    # Initial direction electron and positron
+    Pe = 2*np.pi * self.Generator.random(N)
+    De = directionsFromThetaPhi(np.pi - Ee/Ei * OpeningAngle, Pe)
+    Dp = directionsFromThetaPhi(np.pi - Ep/Ei * OpeningAngle, Pe - np.pi)
+
+    InitialDepth = self.Generator.random(N)
+
+
+    # Track the electrons, then the positrons, which get the remaining hits
+    # The first deposits of both are merged into the first hit, thus the positron has one step more than remaining hit IDs
+    MaxStepsE = np.full(N, self.MaxHits - 3)
+    EEvents, ESteps, EPositions, EEnergies = self.track(Start, De, Ee, InitialDepth, MaxStepsE)
+    NumberOfStepsE = np.bincount(EEvents, minlength=N)
+
+    MaxStepsP = np.where(NumberOfStepsE + 1 < self.MaxHits - 2, self.MaxHits - 2 - NumberOfStepsE, 0)
+    PEvents, PSteps, PPositions, PEnergies = self.track(Start, Dp, Ep, InitialDepth, MaxStepsP)
+
+
+    # Hit 0 ("m") contains the initial deposits of electron and positron,
+    # then follow the electron hits ("e"), and then the positron hits ("p")
+    IsEInitial = ESteps == 0
+    IsPInitial = PSteps == 0
+
+    InitialEnergy = np.bincount(EEvents[IsEInitial], weights=EEnergies[IsEInitial], minlength=N) + np.bincount(PEvents[IsPInitial], weights=PEnergies[IsPInitial], minlength=N)
+    HasInitial = np.bincount(EEvents[IsEInitial], minlength=N) + np.bincount(PEvents[IsPInitial], minlength=N) > 0
+
+    # The hit index within the event
+    InitialIndices = np.zeros(shape=(np.count_nonzero(HasInitial)), dtype="int64")
+    EIndices = ESteps[~IsEInitial]
+    PIndices = NumberOfStepsE[PEvents[~IsPInitial]] - 1 + PSteps[~IsPInitial]
+
+    HitEvents = np.concatenate((np.flatnonzero(HasInitial), EEvents[~IsEInitial], PEvents[~IsPInitial]))
+    HitIndices = np.concatenate((InitialIndices, EIndices, PIndices))
+    HitPositions = np.concatenate((Start[HasInitial], EPositions[~IsEInitial], PPositions[~IsPInitial]))
+    HitEnergies = np.concatenate((InitialEnergy[HasInitial], EEnergies[~IsEInitial], PEnergies[~IsPInitial]))
+    HitTypes = np.concatenate((np.full(len(InitialIndices), b"m"), np.full(len(EIndices), b"e"), np.full(len(PIndices), b"p")))
+
+    # The first positron hit originates from hit 1 (ID 1), all others from the previous hit
+    IsFirstP = np.concatenate((np.zeros(len(InitialIndices) + len(EIndices), dtype=bool), PSteps[~IsPInitial] == 1))
+
+
+    # Order by event and hit index
+    Order = np.lexsort((HitIndices, HitEvents))
+
+    HitEvents = HitEvents[Order]
+    ID = HitIndices[Order] + 1
+
+    Offsets = np.zeros(shape=(N+1), dtype="int64")
+    np.cumsum(np.bincount(HitEvents, minlength=N), out=Offsets[1:])
+
+    Columns = { "Offsets": Offsets }
+    Columns["X"] = HitPositions[Order, 0].astype(EventCache.HitColumns["X"])
+    Columns["Y"] = HitPositions[Order, 1].astype(EventCache.HitColumns["Y"])
+    Columns["Z"] = HitPositions[Order, 2].astype(EventCache.HitColumns["Z"])
+    Columns["E"] = HitEnergies[Order].astype(EventCache.HitColumns["E"])
+    Columns["Type"] = HitTypes[Order].astype(EventCache.HitColumns["Type"])
+    Columns["Origin"] = np.where(IsFirstP[Order], 1, ID - 1).astype(EventCache.HitColumns["Origin"])
+    Columns["ID"] = ID.astype(EventCache.HitColumns["ID"])
+
+    Columns["EventID"] = np.arange(FirstEventID, FirstEventID + N, dtype=EventCache.EventColumns["EventID"])
+    Columns["OriginPositionX"] = xi
+    Columns["OriginPositionY"] = yi
+    Columns["OriginPositionZ"] = zi
+    # As in EventData: the sum of all deposits
+    Columns["GammaEnergy"] = np.bincount(HitEvents, weights=Columns["E"], minlength=N)
+    Columns["EventType"] = np.zeros(shape=(N), dtype=EventCache.EventColumns["EventType"])
+
+    return EventBatch(Columns)
+
+
+# END
+###################################################################################################
@@ -2,7 +2,7 @@
 PyTorch dataset specifications.
 """
 
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, RandomSampler
 from torch.utils.data.distributed import DistributedSampler
 from torch.utils.data.dataloader import default_collate
 
@@ -16,24 +16,48 @@ def get_datasets(name, **data_args):
     else:
         raise Exception('Dataset %s unknown' % name)
 
-def get_data_loaders(name, batch_size, distributed=False, **data_args):
-    """This may replace the datasets function above"""
+def get_data_loaders(name, batch_size, distributed=False, n_buckets=0, **data_args):
+    """
+    This may replace the datasets function above.
+    With n_buckets > 0, the training batches of the hit graphs are formed
+    from graphs of similar sizes (see datasets.bucketing).
+    """
     collate_fn = default_collate
+    train_sizes = None
     if name == 'dummy':
         from .dummy import get_datasets
         train_dataset, valid_dataset = get_datasets(**data_args)
     elif name == 'hitgraphs':
         from . import hitgraphs
         train_dataset, valid_dataset = hitgraphs.get_datasets(**data_args)
-        collate_fn = hitgraphs.collate_fn
+        # Sparse graphs are concatenated into one graph instead of padded
+        if data_args.get('sparse', False):
+            collate_fn = hitgraphs.collate_sparse_fn
+        else:
+            collate_fn = hitgraphs.collate_fn
+        if n_buckets > 0:
+            train_sizes = hitgraphs.get_graph_sizes(train_dataset)
     else:
         raise Exception('Dataset %s unknown' % name)
 
     # Construct the data loaders
     train_sampler = DistributedSampler(train_dataset) if distributed else None
-    train_data_loader = DataLoader(train_dataset, batch_size=batch_size,
-                                   sampler=train_sampler, collate_fn=collate_fn)
+    if train_sizes is not None:
+        from .bucketing import BucketBatchSampler
+        if train_sampler is None:
+            train_sampler = RandomSampler(train_dataset)
+        train_batch_sampler = BucketBatchSampler(train_sampler, *train_sizes,
+                                                 batch_size=batch_size,
+                                                 n_buckets=n_buckets)
+        train_data_loader = DataLoader(train_dataset, batch_sampler=train_batch_sampler,
+                                       collate_fn=collate_fn)
+    else:
+        train_data_loader = DataLoader(train_dataset, batch_size=batch_size,
+                                       sampler=train_sampler, collate_fn=collate_fn)
+    # Each rank evaluates its own part of the validation samples
+    valid_sampler = (DistributedSampler(valid_dataset, shuffle=False)
+                     if distributed and valid_dataset is not None else None)
     valid_data_loader = (DataLoader(valid_dataset, batch_size=batch_size,
-                                    collate_fn=collate_fn)
+                                    sampler=valid_sampler, collate_fn=collate_fn)
                          if valid_dataset is not None else None)
     return train_data_loader, valid_data_loader
@@ -0,0 +1,82 @@
+"""
+Size-bucketed batching of graphs.
+
+The dense collate function pads every graph of a batch to the largest one,
+thus batches which mix small and large graphs waste most of the computation.
+The BucketBatchSampler groups graphs of similar node and edge counts into
+the same batches.
+"""
+
+# Externals
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+class BucketBatchSampler(Sampler):
+    """
+    Batch sampler which groups the indices of a wrapped sampler by size.
+
+    The graphs are assigned to n_buckets node count bins times n_buckets edge
+    count bins (quantiles of the dataset). Each epoch, the indices drawn from
+    the wrapped sampler (a RandomSampler, or a DistributedSampler for this
+    rank) are stably sorted by bucket, so they stay shuffled within each
+    bucket, cut into batches, and the order of the batches is shuffled.
+    Every index of the wrapped sampler is used exactly once per epoch, and
+    the number of batches only depends on its length, thus it is the same
+    on all ranks.
+    """
+
+    def __init__(self, sampler, n_nodes, n_edges, batch_size,
+                 n_buckets=8, drop_last=False, seed=0):
+        self.sampler = sampler
+        self.n_nodes = np.asarray(n_nodes, dtype=np.int64)
+        self.n_edges = np.asarray(n_edges, dtype=np.int64)
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.buckets = (self._bins(self.n_nodes, n_buckets) * n_buckets +
+                        self._bins(self.n_edges, n_buckets))
+        # Real and padded Ri/Ro elements of the last epoch on this rank
+        self.padding_sums = None
+
+    @staticmethod
+    def _bins(sizes, n_bins):
+        """Quantile bin of each size"""
+        if len(sizes) == 0:
+            return sizes
+        edges = np.quantile(sizes, np.linspace(0, 1, n_bins + 1)[1:-1])
+        return np.searchsorted(edges, sizes, side='right')
+
+    def set_epoch(self, epoch):
+        """Set the epoch of the shuffling, forwarded to the wrapped sampler"""
+        self.epoch = epoch
+        if hasattr(self.sampler, 'set_epoch'):
+            self.sampler.set_epoch(epoch)
+
+    def __iter__(self):
+        indices = np.fromiter(iter(self.sampler), dtype=np.int64)
+        indices = indices[np.argsort(self.buckets[indices], kind='stable')]
+        n_batches = len(self)
+        batches = [indices[i*self.batch_size:(i+1)*self.batch_size]
+                   for i in range(n_batches)]
+
+        # Same permutation on all ranks
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        order = torch.randperm(n_batches, generator=generator).tolist()
+        batches = [batches[i] for i in order]
+
+        real, padded = 0, 0
+        for b in batches:
+            real += np.sum(self.n_nodes[b] * self.n_edges[b])
+            padded += len(b) * self.n_nodes[b].max() * self.n_edges[b].max()
+        self.padding_sums = (float(real), float(padded))
+
+        for b in batches:
+            yield b.tolist()
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.sampler) // self.batch_size
+        return (len(self.sampler) + self.batch_size - 1) // self.batch_size
@@ -1,8 +1,15 @@
 """
 This module contains code for interacting with hit graphs.
 A Graph is a namedtuple of matrices X, Ri, Ro, y.
+
+Graphs are stored either one per NPZ file (save_graph), or packed into
+graph archive shards (save_graph_archive): a directory in which the
+graphs share concatenated X / Ri / Ro / y arrays, plus tables with the
+node and edge offsets of each graph. The arrays of a shard are
+memory-mapped by GraphArchive, thus reading a graph only slices them.
 """
 
+import os
 from collections import namedtuple
 
 import numpy as np
@@ -11,6 +18,10 @@ import pandas as pd
 # A Graph is a namedtuple of matrices (X, Ri, Ro, y)
 Graph = namedtuple('Graph', ['X', 'Ri', 'Ro', 'y'])
 
+# A SparseGraph has the same fields, but Ri and Ro are vectors of node indices:
+# edge k goes from node Ro[k] to node Ri[k]
+SparseGraph = namedtuple('SparseGraph', ['X', 'Ri', 'Ro', 'y'])
+
 def graph_to_sparse(graph):
     Ri_rows, Ri_cols = graph.Ri.nonzero()
     Ro_rows, Ro_cols = graph.Ro.nonzero()
@@ -26,6 +37,15 @@ def sparse_to_graph(X, Ri_rows, Ri_cols, Ro_rows, Ro_cols, y, dtype=np.uint8):
     Ro[Ro_rows, Ro_cols] = 1
     return Graph(X, Ri, Ro, y)
 
+def sparse_to_edge_index(X, Ri_rows, Ri_cols, Ro_rows, Ro_cols, y):
+    """Convert the stored sparse matrices into a SparseGraph with edge index vectors"""
+    n_edges = Ri_rows.shape[0]
+    Ri = np.zeros(n_edges, dtype=np.int64)
+    Ro = np.zeros(n_edges, dtype=np.int64)
+    Ri[Ri_cols] = Ri_rows
+    Ro[Ro_cols] = Ro_rows
+    return SparseGraph(X, Ri, Ro, y)
+
 def save_graph(graph, filename):
     """Write a single graph to an NPZ file archive"""
     np.savez(filename, **graph_to_sparse(graph))
@@ -39,5 +59,77 @@ def load_graph(filename):
     with np.load(filename) as f:
         return sparse_to_graph(**dict(f.items()))
 
+def load_sparse_graph(filename):
+    """Read a single graph NPZ as SparseGraph, without the dense matrices"""
+    with np.load(filename) as f:
+        return sparse_to_edge_index(**dict(f.items()))
+
 def load_graphs(filenames, graph_type=Graph):
     return [load_graph(f, graph_type) for f in filenames]
+
+def edge_index_to_graph(graph, dtype=np.uint8):
+    """Convert a SparseGraph into a Graph with dense matrices"""
+    n_nodes, n_edges = graph.X.shape[0], graph.Ri.shape[0]
+    Ri = np.zeros((n_nodes, n_edges), dtype=dtype)
+    Ro = np.zeros((n_nodes, n_edges), dtype=dtype)
+    Ri[graph.Ri, np.arange(n_edges)] = 1
+    Ro[graph.Ro, np.arange(n_edges)] = 1
+    return Graph(np.array(graph.X), Ri, Ro, np.array(graph.y))
+
+def graph_to_edge_index(graph):
+    """Convert a Graph (or SparseGraph) into a SparseGraph"""
+    if graph.Ri.ndim == 1:
+        return graph
+    Ri_rows, Ri_cols = graph.Ri.nonzero()
+    Ro_rows, Ro_cols = graph.Ro.nonzero()
+    return sparse_to_edge_index(graph.X, Ri_rows, Ri_cols, Ro_rows, Ro_cols, graph.y)
+
+# The arrays of a graph archive shard, the offsets are written last
+archive_arrays = ['X', 'Ri', 'Ro', 'y', 'node_offsets', 'edge_offsets']
+
+def save_graph_archive(graphs, dirname):
+    """Write many graphs (Graph or SparseGraph) into one graph archive shard"""
+    graphs = [graph_to_edge_index(g) for g in graphs]
+    n_nodes = np.array([g.X.shape[0] for g in graphs], dtype=np.int64)
+    n_edges = np.array([g.Ri.shape[0] for g in graphs], dtype=np.int64)
+    node_offsets = np.zeros(len(graphs) + 1, dtype=np.int64)
+    edge_offsets = np.zeros(len(graphs) + 1, dtype=np.int64)
+    np.cumsum(n_nodes, out=node_offsets[1:])
+    np.cumsum(n_edges, out=edge_offsets[1:])
+    arrays = dict(
+        X=np.concatenate([g.X for g in graphs]).astype(np.float32),
+        Ri=np.concatenate([g.Ri for g in graphs]).astype(np.int64),
+        Ro=np.concatenate([g.Ro for g in graphs]).astype(np.int64),
+        y=np.concatenate([g.y for g in graphs]).astype(np.float32),
+        node_offsets=node_offsets, edge_offsets=edge_offsets)
+    os.makedirs(dirname, exist_ok=True)
+    # Remove the offsets first, this way an interrupted write is never a valid shard
+    for name in ['node_offsets', 'edge_offsets']:
+        if os.path.exists(os.path.join(dirname, name + '.npy')):
+            os.remove(os.path.join(dirname, name + '.npy'))
+    for name in archive_arrays:
+        np.save(os.path.join(dirname, name + '.npy'), arrays[name])
+
+def is_graph_archive(dirname):
+    """Check if the directory is a complete graph archive shard"""
+    return all(os.path.exists(os.path.join(dirname, name + '.npy'))
+               for name in archive_arrays)
+
+class GraphArchive(object):
+    """Memory-mapped random access to the graphs of a graph archive shard"""
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        for name in archive_arrays:
+            setattr(self, name, np.load(os.path.join(dirname, name + '.npy'),
+                                        mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.node_offsets) - 1
+
+    def __getitem__(self, index):
+        """Return the graph as SparseGraph, its arrays are views into the shard"""
+        n0, n1 = self.node_offsets[index], self.node_offsets[index+1]
+        e0, e1 = self.edge_offsets[index], self.edge_offsets[index+1]
+        return SparseGraph(self.X[n0:n1], self.Ri[e0:e1], self.Ro[e0:e1],
+                           self.y[e0:e1])
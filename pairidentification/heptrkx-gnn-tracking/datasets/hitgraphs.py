@@ -7,35 +7,82 @@ import os
 import logging
 
 # External imports
+import numpy as np
 import torch
-from torch.utils.data import Dataset, random_split
+from torch.utils.data import Dataset, Subset, random_split
 
 # Local imports
-from datasets.graph import load_graph
+from datasets.graph import (load_graph, load_sparse_graph, edge_index_to_graph,
+                            is_graph_archive, GraphArchive)
 
 class HitGraphDataset(Dataset):
-    """PyTorch dataset specification for hit graphs"""
+    """
+    PyTorch dataset specification for hit graphs.
+    The input directory contains either one event*.npz file per graph,
+    or graph archive shards (sub-directories, see datasets.graph),
+    which are memory-mapped and used instead of the NPZ files.
+    """
 
-    def __init__(self, input_dir, n_samples):
+    def __init__(self, input_dir, n_samples, sparse=False):
+        self.sparse = sparse
+        shards = sorted(os.path.join(input_dir, f) for f in os.listdir(input_dir)
+                        if is_graph_archive(os.path.join(input_dir, f)))
+        self.archives = [GraphArchive(d) for d in shards]
+        if len(self.archives) > 0:
+            # Index of the first graph of each shard
+            self.archive_offsets = np.cumsum([0] + [len(a) for a in self.archives])
+            self.n_graphs = min(n_samples, int(self.archive_offsets[-1]))
+            self.filenames = []
+            return
         filenames = [os.path.join(input_dir, f) for f in os.listdir(input_dir)
                      if f.startswith('event') and f.endswith('.npz')]
         self.filenames = filenames[:n_samples]
+        self.n_graphs = len(self.filenames)
         #self.filenames = [os.path.join(input_dir, 'graph%06i.npz' % i)
         #                  for i in range(n_samples)]
 
     def __getitem__(self, index):
+        if len(self.archives) > 0:
+            if index < 0 or index >= self.n_graphs:
+                raise IndexError('graph index %i out of range' % index)
+            i = np.searchsorted(self.archive_offsets, index, side='right') - 1
+            graph = self.archives[i][index - self.archive_offsets[i]]
+            return graph if self.sparse else edge_index_to_graph(graph)
+        if self.sparse:
+            return load_sparse_graph(self.filenames[index])
         return load_graph(self.filenames[index])
 
     def __len__(self):
-        return len(self.filenames)
+        return self.n_graphs
 
-def get_datasets(input_dir, n_train, n_valid):
-    data = HitGraphDataset(input_dir, n_train + n_valid)
+    def get_graph_sizes(self):
+        """Return the number of nodes and edges of each graph"""
+        if len(self.archives) > 0:
+            n_nodes = np.concatenate([np.diff(a.node_offsets) for a in self.archives])
+            n_edges = np.concatenate([np.diff(a.edge_offsets) for a in self.archives])
+            return n_nodes[:self.n_graphs], n_edges[:self.n_graphs]
+        n_nodes = np.zeros(self.n_graphs, dtype=np.int64)
+        n_edges = np.zeros(self.n_graphs, dtype=np.int64)
+        for i, filename in enumerate(self.filenames):
+            # Only the node features and targets are read from the NPZ
+            with np.load(filename) as f:
+                n_nodes[i], n_edges[i] = f['X'].shape[0], f['y'].shape[0]
+        return n_nodes, n_edges
+
+def get_datasets(input_dir, n_train, n_valid, sparse=False):
+    data = HitGraphDataset(input_dir, n_train + n_valid, sparse=sparse)
     logging.info('total %i train %i valid %i', len(data), n_train, n_valid)
     # Split into train and validation
     train_data, valid_data = random_split(data, [n_train, n_valid])
     return train_data, valid_data
 
+def get_graph_sizes(dataset):
+    """Return the number of nodes and edges of each graph of a (split) dataset"""
+    if isinstance(dataset, Subset):
+        n_nodes, n_edges = get_graph_sizes(dataset.dataset)
+        return n_nodes[dataset.indices], n_edges[dataset.indices]
+    return dataset.get_graph_sizes()
+
 def collate_fn(graphs):
     """
     Collate function for building mini-batches from a list of hit-graphs.
@@ -82,3 +129,25 @@ def collate_fn(graphs):
     return batch_inputs, batch_target
     #return (torch.from_numpy(batch_X), torch.from_numpy(batch_Ri),
     #        torch.from_numpy(batch_Ro), torch.from_numpy(batch_y))
+
+def collate_sparse_fn(graphs):
+    """
+    Collate function for building mini-batches from a list of SparseGraphs
+    (HitGraphDataset with sparse=True), without any padding.
+    The graphs are combined into one graph which contains all of them:
+    the node features and targets are concatenated, and the edge index
+    vectors Ri and Ro are shifted by the node offset of each graph.
+    The model then returns one output per edge of all graphs, in the
+    same order as the concatenated targets.
+    """
+    n_nodes = np.array([g.X.shape[0] for g in graphs])
+    node_offsets = np.cumsum(n_nodes) - n_nodes
+
+    batch_X = np.concatenate([g.X for g in graphs]).astype(np.float32)
+    batch_Ri = np.concatenate([g.Ri + o for g, o in zip(graphs, node_offsets)]).astype(np.int64)
+    batch_Ro = np.concatenate([g.Ro + o for g, o in zip(graphs, node_offsets)]).astype(np.int64)
+    batch_y = np.concatenate([g.y for g in graphs]).astype(np.float32)
+
+    batch_inputs = [torch.from_numpy(bm) for bm in [batch_X, batch_Ri, batch_Ro]]
+    batch_target = torch.from_numpy(batch_y)
+    return batch_inputs, batch_target
@@ -1,6 +1,14 @@
 """
 This module implements the PyTorch modules that define the
 message-passing graph neural networks for hit or segment classification.
+
+The graphs are given either as dense padded batches (X of shape
+[batch, nodes, features] and incidence matrices Ri, Ro of shape
+[batch, nodes, edges], see datasets.hitgraphs.collate_fn), or as one
+concatenated sparse graph (X of shape [nodes, features] and edge index
+vectors Ri, Ro of shape [edges], see datasets.hitgraphs.collate_sparse_fn).
+The sparse form gathers and scatters per edge instead of multiplying
+with the mostly zero incidence matrices.
 """
 
 import torch
@@ -22,9 +30,13 @@ class EdgeNetwork(nn.Module):
             nn.Sigmoid())
     def forward(self, X, Ri, Ro):
         # Select the features of the associated nodes
-        bo = torch.bmm(Ro.transpose(1, 2), X)
-        bi = torch.bmm(Ri.transpose(1, 2), X)
-        B = torch.cat([bo, bi], dim=2)
+        if Ri.dim() == 1:
+            bo = X[Ro]
+            bi = X[Ri]
+        else:
+            bo = torch.bmm(Ro.transpose(1, 2), X)
+            bi = torch.bmm(Ri.transpose(1, 2), X)
+        B = torch.cat([bo, bi], dim=-1)
         # Apply the network to each edge
         return self.network(B).squeeze(-1)
 
@@ -44,6 +56,8 @@ class NodeNetwork(nn.Module):
             nn.Linear(output_dim, output_dim),
             hidden_activation())
     def forward(self, X, e, Ri, Ro):
+        if Ri.dim() == 1:
+            return self.network(self.aggregate_sparse(X, e, Ri, Ro))
         bo = torch.bmm(Ro.transpose(1, 2), X)
         bi = torch.bmm(Ri.transpose(1, 2), X)
         Rwo = Ro * e[:,None]
@@ -53,6 +67,14 @@ class NodeNetwork(nn.Module):
         M = torch.cat([mi, mo, X], dim=2)
         return self.network(M)
 
+    def aggregate_sparse(self, X, e, Ri, Ro):
+        """Sum the weighted neighbor features per node with edge index vectors"""
+        bo = X[Ro]
+        bi = X[Ri]
+        mi = torch.zeros_like(X).index_add_(0, Ri, e[:,None] * bo)
+        mo = torch.zeros_like(X).index_add_(0, Ro, e[:,None] * bi)
+        return torch.cat([mi, mo, X], dim=-1)
+
 class GNNSegmentClassifier(nn.Module):
     """
     Segment classification graph neural network model.
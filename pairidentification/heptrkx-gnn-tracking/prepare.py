@@ -18,7 +18,7 @@ import pandas as pd
 import trackml.dataset
 
 # Locals
-from datasets.graph import Graph, save_graphs
+from datasets.graph import Graph, SparseGraph, save_graphs, save_graph_archive
 
 def parse_args():
     """Parse command line arguments."""
@@ -28,6 +28,8 @@ def parse_args():
     add_arg('--n-workers', type=int, default=1)
     add_arg('--task', type=int, default=0)
     add_arg('--n-tasks', type=int, default=1)
+    add_arg('--archive-shard-size', type=int, default=0,
+            help='Number of events per graph archive shard (0: one npz per graph)')
     add_arg('-v', '--verbose', action='store_true')
     add_arg('--show-config', action='store_true')
     add_arg('--interactive', action='store_true')
@@ -50,27 +52,87 @@ def select_segments(hits1, hits2, phi_slope_max, z0_max):
     between hits1 and hits2, filtered with the specified
     phi slope and z0 criteria.
 
+    Instead of all hit pairs of an event, only the pairs within the
+    phi window which can pass the phi slope cut are formed: the hits2
+    are sorted by phi, and the window of each hit1 is found by binary search.
+
     Returns: pd DataFrame of (index_1, index_2), corresponding to the
     DataFrame hit label-indices in hits1 and hits2, respectively.
+    The segments are ordered by the position of the hit in hits1, then hits2.
+    """
+    evtid1, evtid2 = hits1.evtid.values, hits2.evtid.values
+    segments_1, segments_2 = [], []
+    for evtid in np.intersect1d(evtid1, evtid2):
+        idx1 = np.flatnonzero(evtid1 == evtid)
+        idx2 = np.flatnonzero(evtid2 == evtid)
+        pairs_1, pairs_2 = find_segment_candidates(
+            hits1.phi.values[idx1], hits1.r.values[idx1],
+            hits2.phi.values[idx2], hits2.r.values[idx2], phi_slope_max)
+        pairs_1, pairs_2 = idx1[pairs_1], idx2[pairs_2]
+        good_seg_mask = segment_cuts(
+            hits1.r.values[pairs_1], hits1.phi.values[pairs_1], hits1.z.values[pairs_1],
+            hits2.r.values[pairs_2], hits2.phi.values[pairs_2], hits2.z.values[pairs_2],
+            phi_slope_max, z0_max)
+        segments_1.append(pairs_1[good_seg_mask])
+        segments_2.append(pairs_2[good_seg_mask])
+    if len(segments_1) > 0:
+        segments_1 = np.concatenate(segments_1)
+        segments_2 = np.concatenate(segments_2)
+    else:
+        segments_1 = segments_2 = np.zeros(0, dtype=np.int64)
+    order = np.lexsort((segments_2, segments_1))
+    return pd.DataFrame(dict(index_1=hits1.index.values[segments_1[order]],
+                             index_2=hits2.index.values[segments_2[order]]))
+
+def find_segment_candidates(phi1, r1, phi2, r2, phi_slope_max):
+    """
+    Return all pairs of positions (i1, i2) with |dphi| small enough to
+    possibly pass the phi slope cut, i.e. |dphi| <= phi_slope_max * max|dr|.
+    The phi values of the second hits are repeated shifted by -2pi and +2pi,
+    thus windows crossing the phi boundary are found, as in calc_dphi.
     """
-    # Start with all possible pairs of hits
-    keys = ['evtid', 'r', 'phi', 'z']
-    hit_pairs = hits1[keys].reset_index().merge(
-        hits2[keys].reset_index(), on='evtid', suffixes=('_1', '_2'))
+    n1, n2 = len(phi1), len(phi2)
+    if n1 == 0 or n2 == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    dr_max = max(abs(r2.max() - r1.min()), abs(r1.max() - r2.min()))
+    # Slightly wider than required, the exact cut is applied afterwards
+    window = phi_slope_max * dr_max * (1 + 1e-6) + 1e-9
+    if not window < np.pi:
+        # Every pair can pass
+        return np.repeat(np.arange(n1), n2), np.tile(np.arange(n2), n1)
+
+    order2 = np.argsort(phi2, kind='stable')
+    phi2_ext = np.concatenate([phi2[order2] - 2*np.pi, phi2[order2],
+                               phi2[order2] + 2*np.pi])
+    begin = np.searchsorted(phi2_ext, phi1 - window, side='left')
+    end = np.searchsorted(phi2_ext, phi1 + window, side='right')
+
+    # With window < pi, each hit2 is at most once in the window of a hit1
+    counts = end - begin
+    pairs_1 = np.repeat(np.arange(n1), counts)
+    pairs_ext = (np.arange(counts.sum()) -
+                 np.repeat(np.cumsum(counts) - counts, counts) +
+                 np.repeat(begin, counts))
+    return pairs_1, order2[pairs_ext % n2]
+
+def segment_cuts(r1, phi1, z1, r2, phi2, z2, phi_slope_max, z0_max):
+    """Apply the phi slope and z0 criteria to hit pairs, returns the mask"""
     # Compute line through the points
-    dphi = calc_dphi(hit_pairs.phi_1, hit_pairs.phi_2)
-    dz = hit_pairs.z_2 - hit_pairs.z_1
-    dr = hit_pairs.r_2 - hit_pairs.r_1
-    phi_slope = dphi / dr
-    z0 = hit_pairs.z_1 - hit_pairs.r_1 * dz / dr
-    # Filter segments according to criteria
-    good_seg_mask = (phi_slope.abs() < phi_slope_max) & (z0.abs() < z0_max)
-    return hit_pairs[['index_1', 'index_2']][good_seg_mask]
+    dphi = calc_dphi(phi1, phi2)
+    dz = z2 - z1
+    dr = r2 - r1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        phi_slope = dphi / dr
+        z0 = z1 - r1 * dz / dr
+    return (np.abs(phi_slope) < phi_slope_max) & (np.abs(z0) < z0_max)
 
 def construct_graph(hits, layer_pairs,
                     phi_slope_max, z0_max,
-                    feature_names, feature_scale):
-    """Construct one graph (e.g. from one event)"""
+                    feature_names, feature_scale, sparse=False):
+    """
+    Construct one graph (e.g. from one event).
+    If sparse, a SparseGraph is returned, without the dense matrices.
+    """
 
     # Loop over layer pairs and construct segments
     layer_groups = hits.groupby('layer')
@@ -94,8 +156,6 @@ def construct_graph(hits, layer_pairs,
     n_hits = hits.shape[0]
     n_edges = segments.shape[0]
     X = (hits[feature_names].values / feature_scale).astype(np.float32)
-    Ri = np.zeros((n_hits, n_edges), dtype=np.uint8)
-    Ro = np.zeros((n_hits, n_edges), dtype=np.uint8)
     y = np.zeros(n_edges, dtype=np.float32)
 
     # We have the segments' hits given by dataframe label,
@@ -105,15 +165,20 @@ def construct_graph(hits, layer_pairs,
     seg_start = hit_idx.loc[segments.index_1].values
     seg_end = hit_idx.loc[segments.index_2].values
 
+    # Fill the segment labels
+    pid1 = hits.particle_id.loc[segments.index_1].values
+    pid2 = hits.particle_id.loc[segments.index_2].values
+    y[:] = (pid1 == pid2)
+    if sparse:
+        return SparseGraph(X, seg_end.astype(np.int64), seg_start.astype(np.int64), y)
+
     # Now we can fill the association matrices.
     # Note that Ri maps hits onto their incoming edges,
     # which are actually segment endings.
+    Ri = np.zeros((n_hits, n_edges), dtype=np.uint8)
+    Ro = np.zeros((n_hits, n_edges), dtype=np.uint8)
     Ri[seg_end, np.arange(n_edges)] = 1
     Ro[seg_start, np.arange(n_edges)] = 1
-    # Fill the segment labels
-    pid1 = hits.particle_id.loc[segments.index_1].values
-    pid2 = hits.particle_id.loc[segments.index_2].values
-    y[:] = (pid1 == pid2)
     # Return a tuple of the results
     return Graph(X, Ri, Ro, y)
 
@@ -168,6 +233,10 @@ def split_detector_sections(hits, phi_edges, eta_edges):
 
 def process_event(prefix, output_dir, pt_min, n_eta_sections, n_phi_sections,
                   eta_range, phi_range, phi_slope_max, z0_max):
+    """
+    Construct the graphs of one event and write them to the output directory.
+    Without output directory, the graphs are returned as SparseGraphs instead.
+    """
     # Load the data
     evtid = int(prefix[-9:])
     logging.info('Event %i, loading data' % evtid)
@@ -198,8 +267,11 @@ def process_event(prefix, output_dir, pt_min, n_eta_sections, n_phi_sections,
     graphs = [construct_graph(section_hits, layer_pairs=layer_pairs,
                               phi_slope_max=phi_slope_max, z0_max=z0_max,
                               feature_names=feature_names,
-                              feature_scale=feature_scale)
+                              feature_scale=feature_scale,
+                              sparse=(output_dir is None))
               for section_hits in hits_sections]
+    if output_dir is None:
+        return graphs
 
     # Write these graphs to the output directory
     try:
@@ -253,9 +325,23 @@ def main():
 
     # Process input files with a worker pool
     with mp.Pool(processes=args.n_workers) as pool:
-        process_func = partial(process_event, output_dir=output_dir,
-                               phi_range=(-np.pi, np.pi), **config['selection'])
-        pool.map(process_func, file_prefixes)
+        if args.archive_shard_size > 0:
+            # Collect the graphs of archive_shard_size events per shard
+            process_func = partial(process_event, output_dir=None,
+                                   phi_range=(-np.pi, np.pi), **config['selection'])
+            n_shards = (len(file_prefixes) + args.archive_shard_size - 1) // args.archive_shard_size
+            for i in range(n_shards):
+                shard_prefixes = file_prefixes[i*args.archive_shard_size:
+                                               (i+1)*args.archive_shard_size]
+                graphs = [g for event_graphs in pool.map(process_func, shard_prefixes)
+                          for g in event_graphs]
+                shard_dir = os.path.join(output_dir, 'shard_t%03i_%05i' % (args.task, i))
+                logging.info('Writing %i graphs to %s' % (len(graphs), shard_dir))
+                save_graph_archive(graphs, shard_dir)
+        else:
+            process_func = partial(process_event, output_dir=output_dir,
+                                   phi_range=(-np.pi, np.pi), **config['selection'])
+            pool.map(process_func, file_prefixes)
 
     # Drop to IPython interactive shell
     if args.interactive:
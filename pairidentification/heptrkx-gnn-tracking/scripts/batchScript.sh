@@ -4,4 +4,4 @@
 #SBATCH -t 30
 
 . setup.sh
-srun -l python ./train.py -d $@
+srun -l python ./train.py -d --backend mpi $@
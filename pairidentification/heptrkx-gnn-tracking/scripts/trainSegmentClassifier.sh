@@ -4,4 +4,4 @@
 #SBATCH -t 30
 
 . scripts/setup.sh
-srun -l python ./train.py -d configs/segclf.yaml
+srun -l python ./train.py -d --backend mpi configs/segclf.yaml
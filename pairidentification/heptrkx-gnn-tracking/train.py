@@ -3,13 +3,17 @@ Main training script for NERSC PyTorch examples
 """
 
 # System
+import os
+import socket
 import argparse
 import logging
 
 # Externals
 import yaml
 import numpy as np
+import torch
 import torch.distributed as dist
+import torch.multiprocessing as mp
 from torch.utils.data import DataLoader
 from torch.utils.data.distributed import DistributedSampler
 
@@ -23,17 +27,51 @@ def parse_args():
     add_arg = parser.add_argument
     add_arg('config', nargs='?', default='configs/segclf.yaml')
     add_arg('-d', '--distributed', action='store_true')
+    add_arg('--backend', default='gloo', choices=['gloo', 'mpi'],
+            help='Backend of the distributed training')
+    add_arg('--n-procs', type=int, default=1,
+            help='Number of local training processes (implies -d with gloo)')
     add_arg('-v', '--verbose', action='store_true')
     add_arg('--device', default='cpu')
+    add_arg('--resume', action='store_true',
+            help='Resume from the last checkpoint in the output directory')
     add_arg('--show-config', action='store_true')
     add_arg('--interactive', action='store_true')
     return parser.parse_args()
 
-def main():
+def init_distributed(backend, rank=None, world_size=None):
+    """
+    Initialize the process group. The local launcher passes rank and
+    world size, otherwise they are taken from the environment (MASTER_ADDR,
+    MASTER_PORT, RANK, WORLD_SIZE, or SLURM_PROCID, SLURM_NTASKS with srun).
+    """
+    if backend == 'mpi':
+        dist.init_process_group(backend='mpi')
+        return
+    if rank is None:
+        rank = int(os.environ.get('RANK', os.environ.get('SLURM_PROCID', 0)))
+        world_size = int(os.environ.get('WORLD_SIZE', os.environ.get('SLURM_NTASKS', 1)))
+    dist.init_process_group(backend=backend, init_method='env://',
+                            rank=rank, world_size=world_size)
+
+def find_free_port():
+    """Return an unused local TCP port for the process group rendezvous"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def launch(args):
+    """Run main in args.n_procs local processes, one rank each"""
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ.setdefault('MASTER_PORT', str(find_free_port()))
+    mp.spawn(main, args=(args,), nprocs=args.n_procs, join=True)
+
+def main(rank=None, args=None):
     """Main function"""
 
     # Parse the command line
-    args = parse_args()
+    if args is None:
+        args = parse_args()
 
     # Setup logging
     log_format = '%(asctime)s %(levelname)s %(message)s'
@@ -43,14 +81,20 @@ def main():
     if args.show_config:
         logging.info('Command line config: %s' % args)
 
-    # Initialize MPI
+    # Initialize the process group
+    if rank is not None:
+        # Share the cores of the node between the local processes
+        if 'OMP_NUM_THREADS' not in os.environ:
+            torch.set_num_threads(max(1, os.cpu_count() // args.n_procs))
+        init_distributed('gloo', rank, args.n_procs)
+    elif args.distributed:
+        init_distributed(args.backend)
     if args.distributed:
-        dist.init_process_group(backend='mpi')
-        logging.info('MPI rank %i out of %i', dist.get_rank(), dist.get_world_size())
+        logging.info('Rank %i out of %i', dist.get_rank(), dist.get_world_size())
 
     # Load configuration
     with open(args.config) as f:
-        config = yaml.load(f)
+        config = yaml.load(f, Loader=yaml.SafeLoader)
     if not args.distributed or (dist.get_rank() == 0):
         logging.info('Configuration: %s' % config)
     data_config = config['data_config']
@@ -71,12 +115,19 @@ def main():
     # Load the trainer
     experiment_config = config['experiment_config']
     output_dir = experiment_config.pop('output_dir', None)
+    # All ranks load the checkpoint, only rank 0 writes them
+    checkpoint_file = None
+    if args.resume and output_dir is not None:
+        from trainers.base_trainer import BaseTrainer
+        checkpoint_file = BaseTrainer.find_last_checkpoint(output_dir)
     if args.distributed and dist.get_rank() != 0:
         output_dir = None
     trainer = get_trainer(distributed=args.distributed, output_dir=output_dir,
                           device=args.device, **experiment_config)
     # Build the model
     trainer.build_model(**model_config)
+    if checkpoint_file is not None:
+        trainer.load_checkpoint(checkpoint_file)
     if not args.distributed or (dist.get_rank() == 0):
         trainer.print_model_summary()
     print('model')
@@ -92,7 +143,7 @@ def main():
     print(summary)
 
     # Print some conclusions
-    n_train_samples = len(train_data_loader.sampler)
+    n_train_samples = len(train_data_loader.batch_sampler.sampler)
     logging.info('Finished training')
     train_time = np.mean(summary['train_time'])
     logging.info('Train samples %g time %gs rate %g samples/s',
@@ -109,7 +160,14 @@ def main():
         import IPython
         IPython.embed()
 
+    if args.distributed:
+        dist.destroy_process_group()
     logging.info('All done!')
 
 if __name__ == '__main__':
-    main()
+    args = parse_args()
+    if args.n_procs > 1:
+        args.distributed = True
+        launch(args)
+    else:
+        main(args=args)
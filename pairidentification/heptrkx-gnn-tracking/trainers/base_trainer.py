@@ -4,26 +4,59 @@ Common PyTorch trainer code.
 
 # System
 import os
+import json
+import time
+import glob
+import inspect
 import logging
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 # Externals
 import numpy as np
 import torch
+import torch.distributed as dist
 
 class BaseTrainer(object):
     """
     Base class for PyTorch trainers.
     This implements the common training logic,
     logging of summaries, and checkpoints.
+
+    The trainers accumulate the wall-clock time of the training phases
+    (data, copy, forward, backward, optimizer) with timed/timed_batches.
+    With profile_steps > 0, a torch.profiler trace of the first
+    profile_steps training steps is written to the output directory.
+
+    Checkpoints are written by a background thread from a copy of the
+    model and optimizer state, thus training continues meanwhile. With
+    keep_last or keep_best > 0, only the last keep_last checkpoints and the
+    keep_best ones with the best best_metric (lowest, or highest with
+    best_mode='max') are kept; the latest checkpoint is always kept.
     """
 
-    def __init__(self, output_dir=None, device='cpu', distributed=False):
+    def __init__(self, output_dir=None, device='cpu', distributed=False,
+                 profile_steps=0, keep_last=0, keep_best=0,
+                 best_metric='valid_loss', best_mode='min'):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.output_dir = (os.path.expandvars(output_dir)
                            if output_dir is not None else None)
         self.device = device
         self.distributed = distributed
         self.summaries = {}
+        self.phase_times = {}
+        self.profile_steps = profile_steps
+        self.profiler = None
+        self.profiled_steps = 0
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.best_metric = best_metric
+        self.best_mode = best_mode
+        self.start_epoch = 0
+        # The epochs of the kept checkpoints, and the background writer
+        self.checkpoint_epochs = []
+        self.checkpoint_writer = ThreadPoolExecutor(max_workers=1)
+        self.checkpoint_future = None
 
     def print_model_summary(self):
         """Override as needed"""
@@ -45,14 +78,167 @@ class BaseTrainer(object):
         self.logger.info('Saving summaries to %s' % summary_file)
         np.savez(summary_file, **self.summaries)
 
+    def write_summary_log(self, summary):
+        """Append the summary of one epoch to the JSON log (one line per epoch)"""
+        assert self.output_dir is not None
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, 'summaries.jsonl'), 'a') as f:
+            f.write(json.dumps(summary, default=float) + '\n')
+
+    def synchronize(self):
+        """Wait for the device, thus the phase times include its work"""
+        if str(self.device).startswith('cuda'):
+            torch.cuda.synchronize()
+
+    @contextmanager
+    def timed(self, phase):
+        """Accumulate the wall-clock time of a phase in phase_times"""
+        self.synchronize()
+        start_time = time.time()
+        with torch.profiler.record_function(phase):
+            yield
+        self.synchronize()
+        self.phase_times[phase] = (self.phase_times.get(phase, 0.) +
+                                   time.time() - start_time)
+
+    def timed_batches(self, data_loader):
+        """Iterate over the data loader, the waiting time is the 'data' phase"""
+        batches = iter(data_loader)
+        while True:
+            with self.timed('data'):
+                batch = next(batches, None)
+            if batch is None:
+                return
+            yield batch
+
+    def start_profiler(self):
+        """Start the torch.profiler trace of the first profile_steps steps"""
+        if self.profile_steps <= 0 or self.output_dir is None:
+            return
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if str(self.device).startswith('cuda'):
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.profiler = torch.profiler.profile(activities=activities)
+        self.profiler.start()
+        self.profiled_steps = 0
+
+    def profile_step(self):
+        """Called after each training step, stops the profiler after profile_steps"""
+        if self.profiler is None:
+            return
+        self.profiled_steps += 1
+        if self.profiled_steps >= self.profile_steps:
+            self.stop_profiler()
+
+    def stop_profiler(self):
+        """Stop the profiler and write the trace"""
+        if self.profiler is None:
+            return
+        self.profiler.stop()
+        trace_file = os.path.join(self.output_dir, 'profile_trace.json')
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.profiler.export_chrome_trace(trace_file)
+        self.logger.info('Wrote profile of %i steps to %s' %
+                         (self.profiled_steps, trace_file))
+        self.profiler = None
+
+    @staticmethod
+    def get_checkpoint_file(checkpoint_dir, checkpoint_id):
+        return os.path.join(checkpoint_dir,
+                            'model_checkpoint_%03i.pth.tar' % checkpoint_id)
+
+    @staticmethod
+    def find_last_checkpoint(output_dir):
+        """Return the checkpoint file of the last epoch in output_dir, or None"""
+        files = glob.glob(os.path.join(os.path.expandvars(output_dir), 'checkpoints',
+                                       'model_checkpoint_*.pth.tar'))
+        return max(files, key=lambda f: int(f.split('_')[-1].split('.')[0]),
+                   default=None)
+
     def write_checkpoint(self, checkpoint_id):
-        """Write a checkpoint for the model"""
+        """
+        Write a checkpoint for the model, optimizer and summaries in the
+        background. It waits for the previous checkpoint to be written.
+        """
         assert self.output_dir is not None
         checkpoint_dir = os.path.join(self.output_dir, 'checkpoints')
-        checkpoint_file = 'model_checkpoint_%03i.pth.tar' % checkpoint_id
         os.makedirs(checkpoint_dir, exist_ok=True)
-        torch.save(dict(model=self.model.state_dict()),
-                   os.path.join(checkpoint_dir, checkpoint_file))
+        # Without the DistributedDataParallel wrapper
+        model = getattr(self.model, 'module', self.model)
+        checkpoint = dict(model=model.state_dict(), epoch=checkpoint_id,
+                          summaries=self.summaries,
+                          rng_state=torch.get_rng_state())
+        if hasattr(self, 'optimizer'):
+            checkpoint['optimizer'] = self.optimizer.state_dict()
+        # Copy all tensors, training modifies the parameters in place
+        checkpoint = copy_state(checkpoint)
+        self.wait_for_checkpoint()
+        self.checkpoint_epochs.append(checkpoint_id)
+        removed = self.select_removed_checkpoints()
+        self.checkpoint_future = self.checkpoint_writer.submit(
+            self._write_checkpoint, checkpoint,
+            self.get_checkpoint_file(checkpoint_dir, checkpoint_id),
+            [self.get_checkpoint_file(checkpoint_dir, i) for i in removed])
+
+    @staticmethod
+    def _write_checkpoint(checkpoint, checkpoint_file, removed_files):
+        """Runs in the writer thread, an interrupted write leaves no checkpoint"""
+        torch.save(checkpoint, checkpoint_file + '.tmp')
+        os.replace(checkpoint_file + '.tmp', checkpoint_file)
+        for f in removed_files:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def wait_for_checkpoint(self):
+        """Wait until the last checkpoint is written, raises its exception"""
+        if self.checkpoint_future is not None:
+            self.checkpoint_future.result()
+            self.checkpoint_future = None
+
+    def select_removed_checkpoints(self):
+        """Apply the retention policy to checkpoint_epochs, return the removed epochs"""
+        if self.keep_last <= 0 and self.keep_best <= 0:
+            return []
+        epochs = sorted(self.checkpoint_epochs)
+        kept = set(epochs[-max(self.keep_last, 1):])
+        metrics = dict(zip(self.summaries.get('epoch', []),
+                           self.summaries.get(self.best_metric, [])))
+        ranked = sorted((e for e in epochs if e in metrics), key=lambda e: metrics[e],
+                        reverse=(self.best_mode == 'max'))
+        kept.update(ranked[:self.keep_best])
+        self.checkpoint_epochs = [e for e in epochs if e in kept]
+        return [e for e in epochs if e not in kept]
+
+    def load_checkpoint(self, checkpoint_file):
+        """Restore the model, optimizer and summaries, training resumes after its epoch"""
+        self.logger.info('Resuming from %s' % checkpoint_file)
+        # The checkpoint also holds the summaries and the RNG state, which newer
+        # torch versions only load with weights_only=False (torch < 1.13 has no such keyword)
+        load_args = dict(map_location=self.device)
+        if 'weights_only' in inspect.signature(torch.load).parameters:
+            load_args['weights_only'] = False
+        checkpoint = torch.load(checkpoint_file, **load_args)
+        model = getattr(self.model, 'module', self.model)
+        model.load_state_dict(checkpoint['model'])
+        if 'optimizer' in checkpoint and hasattr(self, 'optimizer'):
+            self.optimizer.load_state_dict(checkpoint['optimizer'])
+        if 'rng_state' in checkpoint:
+            torch.set_rng_state(checkpoint['rng_state'])
+        self.summaries = checkpoint.get('summaries', {})
+        self.start_epoch = checkpoint.get('epoch', -1) + 1
+        # The checkpoints written before are subject to the retention policy
+        checkpoint_dir = os.path.dirname(checkpoint_file)
+        self.checkpoint_epochs = [
+            i for i in range(self.start_epoch)
+            if os.path.exists(self.get_checkpoint_file(checkpoint_dir, i))]
+
+    def reduce_sums(self, *values):
+        """Sum the values (e.g. loss sums and counts) over all ranks"""
+        if not self.distributed:
+            return list(values)
+        values = torch.tensor(values, dtype=torch.float64)
+        dist.all_reduce(values, op=dist.ReduceOp.SUM)
+        return values.tolist()
 
     def build_model(self):
         """Virtual method to construct the model"""
@@ -69,10 +255,16 @@ class BaseTrainer(object):
     def train(self, train_data_loader, n_epochs, valid_data_loader=None):
         """Run the model training"""
 
+        self.start_profiler()
         # Loop over epochs
-        for i in range(n_epochs):
+        for i in range(self.start_epoch, n_epochs):
             self.logger.info('Epoch %i' % i)
             summary = dict(epoch=i)
+            # Reshuffle the (distributed or bucketed) training samples
+            for sampler in [train_data_loader.batch_sampler, train_data_loader.sampler]:
+                if hasattr(sampler, 'set_epoch'):
+                    sampler.set_epoch(i)
+                    break
             # Train on this epoch
             summary.update(self.train_epoch(train_data_loader))
             # Evaluate on this epoch
@@ -81,6 +273,19 @@ class BaseTrainer(object):
             # Save summary, checkpoint
             self.save_summary(summary)
             if self.output_dir is not None:
+                self.write_summary_log(summary)
                 self.write_checkpoint(checkpoint_id=i)
 
+        self.stop_profiler()
+        self.wait_for_checkpoint()
         return self.summaries
+
+def copy_state(state):
+    """Copy a (nested) state dict, with all tensors copied to the CPU"""
+    if isinstance(state, torch.Tensor):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {k: copy_state(v) for k, v in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(copy_state(v) for v in state)
+    return state
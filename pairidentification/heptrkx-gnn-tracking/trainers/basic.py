@@ -25,7 +25,7 @@ class BasicTrainer(BaseTrainer):
         """Instantiate our model"""
         self.model = get_model(name=model_type, **model_args).to(self.device)
         if self.distributed:
-            self.model = nn.parallel.DistributedDataParallelCPU(self.model)
+            self.model = nn.parallel.DistributedDataParallel(self.model)
         # TODO: add support for more optimizers and loss functions here
         opt_type = dict(Adam=torch.optim.Adam)[optimizer]
         self.optimizer = opt_type(self.model.parameters(), lr=learning_rate)
@@ -49,7 +49,9 @@ class BasicTrainer(BaseTrainer):
             self.optimizer.step()
             sum_loss += batch_loss.item()
         summary['train_time'] = time.time() - start_time
-        summary['train_loss'] = sum_loss / (i + 1)
+        # Average over the batches of all ranks
+        sum_loss, n_batches = self.reduce_sums(sum_loss, i + 1)
+        summary['train_loss'] = sum_loss / n_batches
         self.logger.debug(' Processed %i batches' % (i + 1))
         self.logger.info('  Training loss: %.3f' % summary['train_loss'])
         return summary
@@ -73,8 +75,10 @@ class BasicTrainer(BaseTrainer):
             _, batch_preds = torch.max(batch_output, 1)
             sum_correct += (batch_preds == batch_target).sum().item()
         summary['valid_time'] = time.time() - start_time
-        summary['valid_loss'] = sum_loss / (i + 1)
-        summary['valid_acc'] = sum_correct / len(data_loader.sampler)
+        sum_loss, n_batches, sum_correct, n_samples = self.reduce_sums(
+            sum_loss, i + 1, sum_correct, len(data_loader.sampler))
+        summary['valid_loss'] = sum_loss / n_batches
+        summary['valid_acc'] = sum_correct / n_samples
         self.logger.debug(' Processed %i samples in %i batches',
                           len(data_loader.sampler), i + 1)
         self.logger.info('  Validation loss: %.3f acc: %.3f' %
@@ -25,7 +25,7 @@ class GNNTrainer(BaseTrainer):
         """Instantiate our model"""
         self.model = get_model(name=model_type, **model_args).to(self.device)
         if self.distributed:
-            self.model = nn.parallel.DistributedDataParallelCPU(self.model)
+            self.model = nn.parallel.DistributedDataParallel(self.model)
         self.optimizer = getattr(torch.optim, optimizer)(
             self.model.parameters(), lr=learning_rate)
         self.loss_func = getattr(torch.nn, loss_func)()
@@ -35,33 +35,54 @@ class GNNTrainer(BaseTrainer):
         self.model.train()
         summary = dict()
         sum_loss = 0
+        n_edges = 0
+        self.phase_times = {}
         start_time = time.time()
         i_final = 0
+        dense = False
         # Loop over training batches
-        for i, (batch_input, batch_target) in enumerate(data_loader):
-            print('batch_input')
-            print(batch_input)
-            print(len(batch_input))
-            print(batch_input[0].size())
-            print(batch_input[1].size())
-            print(batch_input[2].size())
-            print('batch_target')
-            print(batch_target)
-            print(batch_target.size())
+        for i, (batch_input, batch_target) in enumerate(self.timed_batches(data_loader)):
             self.logger.debug('  batch %i', i)
-            batch_input = [a.to(self.device) for a in batch_input]
-            batch_target = batch_target.to(self.device)
-            self.model.zero_grad()
-            batch_output = self.model(batch_input)
-            batch_loss = self.loss_func(batch_output, batch_target)
-            batch_loss.backward()
-            self.optimizer.step()
+            n_edges += count_edges(batch_input)
+            dense = batch_input[1].dim() > 1
+            with self.timed('copy'):
+                batch_input = [a.to(self.device) for a in batch_input]
+                batch_target = batch_target.to(self.device)
+            with self.timed('forward'):
+                self.model.zero_grad()
+                batch_output = self.model(batch_input)
+                batch_loss = self.loss_func(batch_output, batch_target)
+            with self.timed('backward'):
+                batch_loss.backward()
+            with self.timed('optimizer'):
+                self.optimizer.step()
             sum_loss += batch_loss.item()
             i_final = i
+            self.profile_step()
         summary['train_time'] = time.time() - start_time
-        summary['train_loss'] = sum_loss / (i_final + 1)
+        for phase, phase_time in self.phase_times.items():
+            summary['train_%s_time' % phase] = phase_time
+        # Average over the batches of all ranks
+        n_graphs = len(data_loader.batch_sampler.sampler)
+        sum_loss, n_batches, n_graphs, n_edges = self.reduce_sums(
+            sum_loss, i_final + 1, n_graphs, n_edges)
+        summary['train_loss'] = sum_loss / n_batches
+        summary['train_graphs_per_s'] = n_graphs / summary['train_time']
+        summary['train_edges_per_s'] = n_edges / summary['train_time']
         self.logger.debug(' Processed %i batches' % (i_final + 1))
         self.logger.info('  Training loss: %.3f' % summary['train_loss'])
+        self.logger.info('  Time %.2fs: ' % summary['train_time'] +
+                         ', '.join('%s %.2fs' % p for p in self.phase_times.items()))
+        self.logger.info('  Throughput: %.1f graphs/s, %.0f edges/s' %
+                         (summary['train_graphs_per_s'], summary['train_edges_per_s']))
+        # Fraction of the padded batch matrices filled by real graphs, over
+        # all ranks (sparse batches are concatenated without padding)
+        padding_sums = getattr(data_loader.batch_sampler, 'padding_sums', None)
+        if padding_sums is not None and dense:
+            real, padded = self.reduce_sums(*padding_sums)
+            summary['train_padding_efficiency'] = real / max(padded, 1.)
+            self.logger.info('  Padding efficiency: %.3f' %
+                             summary['train_padding_efficiency'])
         return summary
 
     @torch.no_grad()
@@ -87,7 +108,9 @@ class GNNTrainer(BaseTrainer):
             sum_total += matches.numel()
             i_final = i
         summary['valid_time'] = time.time() - start_time
-        summary['valid_loss'] = sum_loss / (i_final + 1)
+        sum_loss, n_batches, sum_correct, sum_total = self.reduce_sums(
+            sum_loss, i_final + 1, sum_correct, sum_total)
+        summary['valid_loss'] = sum_loss / n_batches
         summary['valid_acc'] = sum_correct / (sum_total + 1e-10)
         self.logger.debug(' Processed %i samples in %i batches',
                           len(data_loader.sampler), i_final + 1)
@@ -95,6 +118,13 @@ class GNNTrainer(BaseTrainer):
                          (summary['valid_loss'], summary['valid_acc']))
         return summary
 
+def count_edges(batch_input):
+    """Number of edges of a batch, without the padding of dense batches"""
+    Ri = batch_input[1]
+    if Ri.dim() == 1:
+        return Ri.shape[0]
+    return int((Ri.sum(dim=1) > 0).sum())
+
 def _test():
     t = GNNTrainer(output_dir='./')
     t.build_model()